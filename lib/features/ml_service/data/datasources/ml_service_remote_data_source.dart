@@ -11,6 +11,11 @@ class MLServiceRemoteDataSourceImpl implements MLServiceRemoteDataSource {
   final Dio dio;
   final String baseUrl;
 
+  // Last drug list and its ETag per server, shared across screen loads.
+  // The server answers 304 without a body while the list is unchanged.
+  static final Map<String, String> _drugsEtags = {};
+  static final Map<String, List<String>> _cachedDrugs = {};
+
   MLServiceRemoteDataSourceImpl({
     required this.dio,
     this.baseUrl = 'http://localhost:8000',
@@ -38,11 +43,30 @@ class MLServiceRemoteDataSourceImpl implements MLServiceRemoteDataSource {
   @override
   Future<List<String>> getAvailableDrugs() async {
     try {
-      final response = await dio.get('$baseUrl/drugs');
+      final etag = _drugsEtags[baseUrl];
+      final response = await dio.get(
+        '$baseUrl/drugs',
+        options: Options(
+          headers: {
+            if (etag != null) 'If-None-Match': etag,
+          },
+          validateStatus: (status) => status == 200 || status == 304,
+        ),
+      );
 
+      final cached = _cachedDrugs[baseUrl];
+      if (response.statusCode == 304 && cached != null) {
+        return cached;
+      }
       if (response.statusCode == 200) {
         final data = response.data as Map<String, dynamic>;
-        return List<String>.from(data['drugs']);
+        final drugs = List<String>.from(data['drugs']);
+        final newEtag = response.headers.value('etag');
+        if (newEtag != null) {
+          _drugsEtags[baseUrl] = newEtag;
+          _cachedDrugs[baseUrl] = drugs;
+        }
+        return drugs;
       } else {
         throw Exception('Failed to get available drugs');
       }
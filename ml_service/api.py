@@ -1,11 +1,27 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel, Field
-from typing import Optional
-import joblib
-import uvicorn
+import time
+_imports_started = time.perf_counter()
+from fastapi import FastAPI, HTTPException, Body, Query, Request
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel, Field, ValidationError
+from typing import Optional, List, Any
 import os
-import numpy as np
+import threading
+from contextvars import ContextVar
 from fastapi.middleware.cors import CORSMiddleware
+from prediction_cache import PredictionCache
+from micro_batcher import MicroBatcher
+from inference_executor import InferenceExecutor, Admission, Overloaded
+from model_registry import ModelRegistry, FEATURE_COLUMNS
+from model_bundle import resolve_model_paths
+from startup_timing import StartupTimer
+from metrics import MetricsRegistry, NULL_CLOCK, CONTENT_TYPE
+from dosage_rules import DosageRules, ShadowComparator
+from synthetic_data import DRUGS_WITH_TYPICAL_DOSES, DRUGS, ROUTES, GENDERS, ADMISSION_TYPES, DIAGNOSES
+from catalog import Catalog
+
+# مراحل الإقلاع؛ /ready لا يعيد 200 قبل اكتمال التسخين
+startup = StartupTimer(started=_imports_started)
+startup.record("imports", time.perf_counter() - startup.started)
 
 app = FastAPI(title="MedLink Drug Dosage API", 
               description="واجهة برمجة تطبيقات متقدمة لتصنيف الجرعات الدوائية",
@@ -20,16 +36,150 @@ app.add_middleware(
     allow_headers=["*"],  # يسمح بكل الترويسات
 )
 
-# تحميل النموذج والمشفرات
-try:
-    model = joblib.load(r'D:\untitled6\ml_service\dosage_model.pkl')
-    encoders = joblib.load(r'D:\untitled6\ml_service\encoders.pkl')
-    print("Model and encoders loaded successfully")
-except Exception as e:
-    print(f"Error loading model: {str(e)}")
-    # تهيئة كـ None وفحص قبل التوقعات
-    model = None
-    encoders = None
+DEFAULT_WEIGHT = 70
+# الحد الأقصى لعدد المرضى في طلب دفعة واحد
+MAX_BATCH_SIZE = int(os.environ.get("MEDLINK_MAX_BATCH_SIZE", "1000"))
+# model: توقع دقيق بالنموذج، table: بحث في جدول القرارات المحسوب مسبقاً (عمر/وزن مُكمَّم)
+PREDICT_MODE = os.environ.get("MEDLINK_PREDICT_MODE", "model")
+# عدد threads المسموح لكل عملية عند التوقع (0 = إعدادات النموذج المحفوظة كما هي)
+INFERENCE_THREADS = int(os.environ.get("MEDLINK_INFERENCE_THREADS", "0"))
+# التحكم في القبول: عدد workers التوقع، أقصى عدد طلبات منتظرة، ومهلة الانتظار لكل طلب (0 = بلا حد)
+# الطلب الذي لا يتسع له الطابور أو لن يبدأ قبل المهلة يحصل على 503 مع Retry-After
+INFERENCE_WORKERS = int(os.environ.get("MEDLINK_INFERENCE_WORKERS", "2"))
+QUEUE_MAX = int(os.environ.get("MEDLINK_QUEUE_MAX", "64"))
+DEADLINE_MS = float(os.environ.get("MEDLINK_DEADLINE_MS", "1000"))
+# عند عدم وجود نموذج محمّل: التصنيف بقواعد الجرعة بدلاً من خطأ 500 (MEDLINK_RULES_FALLBACK=0 لتعطيله)
+RULES_FALLBACK = os.environ.get("MEDLINK_RULES_FALLBACK", "1") != "0"
+
+# قواعد تصنيف الجرعة (نفس قواعد فئات التدريب)؛ مقارن الظل يسجل اختلافها عن النموذج خارج مسار الطلب
+# MEDLINK_SHADOW_RULES=0 لتعطيله، MEDLINK_SHADOW_LOG لكتابة الاختلافات في ملف JSON lines
+rules = DosageRules()
+shadow = ShadowComparator(
+    rules,
+    max_queue=int(os.environ.get("MEDLINK_SHADOW_QUEUE", "1000")),
+    log_path=os.environ.get("MEDLINK_SHADOW_LOG")
+) if os.environ.get("MEDLINK_SHADOW_RULES", "1") != "0" else None
+
+# dosage_model.bundle بجانب الكود إن وجدت وإلا dosage_model.pkl + encoders.pkl
+# (أو MEDLINK_MODEL_PATH / MEDLINK_ENCODERS_PATH)
+MODEL_PATH, ENCODERS_PATH = resolve_model_paths()
+
+# ذاكرة مؤقتة لنتائج التوقع - MEDLINK_CACHE_SIZE=0 لتعطيلها
+prediction_cache = PredictionCache(
+    max_size=int(os.environ.get("MEDLINK_CACHE_SIZE", "10000")),
+    ttl_seconds=float(os.environ.get("MEDLINK_CACHE_TTL", "300"))
+)
+
+# سجل إصدارات النموذج؛ كل طلب يأخذ الإصدار النشط مرة واحدة ويكمل عليه
+registry = ModelRegistry(
+    keep=int(os.environ.get("MEDLINK_MODEL_KEEP", "2")),
+    # النتائج المخزنة تخص النموذج السابق
+    on_activate=lambda version: prediction_cache.reset(version.version),
+    predict_mode=PREDICT_MODE,
+    inference_threads=INFERENCE_THREADS,
+    tree_export_path=os.environ.get("MEDLINK_TREE_EXPORT"),
+    decision_table_path=os.environ.get("MEDLINK_DECISION_TABLE")
+)
+
+# مقاييس Prometheus على /metrics - MEDLINK_METRICS=0 لتعطيل قياس المراحل
+metrics = MetricsRegistry(enabled=os.environ.get("MEDLINK_METRICS", "1") != "0")
+stage_seconds = metrics.histogram(
+    "medlink_stage_seconds", "Time spent in each stage of a request", ("handler", "stage"))
+request_seconds = metrics.histogram(
+    "medlink_request_seconds", "Request latency from the first byte received to the response start", ("handler",))
+requests_total = metrics.counter(
+    "medlink_requests_total", "Requests by handler, outcome and active model version", ("handler", "outcome", "model_version"))
+inference_wait_seconds = metrics.histogram(
+    "medlink_inference_wait_seconds", "Time admitted work waited before an inference worker started it", ("pool",))
+metrics.gauge("medlink_cache_entries", "Entries in the prediction cache", lambda: prediction_cache.stats()["size"])
+metrics.gauge("medlink_cache_lookups_total", "Prediction cache lookups by result",
+              lambda: {("hit",): prediction_cache.hits, ("miss",): prediction_cache.misses},
+              ("result",), kind="counter")
+metrics.gauge("medlink_startup_ready_seconds", "Seconds from import to readiness", lambda: startup.ready_seconds)
+if shadow is not None:
+    metrics.gauge("medlink_rules_shadow_rows_total", "Model predictions compared with the dosage rules by outcome",
+                  lambda: {(outcome,): count for outcome, count in shadow.totals().items()},
+                  ("outcome",), kind="counter")
+    metrics.gauge("medlink_rules_shadow_dropped_total", "Rows skipped because the shadow queue was full",
+                  lambda: shadow.dropped, kind="counter")
+# /predict بدون تجميع و /predict/batch (التجميع له طابوره الخاص بنفس الحدود، انظر micro_batcher)
+executor = InferenceExecutor(
+    max_workers=INFERENCE_WORKERS,
+    max_queue=QUEUE_MAX,
+    deadline_ms=DEADLINE_MS,
+    wait_observer=lambda seconds: inference_wait_seconds.observe(("executor",), seconds)
+)
+
+# ساعة مراحل الطلب الحالي (يضعها MetricsMiddleware)
+request_clock = ContextVar("request_clock", default=NULL_CLOCK)
+
+class MetricsMiddleware:
+    """زمن الطلب ومراحله ونتيجته؛ ASGI مباشر لأن BaseHTTPMiddleware يضيف كلفة لكل طلب"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not metrics.enabled:
+            await self.app(scope, receive, send)
+            return
+        clock = metrics.clock()
+        start = clock.last
+        token = request_clock.set(clock)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                elapsed = time.perf_counter() - start
+                if clock.laps:
+                    clock.lap("response_serialization")
+                record_request(scope, clock, status, elapsed)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        except Exception:
+            # الاستثناء غير المعالج يتحول إلى 500 في ServerErrorMiddleware خارج هذه الطبقة
+            record_request(scope, clock, 500, time.perf_counter() - start)
+            raise
+        finally:
+            request_clock.reset(token)
+
+def record_request(scope, clock, status, elapsed):
+    # اسم دالة المسار بدلاً من المسار الخام حتى لا تتضخم التسميات (/admin/models/{version}/...)
+    handler = getattr(scope.get("endpoint"), "__name__", "unmatched")
+    request_seconds.observe((handler,), elapsed)
+    stage_seconds.observe_laps((handler,), clock.laps)
+    outcome = "success" if status < 400 else "client_error" if status < 500 else "server_error"
+    runtime = registry.current()
+    requests_total.inc((handler, outcome, runtime.version if runtime is not None else "none"))
+
+app.add_middleware(MetricsMiddleware)
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request, exc):
+    """رفض الحمل الزائد: 503 مع Retry-After بدلاً من طابور بلا حد"""
+    return JSONResponse(status_code=503, content={"detail": str(exc), "reason": exc.reason},
+                        headers={"Retry-After": str(exc.retry_after)})
+
+def load_model(model_path, encoders_path):
+    """تحميل النموذج والمشفرات وتفعيلهما؛ يعيد الإصدار أو None عند الفشل"""
+    try:
+        version = registry.load(model_path, encoders_path)
+        print("Model and encoders loaded successfully")
+        return version
+    except Exception as e:
+        print(f"Error loading model: {str(e)}")
+        return None
+
+def current_model():
+    """الإصدار النشط؛ None يعني التصنيف بالقواعد، وخطأ 500 إذا لم يُحمَّل نموذج والبديل معطل"""
+    runtime = registry.current()
+    if runtime is None and not RULES_FALLBACK:
+        raise HTTPException(status_code=500, detail="Model not loaded")
+    return runtime
 
 class PatientData(BaseModel):
     age: float = Field(..., description="عمر المريض", example=65)
@@ -46,165 +196,505 @@ class DosagePrediction(BaseModel):
     confidence: float = Field(..., description="مستوى الثقة في التوقع")
     recommendation: str = Field(..., description="التوصية")
     normal_range: Optional[str] = Field(None, description="النطاق الطبيعي للدواء")
+    source: str = Field("model", description="مصدر التصنيف: model أو rules (قواعد الجرعة دون احتمال، confidence = 0)")
+
+class BatchPredictionItem(BaseModel):
+    index: int = Field(..., description="ترتيب المريض في الطلب")
+    prediction: Optional[DosagePrediction] = Field(None, description="نتيجة التوقع عند النجاح")
+    error: Optional[str] = Field(None, description="سبب رفض هذا السجل")
+
+class BatchPredictionResponse(BaseModel):
+    predictions: List[BatchPredictionItem]
+    n_succeeded: int = Field(..., description="عدد السجلات التي تم توقعها")
+    n_failed: int = Field(..., description="عدد السجلات المرفوضة")
+
+DOSAGE_LABELS = {0: "Low dose", 1: "Medium-low dose", 2: "Medium-high dose", 3: "High dose"}
+
+RECOMMENDATIONS = {
+    0: "الجرعة منخفضة. يجب متابعة فعالية العلاج والنظر في زيادة الجرعة إذا لم يكن هناك استجابة مناسبة.",
+    1: "الجرعة متوسطة-منخفضة. جرعة آمنة في معظم الحالات مع الحاجة إلى مراقبة الفعالية.",
+    2: "الجرعة متوسطة-مرتفعة. مراقبة المريض للآثار الجانبية المحتملة مع الحفاظ على فعالية العلاج.",
+    3: "الجرعة مرتفعة. توخي الحذر ومراقبة المريض بعناية للتفاعلات السلبية والآثار الجانبية."
+}
 
 @app.get("/")
 def read_root():
     return {"message": "MedLink Drug Dosage API is running", "status": "active"}
 
-@app.post("/predict", response_model=DosagePrediction)
-def predict_dosage(data: PatientData):
-    if model is None or encoders is None:
-        raise HTTPException(status_code=500, detail="Model not loaded")
-    
+def encode_patient(data, runtime, clock=NULL_CLOCK):
+    """ترميز بيانات المريض والتحقق من القيم التصنيفية
+
+    يعيد (الميزات, رموز التشفير, قائمة الأخطاء)
+    """
+    category_codes = runtime.category_codes
+    drug_codes = category_codes.get('drug', {})
+    drug = data.drug
+    if drug not in drug_codes:
+        # محاولة العثور على أقرب دواء
+        drug = runtime.drug_index.resolve(data.drug)
+        clock.lap("drug_match")
+
+    drug_encoded = drug_codes.get(drug, -1) if drug else -1
+    route_encoded = category_codes.get('route', {}).get(data.route, -1)
+    gender_encoded = category_codes.get('gender', {}).get(data.gender, -1)
+    admission_encoded = category_codes.get('admission', {}).get(data.admission_type, -1)
+
+    # فحص القيم غير المعروفة
+    missing_features = []
+    if drug_encoded == -1:
+        missing_features.append(f"Drug '{data.drug}' not recognized")
+    if route_encoded == -1:
+        missing_features.append(f"Route '{data.route}' not recognized")
+    if gender_encoded == -1:
+        missing_features.append(f"Gender '{data.gender}' not recognized")
+    if admission_encoded == -1:
+        missing_features.append(f"Admission type '{data.admission_type}' not recognized")
+    clock.lap("encoder_checks")
+    if missing_features:
+        return None, None, missing_features
+
+    # التشخيص اختياري والقيم غير المعروفة يتجاهلها OneHotEncoder
+    feature_dict = {
+        'age': data.age,
+        'weight': data.weight if data.weight else DEFAULT_WEIGHT,  # قيمة افتراضية
+        'drug': drug,
+        'route': data.route,
+        'gender': data.gender,
+        'admission_type': data.admission_type,
+        'diagnosis': data.diagnosis if data.diagnosis else "Not specified"
+    }
+    codes = [data.age, drug_encoded, route_encoded, gender_encoded, admission_encoded]
+    clock.lap("feature_assembly")
+    return feature_dict, codes, []
+
+def cache_key(feature_dict, runtime):
+    """مفتاح الذاكرة المؤقتة: إصدار النموذج وقيم الميزات بعد التطبيع بترتيب الأعمدة"""
+    return (runtime.version,) + tuple(feature_dict[column] for column in FEATURE_COLUMNS)
+
+def build_prediction(data, drug, prediction, confidence, runtime, clock=NULL_CLOCK, source="model"):
+    """توليد تسمية الجرعة والتوصية لمريض واحد (runtime = None لنتيجة القواعد)"""
+    # استخراج نطاق الجرعة الطبيعي للدواء المحدد إذا كان متاحا
+    encoders = runtime.encoders if runtime is not None else {'drug_info': DRUGS_WITH_TYPICAL_DOSES}
+    normal_range = None
+    if 'drug_info' in encoders and drug in encoders['drug_info']:
+        drug_info = encoders['drug_info'][drug]
+        normal_range = f"{drug_info['min']} - {drug_info['max']} {drug_info['unit']}"
+
+    # إضافة توصيات إضافية حسب العمر
+    age_specific = ""
+    if data.age < 18:
+        age_specific = " (يجب مراعاة تعديلات الجرعة للأطفال)"
+    elif data.age > 65:
+        age_specific = " (قد يحتاج كبار السن إلى جرعات مخفضة)"
+
+    # دمج التوصيات
+    final_recommendation = RECOMMENDATIONS[prediction] + age_specific
+
+    result = DosagePrediction(
+        dosage_class=prediction,
+        dosage_label=DOSAGE_LABELS[prediction],
+        confidence=confidence,
+        recommendation=final_recommendation,
+        normal_range=normal_range,
+        source=source
+    )
+    clock.lap("response_building")
+    return result
+
+def prepare_patient(data, runtime, clock=NULL_CLOCK):
+    """التحقق من المريض وترميزه والبحث في الذاكرة المؤقتة
+
+    يعيد (الميزات, رموز التشفير, مفتاح الذاكرة, النتيجة المخزنة أو None)
+    """
+    feature_dict, codes, missing_features = encode_patient(data, runtime, clock)
+    if missing_features:
+        raise HTTPException(status_code=400, detail=f"Unknown category values: {', '.join(missing_features)}")
+
+    key = cache_key(feature_dict, runtime)
+    cached = prediction_cache.get(key)
+    clock.lap("cache_lookup")
+    return feature_dict, codes, key, cached
+
+def finish_prediction(data, feature_dict, key, prediction, confidence, runtime, clock=NULL_CLOCK):
+    result = build_prediction(data, feature_dict['drug'], prediction, confidence, runtime, clock)
+    prediction_cache.put(key, result)
+    if shadow is not None:
+        shadow.submit(runtime.version, [feature_dict], [prediction])
+    return result
+
+def rules_prediction(data, clock=NULL_CLOCK):
+    """تصنيف مريض واحد بقواعد الجرعة (دون نموذج)؛ نفس التحقق من القيم التصنيفية"""
+    drug = data.drug if data.drug in rules.drug_doses else rules.drug_index.resolve(data.drug)
+    missing_features = []
+    if drug is None:
+        missing_features.append(f"Drug '{data.drug}' not recognized")
+    if data.route not in ROUTES:
+        missing_features.append(f"Route '{data.route}' not recognized")
+    if data.gender not in GENDERS:
+        missing_features.append(f"Gender '{data.gender}' not recognized")
+    if data.admission_type not in ADMISSION_TYPES:
+        missing_features.append(f"Admission type '{data.admission_type}' not recognized")
+    if missing_features:
+        raise HTTPException(status_code=400, detail=f"Unknown category values: {', '.join(missing_features)}")
+
+    prediction = rules.classify_row({
+        'age': data.age,
+        'weight': data.weight if data.weight else DEFAULT_WEIGHT,
+        'drug': drug,
+        'route': data.route,
+        'admission_type': data.admission_type,
+        'diagnosis': data.diagnosis if data.diagnosis else "Not specified"
+    })
+    clock.lap("rules")
+    return build_prediction(data, drug, prediction, 0.0, None, clock, source="rules")
+
+def predict_dosage(data, clock=NULL_CLOCK):
+    """توقع متزامن لمريض واحد (بدون تجميع في دفعات)"""
+    clock.lap("threadpool_wait")
+    runtime = current_model()
+    if runtime is None:
+        return rules_prediction(data, clock)
+    feature_dict, codes, key, cached = prepare_patient(data, runtime, clock)
+    if cached is not None:
+        return cached
+
     try:
-        # استخراج الميزات
-        features = {}
-        
-        # الميزات العددية
-        features['age'] = data.age
-        features['weight'] = data.weight if data.weight else 70  # قيمة افتراضية
-
-        # التشفير للبيانات التصنيفية
-        try:
-            drug_encoded = -1
-            if data.drug in encoders['drug'].classes_:
-                drug_encoded = encoders['drug'].transform([data.drug])[0]
-            else:
-                # محاولة العثور على أقرب دواء
-                closest_drug = find_closest_match(data.drug, list(encoders['drug'].classes_))
-                if closest_drug:
-                    drug_encoded = encoders['drug'].transform([closest_drug])[0]
-            
-            route_encoded = encoders['route'].transform([data.route])[0] if data.route in encoders['route'].classes_ else -1
-            gender_encoded = encoders['gender'].transform([data.gender])[0] if data.gender in encoders['gender'].classes_ else -1
-            admission_encoded = encoders['admission'].transform([data.admission_type])[0] if data.admission_type in encoders['admission'].classes_ else -1
-            
-            # التشخيص اختياري
-            diagnosis_encoded = -1
-            if data.diagnosis and 'diagnosis' in encoders:
-                if data.diagnosis in encoders['diagnosis'].classes_:
-                    diagnosis_encoded = encoders['diagnosis'].transform([data.diagnosis])[0]
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Error encoding features: {str(e)}")
-        
-        # فحص القيم غير المعروفة
-        if -1 in [drug_encoded, route_encoded, gender_encoded, admission_encoded]:
-            missing_features = []
-            if drug_encoded == -1:
-                missing_features.append(f"Drug '{data.drug}' not recognized")
-            if route_encoded == -1:
-                missing_features.append(f"Route '{data.route}' not recognized")
-            if gender_encoded == -1:
-                missing_features.append(f"Gender '{data.gender}' not recognized")
-            if admission_encoded == -1:
-                missing_features.append(f"Admission type '{data.admission_type}' not recognized")
-            
-            raise HTTPException(status_code=400, detail=f"Unknown category values: {', '.join(missing_features)}")
-        
-        # إنشاء مصفوفة الميزات
-        if hasattr(model, 'predict_proba'):
-            # نموذج يدعم احتمالات التوقع
-            # إنشاء المصفوفة بالبنية المطلوبة
-            feature_dict = {
-                'age': data.age,
-                'weight': features['weight'],
-                'drug': data.drug,
-                'route': data.route,
-                'gender': data.gender,
-                'admission_type': data.admission_type,
-                'diagnosis': data.diagnosis if data.diagnosis else "Not specified"
-            }
-            
-            # حصول على التوقع
-            import pandas as pd
-            feature_df = pd.DataFrame([feature_dict])
-            prediction = model.predict(feature_df)[0]
-            probabilities = model.predict_proba(feature_df)[0]
-            confidence = probabilities[prediction]
-        else:
-            # طريقة احتياطية للنماذج البسيطة
-            features_array = [[data.age, drug_encoded, route_encoded, gender_encoded, admission_encoded]]
-            prediction = model.predict(features_array)[0]
-            confidence = 0.8  # قيمة افتراضية
-        
-        # توليد تسمية الجرعة والتوصية
-        dosage_labels = {0: "Low dose", 1: "Medium-low dose", 2: "Medium-high dose", 3: "High dose"}
-        
-        recommendations = {
-            0: "الجرعة منخفضة. يجب متابعة فعالية العلاج والنظر في زيادة الجرعة إذا لم يكن هناك استجابة مناسبة.",
-            1: "الجرعة متوسطة-منخفضة. جرعة آمنة في معظم الحالات مع الحاجة إلى مراقبة الفعالية.",
-            2: "الجرعة متوسطة-مرتفعة. مراقبة المريض للآثار الجانبية المحتملة مع الحفاظ على فعالية العلاج.",
-            3: "الجرعة مرتفعة. توخي الحذر ومراقبة المريض بعناية للتفاعلات السلبية والآثار الجانبية."
-        }
-        
-        # استخراج نطاق الجرعة الطبيعي للدواء المحدد إذا كان متاحا
-        normal_range = None
-        if 'drug_info' in encoders and data.drug in encoders['drug_info']:
-            drug_info = encoders['drug_info'][data.drug]
-            normal_range = f"{drug_info['min']} - {drug_info['max']} {drug_info['unit']}"
-        
-        # إضافة توصيات إضافية حسب العمر
-        age_specific = ""
-        if data.age < 18:
-            age_specific = " (يجب مراعاة تعديلات الجرعة للأطفال)"
-        elif data.age > 65:
-            age_specific = " (قد يحتاج كبار السن إلى جرعات مخفضة)"
-        
-        # دمج التوصيات
-        final_recommendation = recommendations[prediction] + age_specific
-        
-        return DosagePrediction(
-            dosage_class=int(prediction),
-            dosage_label=dosage_labels[prediction],
-            confidence=float(confidence),
-            recommendation=final_recommendation,
-            normal_range=normal_range
-        )
-        
+        predictions, confidences = runtime.predict_rows([feature_dict], [codes], clock)
+        return finish_prediction(data, feature_dict, key, predictions[0], confidences[0], runtime, clock)
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
 
+def warm_up_request_path(runtime):
+    """تمرير مريض اصطناعي عبر مسار الطلب كاملاً (pydantic، حل اسم الدواء، بناء الاستجابة)"""
+    feature_rows, _ = runtime.synthetic_rows(1)
+    row = feature_rows[0]
+    data = PatientData(age=row['age'], weight=row['weight'], drug=str(row['drug']), route=str(row['route']),
+                       gender=str(row['gender']), admission_type=str(row['admission_type']))
+    feature_dict, codes, _ = encode_patient(data, runtime)
+    predictions, confidences = runtime.predict_rows([feature_dict], [codes])
+    build_prediction(data, feature_dict['drug'], predictions[0], confidences[0], runtime)
+
+def start_up():
+    """تحميل النموذج وتسخينه ثم إعلان الجاهزية"""
+    runtime = load_model(MODEL_PATH, ENCODERS_PATH)
+    if runtime is None:
+        startup.mark_failed("Model not loaded")
+        return
+    for name, seconds in runtime.timer.phases.items():
+        startup.record(name, seconds)
+    try:
+        with startup.phase("warm_up_request_path"):
+            warm_up_request_path(runtime)
+    except Exception as e:
+        # التسخين تحسين فقط - لا يمنع الخدمة إذا فشل لمريض اصطناعي
+        print(f"Request path warm-up skipped: {str(e)}")
+    startup.mark_ready()
+    print(f"Ready in {startup.ready_seconds:.2f}s: " +
+          ", ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in startup.phases.items()))
+
+def predict_queued_rows(items):
+    """دالة المُجدوِل: items قائمة (بيانات المريض, ساعة الطلب) من طلبات متزامنة مختلفة
+
+    كل العمل لكل طلب (حل اسم الدواء، الترميز، الذاكرة المؤقتة، بناء الاستجابة) يتم هنا على worker
+    التوقع وليس على حلقة الأحداث؛ الدفعة كلها تُقيَّم بالإصدار النشط عند بدايتها.
+    يعيد لكل طلب الاستجابة أو HTTPException خاصاً به
+    """
+    results = [None] * len(items)
+    runtime = registry.current()
+    pending = []
+    for i, (data, clock) in enumerate(items):
+        # الانتظار في طابور التجميع
+        clock.lap("micro_batch_wait")
+        try:
+            if runtime is None:
+                results[i] = rules_prediction(data, clock) if RULES_FALLBACK else \
+                    HTTPException(status_code=500, detail="Model not loaded")
+                continue
+            feature_dict, codes, key, cached = prepare_patient(data, runtime, clock)
+        except HTTPException as e:
+            results[i] = e
+            continue
+        if cached is not None:
+            results[i] = cached
+            continue
+        pending.append((i, data, feature_dict, codes, key, clock))
+
+    if pending:
+        batch_clock = metrics.clock()
+        try:
+            predictions, confidences = runtime.predict_rows([p[2] for p in pending], [p[3] for p in pending], batch_clock)
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            error = HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
+            for p in pending:
+                results[p[0]] = error
+            return results
+        # مراحل النموذج تُسجل مرة لكل دفعة وليس لكل طلب
+        stage_seconds.observe_laps(("micro_batch",), batch_clock.laps)
+        for (i, data, feature_dict, _, key, clock), prediction, confidence in zip(pending, predictions, confidences):
+            clock.lap("micro_batch")
+            results[i] = build_prediction(data, feature_dict['drug'], prediction, confidence, runtime, clock)
+            prediction_cache.put(key, results[i])
+        if shadow is not None:
+            shadow.submit(runtime.version, [p[2] for p in pending], predictions)
+    return results
+
+# تجميع الطلبات المتزامنة - MEDLINK_MICROBATCH_MAX=0 لتعطيله
+MICROBATCH_MAX = int(os.environ.get("MEDLINK_MICROBATCH_MAX", "64"))
+micro_batcher = MicroBatcher(
+    predict_queued_rows,
+    max_batch_size=MICROBATCH_MAX,
+    max_wait_ms=float(os.environ.get("MEDLINK_MICROBATCH_WAIT_MS", "2")),
+    admission=Admission(QUEUE_MAX, DEADLINE_MS,
+                        wait_observer=lambda seconds: inference_wait_seconds.observe(("micro_batch",), seconds))
+) if MICROBATCH_MAX > 1 else None
+
+def admission_pools():
+    """(اسم المجمّع, Admission) لكل طابور توقع"""
+    pools = [("executor", executor.admission)]
+    if micro_batcher is not None:
+        pools.append(("micro_batch", micro_batcher.admission))
+    return pools
+
+metrics.gauge("medlink_inference_queue_length", "Admitted requests waiting for an inference worker",
+              lambda: {(name,): admission.waiting for name, admission in admission_pools()}, ("pool",))
+metrics.gauge("medlink_inference_running", "Requests being scored by inference workers",
+              lambda: {(name,): admission.running for name, admission in admission_pools()}, ("pool",))
+metrics.gauge("medlink_inference_shed_total", "Requests rejected with 503 by admission control",
+              lambda: {(name, reason): count for name, admission in admission_pools()
+                       for reason, count in admission.stats()["shed"].items()},
+              ("pool", "reason"), kind="counter")
+
+if micro_batcher is not None:
+    metrics.gauge("medlink_microbatch_queue_length", "Requests waiting for the inference thread",
+                  lambda: micro_batcher.stats()["queue_length"])
+    metrics.gauge("medlink_microbatch_items_total", "Requests scored through the micro-batcher",
+                  lambda: micro_batcher.items, kind="counter")
+    metrics.gauge("medlink_microbatch_batches_total", "Model calls made by the micro-batcher",
+                  lambda: micro_batcher.batches, kind="counter")
+
+# تحميل النموذج والمشفرات؛ MEDLINK_BACKGROUND_LOAD=1 يفتح المنفذ فوراً ويحمّل في الخلفية
+# (/health يستجيب أثناء التحميل و /ready يعيد 503 حتى يكتمل التسخين)
+if os.environ.get("MEDLINK_BACKGROUND_LOAD", "0") == "1":
+    threading.Thread(target=start_up, name="model-startup", daemon=True).start()
+else:
+    start_up()
+
+@app.post("/predict", response_model=DosagePrediction)
+async def predict_dosage_endpoint(data: PatientData):
+    clock = request_clock.get()
+    # قراءة الجسم وتحليل JSON والتحقق عبر pydantic تتم قبل استدعاء الدالة
+    clock.lap("validation")
+    if micro_batcher is None:
+        return await executor.run(predict_dosage, data, clock)
+
+    # الترميز والذاكرة المؤقتة وبناء الاستجابة على worker التوقع (predict_queued_rows)
+    return await micro_batcher.submit((data, clock))
+
+@app.post("/predict/rules", response_model=DosagePrediction)
+async def predict_dosage_rules_endpoint(data: PatientData):
+    """التصنيف بقواعد الجرعة فقط (بدون النموذج)؛ الجرعة تُقدَّر من عمر المريض ووزنه ونوع الدخول"""
+    clock = request_clock.get()
+    clock.lap("validation")
+    return rules_prediction(data, clock)
+
+@app.post("/predict/batch", response_model=BatchPredictionResponse)
+async def predict_dosage_batch_endpoint(items: List[Any] = Body(..., description="قائمة بيانات المرضى بنفس صيغة /predict")):
+    """توقع الجرعات لمجموعة من المرضى باستدعاء واحد للنموذج
+
+    السجلات غير الصالحة تحصل على خطأ خاص بها دون إفشال الطلب بالكامل
+    """
+    # الساعة تُمرر صراحة لأن threadpool لا ينقل contextvars في كل إصدارات anyio
+    clock = request_clock.get()
+    clock.lap("validation")
+    return await executor.run(predict_dosage_batch, items, clock)
+
+def predict_dosage_batch(items, clock=NULL_CLOCK):
+    # مراحل التحقق والترميز والبحث في الذاكرة تُسجل لكل سجل؛ التحويل والمصنف مرة لكل طلب
+    clock.lap("threadpool_wait")
+    runtime = current_model()
+    if len(items) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch too large: {len(items)} > {MAX_BATCH_SIZE}")
+
+    results = [BatchPredictionItem(index=i) for i in range(len(items))]
+    # السجلات الصالحة غير الموجودة في الذاكرة المؤقتة
+    pending = []
+    n_succeeded = 0
+    for i, item in enumerate(items):
+        try:
+            if not isinstance(item, dict):
+                raise TypeError("Patient record must be a JSON object")
+            data = PatientData(**item)
+        except (ValidationError, TypeError) as e:
+            results[i].error = f"Invalid patient data: {str(e)}"
+            continue
+        finally:
+            clock.lap("validation")
+
+        if runtime is None:
+            try:
+                results[i].prediction = rules_prediction(data, clock)
+                n_succeeded += 1
+            except HTTPException as e:
+                results[i].error = e.detail
+            continue
+
+        feature_dict, codes, missing_features = encode_patient(data, runtime, clock)
+        if missing_features:
+            results[i].error = f"Unknown category values: {', '.join(missing_features)}"
+            continue
+        n_succeeded += 1
+        key = cache_key(feature_dict, runtime)
+        cached = prediction_cache.get(key)
+        clock.lap("cache_lookup")
+        if cached is not None:
+            results[i].prediction = cached
+            continue
+        pending.append((i, data, feature_dict, codes, key))
+
+    if pending:
+        try:
+            predictions, confidences = runtime.predict_rows([p[2] for p in pending], [p[3] for p in pending], clock)
+            for (i, data, feature_dict, _, key), prediction, confidence in zip(pending, predictions, confidences):
+                results[i].prediction = build_prediction(data, feature_dict['drug'], prediction, confidence, runtime, clock)
+                prediction_cache.put(key, results[i].prediction)
+            if shadow is not None:
+                shadow.submit(runtime.version, [p[2] for p in pending], predictions)
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
+
+    return BatchPredictionResponse(
+        predictions=results,
+        n_succeeded=n_succeeded,
+        n_failed=len(items) - n_succeeded
+    )
+
 @app.get("/health")
 def health_check():
-    if model is None or encoders is None:
+    """فحص الحياة: العملية تعمل (لا يعني أنها جاهزة لاستقبال الطلبات)"""
+    runtime = registry.current()
+    if runtime is None:
+        if startup.state == "starting":
+            return {"status": "starting", "message": "Model is loading"}
         return {"status": "error", "message": "Model not loaded"}
-    return {"status": "ok", "message": "Service is healthy"}
+    return {"status": "ok", "message": "Service is healthy", "model_version": runtime.version}
+
+@app.get("/ready")
+def readiness_check():
+    """فحص الجاهزية: 200 فقط بعد تحميل النموذج وتسخينه، مع زمن كل مرحلة من مراحل الإقلاع"""
+    report = startup.report()
+    runtime = registry.current()
+    if not startup.ready or runtime is None:
+        return JSONResponse(status_code=503, content=dict(report, ready=False))
+    return dict(report, ready=True, model_version=runtime.version)
+
+class ReloadRequest(BaseModel):
+    model_path: Optional[str] = Field(None, description="مسار حزمة النموذج أو ملفه (الافتراضي: المسار المُعدّ)")
+    encoders_path: Optional[str] = Field(None, description="مسار ملف المشفرات (الافتراضي: المسار المُعدّ؛ لا يلزم مع الحزمة)")
+
+@app.post("/admin/models/reload", status_code=202)
+def reload_model(request: Optional[ReloadRequest] = None):
+    """تحميل إصدار جديد وتسخينه في الخلفية ثم تبديله دون إيقاف الخدمة"""
+    request = request or ReloadRequest()
+    model_path = request.model_path or MODEL_PATH
+    encoders_path = request.encoders_path or (None if request.model_path else ENCODERS_PATH)
+    if not registry.reload_async(model_path, encoders_path):
+        raise HTTPException(status_code=409, detail="A model reload is already in progress")
+    return {"status": "loading", "model_path": model_path}
+
+@app.get("/admin/models")
+def list_model_versions():
+    """الإصدارات المحمّلة في الذاكرة مع زمن التحميل والتسخين وحالة آخر تحميل"""
+    return {"versions": registry.versions(), "reload": registry.reload_status}
+
+@app.post("/admin/models/{version}/activate")
+def activate_model_version(version: str):
+    """التراجع الفوري إلى إصدار ما زال محمّلاً"""
+    try:
+        runtime = registry.activate(version)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Model version '{version}' is not resident")
+    return {"status": "active", "model_version": runtime.version}
+
+@app.get("/batching/stats")
+def batching_stats():
+    """توزيع أحجام الدفعات وزمن الانتظار في طابور التوقع"""
+    if micro_batcher is None:
+        return {"enabled": False}
+    return {"enabled": True, **micro_batcher.stats()}
+
+@app.get("/rules/shadow/stats")
+def rules_shadow_stats():
+    """نسبة اتفاق النموذج مع قواعد الجرعة وآخر الحالات المختلفة"""
+    if shadow is None:
+        return {"enabled": False}
+    return {"enabled": True, **shadow.stats()}
+
+@app.get("/inference/stats")
+def inference_stats():
+    """طول طوابير التوقع وزمن الخدمة وعدد الطلبات المرفوضة لكل سبب"""
+    return {name: admission.stats() for name, admission in admission_pools()}
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """المقاييس بصيغة Prometheus النصية"""
+    return Response(content=metrics.render(), media_type=CONTENT_TYPE)
+
+@app.get("/cache/stats")
+def cache_stats():
+    """إحصائيات الذاكرة المؤقتة للتوقعات"""
+    return prediction_cache.stats()
+
+@app.get("/drugs/search")
+def search_drugs(q: str = Query(..., min_length=1, description="بداية اسم الدواء أو جزء منه"),
+                 limit: int = Query(10, ge=1, le=50)):
+    """الإكمال التلقائي لأسماء الأدوية"""
+    runtime = registry.current()
+    if runtime is not None:
+        drug_index = runtime.drug_index
+    elif RULES_FALLBACK:
+        # بدون نموذج: أسماء أدوية قواعد الجرعة (نفس قائمة /drugs و /catalog)
+        drug_index = rules.drug_index
+    else:
+        raise HTTPException(status_code=500, detail="Encoders not loaded")
+    return {"query": q, "results": drug_index.search(q, limit)}
+
+# كتالوج قواعد الجرعة عندما لا يكون هناك نموذج (نفس القيم التي يقبلها rules_prediction)
+rules_catalog = Catalog(None, {'drugs': sorted(DRUGS), 'routes': sorted(ROUTES), 'genders': sorted(GENDERS),
+                               'admission_types': sorted(ADMISSION_TYPES), 'diagnoses': sorted(DIAGNOSES)},
+                        DRUGS_WITH_TYPICAL_DOSES, source="rules")
+
+def catalog_response(name, request):
+    """مستند الكتالوج المسلسل مسبقاً للإصدار النشط، أو 304 إذا كان لدى العميل نفس النسخة"""
+    runtime = registry.current()
+    if runtime is not None:
+        catalog = runtime.catalog
+    elif RULES_FALLBACK:
+        catalog = rules_catalog
+    else:
+        raise HTTPException(status_code=500, detail="Encoders not loaded")
+    if name == 'drugs' and not catalog.payload['drugs']:
+        raise HTTPException(status_code=500, detail="Drug information not available")
+    status, body, headers = catalog.document(name).respond(
+        request.headers.get('if-none-match'), request.headers.get('accept-encoding'))
+    return Response(content=body, status_code=status,
+                    media_type="application/json" if status == 200 else None, headers=headers)
+
+@app.get("/catalog")
+async def get_catalog(request: Request):
+    """كل القيم المقبولة في /predict ونطاقات الجرعات، مع ETag لكل إصدار نموذج"""
+    return catalog_response('catalog', request)
 
 @app.get("/drugs")
-def list_drugs():
+async def list_drugs(request: Request):
     """الحصول على قائمة الأدوية المدعومة"""
-    if encoders is None:
-        raise HTTPException(status_code=500, detail="Encoders not loaded")
-    
-    try:
-        if 'drug' in encoders:
-            drug_list = list(encoders['drug'].classes_)
-            return {"drugs": drug_list}
-        elif 'drug_info' in encoders:
-            drug_list = list(encoders['drug_info'].keys())
-            return {"drugs": drug_list}
-        else:
-            raise HTTPException(status_code=500, detail="Drug information not available")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error retrieving drugs: {str(e)}")
-
-def find_closest_match(search_term, options, threshold=0.7):
-    """العثور على أقرب تطابق لمصطلح البحث في الخيارات المتاحة"""
-    from difflib import SequenceMatcher
-    
-    best_match = None
-    best_ratio = 0
-    
-    search_term = search_term.lower()
-    for option in options:
-        ratio = SequenceMatcher(None, search_term, option.lower()).ratio()
-        if ratio > best_ratio and ratio > threshold:
-            best_ratio = ratio
-            best_match = option
-    
-    return best_match
+    return catalog_response('drugs', request)
 
 if __name__ == "__main__":
+    import uvicorn  # مطلوب فقط عند التشغيل المباشر
     uvicorn.run("api:app", host="0.0.0.0", port=8000, reload=True) 
\ No newline at end of file
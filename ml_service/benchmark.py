@@ -0,0 +1,336 @@
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+# قياس أداء مسارات التوقع داخل العملية نفسها (بدون HTTP)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def sample_patients(encoders, n, seed=42):
+    """توليد طلبات مرضى عشوائية من القيم التي تعرفها المشفرات"""
+    rng = np.random.default_rng(seed)
+    drugs = list(encoders['drug'].classes_)
+    routes = list(encoders['route'].classes_)
+    genders = list(encoders['gender'].classes_)
+    admissions = list(encoders['admission'].classes_)
+    diagnoses = list(encoders['diagnosis'].classes_) if 'diagnosis' in encoders else [None]
+    return [
+        {
+            'age': float(rng.uniform(1, 90)),
+            'weight': float(rng.normal(70, 15)),
+            'drug': str(rng.choice(drugs)),
+            'route': str(rng.choice(routes)),
+            'gender': str(rng.choice(genders)),
+            'admission_type': str(rng.choice(admissions)),
+            'diagnosis': str(rng.choice(diagnoses)) if diagnoses[0] is not None else None,
+        }
+        for _ in range(n)
+    ]
+
+
+def bench_batch(api, n_rows, repeats):
+    """مقارنة /predict لكل مريض مع /predict/batch لنفس المرضى"""
+    patients = sample_patients(api.registry.current().encoders, n_rows)
+    requests_ = [api.PatientData(**p) for p in patients]
+
+    single_times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        single = [api.predict_dosage(r) for r in requests_]
+        single_times.append(time.perf_counter() - start)
+
+    batch_times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        batch = api.predict_dosage_batch(patients)
+        batch_times.append(time.perf_counter() - start)
+
+    mismatches = sum(
+        1 for s, b in zip(single, batch.predictions)
+        if b.prediction is None or s.dosage_class != b.prediction.dosage_class
+        or s.confidence != b.prediction.confidence
+    )
+    single_best = min(single_times)
+    batch_best = min(batch_times)
+    return {
+        'rows': n_rows,
+        'single_ms_per_row': single_best / n_rows * 1000,
+        'batch_ms_per_row': batch_best / n_rows * 1000,
+        'speedup': single_best / batch_best,
+        'mismatches': mismatches,
+    }
+
+
+def bench_featurizer(api, n_rows):
+    """زمن التوقع لمريض واحد: pandas + Pipeline مقابل المحوّل المجمّع"""
+    runtime = api.registry.current()
+    if runtime.featurizer is None:
+        return {'error': 'compiled featurizer not available'}
+    import pandas as pd
+    rows = runtime.featurizer.sample_rows(n_rows)
+
+    start = time.perf_counter()
+    for row in rows:
+        frame = pd.DataFrame([row], columns=runtime.featurizer.input_columns)
+        runtime.model.predict(frame)
+        runtime.model.predict_proba(frame)
+    pandas_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for row in rows:
+        runtime.featurizer.predict_proba([row])
+    compiled_time = time.perf_counter() - start
+
+    return {
+        'rows': n_rows,
+        'pandas_ms_per_request': pandas_time / n_rows * 1000,
+        'compiled_ms_per_request': compiled_time / n_rows * 1000,
+        'speedup': pandas_time / compiled_time,
+        'max_difference': runtime.featurizer.compare_with_pipeline(runtime.model, rows),
+    }
+
+
+def bench_drug_index(sizes=(20, 1000, 10000), queries=500, seed=42):
+    """زمن حل اسم دواء بخطأ إملائي مع نمو المعجم (بدون ذاكرة الحل)"""
+    from drug_index import DrugIndex
+    rng = np.random.default_rng(seed)
+    letters = np.array(list('abcdefghijklmnopqrstuvwxyz'))
+    results = []
+    for size in sizes:
+        names = sorted({''.join(rng.choice(letters, rng.integers(6, 14))) for _ in range(size)})
+        start = time.perf_counter()
+        index = DrugIndex(names)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        misspelled = []
+        for name in rng.choice(names, queries):
+            position = rng.integers(len(name))
+            misspelled.append(name[:position] + name[position + 1:])
+        start = time.perf_counter()
+        resolved = [index._resolve(q) for q in misspelled]
+        elapsed = time.perf_counter() - start
+        results.append({
+            'vocabulary': len(names),
+            'build_ms': build_ms,
+            'resolve_us_per_query': elapsed / queries * 1e6,
+            'resolved_rate': sum(r is not None for r in resolved) / queries,
+        })
+    return results
+
+
+async def _asgi_request(app, method, path, body=b""):
+    """استدعاء تطبيق ASGI مباشرة (المسار الكامل للإطار بدون شبكة)؛ يعيد رمز الحالة"""
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': method, 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+        'query_string': b'', 'root_path': '',
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+        'client': ('127.0.0.1', 50000), 'server': ('127.0.0.1', 80),
+    }
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    status = []
+
+    async def receive():
+        return messages.pop() if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await app(scope, receive, send)
+    return status[0] if status else None
+
+
+def bench_metrics(api, n_requests, rounds=5):
+    """كلفة قياس المراحل على /predict عبر تطبيق ASGI داخل العملية
+
+    المقاييس تُفعَّل وتُعطَّل بالتناوب لكل طلب وتُقارن الوسيطات، حتى لا يؤثر
+    الانحراف الزمني للجهاز على إحدى الحالتين؛ ويُقاس أيضاً زمن التسجيل نفسه مباشرة
+    """
+    import asyncio
+    from metrics import StageClock
+    bodies = [json.dumps(p).encode() for p in sample_patients(api.registry.current().encoders, n_requests)]
+    latencies = {False: [], True: []}
+    errors = 0
+
+    async def run():
+        nonlocal errors
+        for i, body in enumerate(bodies):
+            enabled = bool(i % 2)
+            api.metrics.enabled = enabled
+            start = time.perf_counter()
+            if await _asgi_request(api.app, 'POST', '/predict', body) != 200:
+                errors += 1
+            latencies[enabled].append(time.perf_counter() - start)
+
+    loop = asyncio.new_event_loop()
+    try:
+        for _ in range(rounds):
+            loop.run_until_complete(run())
+    finally:
+        api.metrics.enabled = True
+        loop.close()
+
+    # الكلفة المباشرة: 12 مرحلة + تسجيلها في المدرجات (ما يضيفه الطلب الواحد)
+    stages = ['validation', 'encoder_checks', 'feature_assembly', 'cache_lookup', 'preprocess', 'classifier',
+              'response_building', 'response_serialization', 'drug_match', 'micro_batch', 'threadpool_wait', 'extra']
+    scope = {'endpoint': bench_metrics}
+    repeats = 20000
+    start = time.perf_counter()
+    for _ in range(repeats):
+        clock = StageClock()
+        for stage in stages:
+            clock.lap(stage)
+        api.record_request(scope, clock, 200, 0.001)
+    instrumentation_us = (time.perf_counter() - start) / repeats * 1e6
+
+    without = float(np.median(latencies[False]))
+    with_metrics = float(np.median(latencies[True]))
+    return {
+        'requests': n_requests * rounds,
+        'median_us_without_metrics': without * 1e6,
+        'median_us_with_metrics': with_metrics * 1e6,
+        'overhead_percent': (with_metrics - without) / without * 100,
+        'instrumentation_us_per_request': instrumentation_us,
+        'instrumentation_percent_of_median': instrumentation_us / (without * 1e6) * 100,
+        'errors': errors,
+    }
+
+
+def _http_load(port, payloads, concurrency, duration):
+    """عدد الطلبات الناجحة في الثانية مع اتصالات keep-alive متوازية"""
+    counts = [0] * concurrency
+    errors = [0] * concurrency
+    deadline = time.perf_counter() + duration
+
+    def client(worker):
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        i = worker
+        while time.perf_counter() < deadline:
+            body = json.dumps(payloads[i % len(payloads)])
+            i += concurrency
+            try:
+                connection.request('POST', '/predict', body, {'Content-Type': 'application/json'})
+                response = connection.getresponse()
+                response.read()
+                if response.status == 200:
+                    counts[worker] += 1
+                else:
+                    errors[worker] += 1
+            except (OSError, http.client.HTTPException):
+                errors[worker] += 1
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        connection.close()
+
+    threads = [threading.Thread(target=client, args=(w,)) for w in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sum(counts) / duration, sum(errors)
+
+
+def _process_tree(pid):
+    """العملية وكل العمليات الفرعية لها (من /proc)"""
+    pids = [pid]
+    for child in pids:
+        try:
+            with open(f'/proc/{child}/task/{child}/children') as f:
+                pids.extend(int(p) for p in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def _wait_ready(port, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            connection.request('GET', '/ready')
+            if connection.getresponse().status == 200:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.1)
+    return False
+
+
+def bench_servers(encoders, concurrency, duration, workers, port=8765):
+    """uvicorn بعملية واحدة مقابل serve.py (fork بعد تحميل النموذج)"""
+    from serve import process_memory
+    payloads = sample_patients(encoders, 1000)
+    setups = {
+        'uvicorn_single': [sys.executable, '-m', 'uvicorn', 'api:app', '--port', str(port), '--log-level', 'warning'],
+        'serve_prefork': [sys.executable, 'serve.py', '--port', str(port), '--workers', str(workers)],
+    }
+    results = {}
+    for name, command in setups.items():
+        spawned = time.perf_counter()
+        server = subprocess.Popen(command, cwd=BASE_DIR)
+        try:
+            if not _wait_ready(port):
+                results[name] = {'error': 'server did not become ready'}
+                continue
+            # زمن الإقلاع كما يراه المُوسِّع التلقائي: من تشغيل العملية حتى أول 200 من /ready
+            ready_seconds = time.perf_counter() - spawned
+            throughput, errors = _http_load(port, payloads, concurrency, duration)
+            processes = [p for p in _process_tree(server.pid) if p != server.pid] or [server.pid]
+            memory = [process_memory(p) for p in processes]
+            results[name] = {
+                'workers': len(processes),
+                'spawn_to_ready_seconds': ready_seconds,
+                'requests_per_second': throughput,
+                'errors': errors,
+                'rss_mb_per_worker': [m.get('rss') for m in memory],
+                'pss_mb_per_worker': [m.get('pss') for m in memory],
+            }
+        finally:
+            server.terminate()
+            server.wait()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MedLink inference benchmarks")
+    parser.add_argument('--model', help="bundle directory or pickle (default: the one the API serves)")
+    parser.add_argument('--encoders')
+    parser.add_argument('--rows', type=int, default=500)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--servers', action='store_true',
+                        help="also compare single-process uvicorn with the pre-fork launcher over HTTP")
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--workers', type=int, default=0)
+    args = parser.parse_args()
+
+    import api
+    if api.load_model(args.model, args.encoders) is None:
+        raise SystemExit("Model could not be loaded")
+    # قياس كلفة النموذج نفسه وليس الذاكرة المؤقتة
+    api.prediction_cache.max_size = 0
+
+    results = {
+        'batch': bench_batch(api, args.rows, args.repeats),
+        'featurizer': bench_featurizer(api, args.rows),
+        'drug_index': bench_drug_index(),
+        'metrics_overhead': bench_metrics(api, args.rows),
+    }
+    if args.servers:
+        from serve import autosize_workers
+        results['servers'] = bench_servers(api.registry.current().encoders, args.concurrency, args.duration,
+                                           args.workers or autosize_workers(1))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import gzip
+import hashlib
+import json
+
+# كتالوج القيم المقبولة في الطلبات (الأدوية، طرق الإعطاء، الجنس، أنواع الدخول، التشخيصات ونطاقات الجرعات)
+# يُبنى مرة واحدة لكل إصدار نموذج ويُسلسل ويُضغط مسبقاً؛ الطلب المتكرر بـ If-None-Match يحصل على 304
+# دون جسم، والطلب الجديد يحصل على البايتات الجاهزة (gzip إن قبلها العميل)
+
+# (مفتاح الكتالوج, اسم المشفر في encoders.pkl)
+VOCABULARIES = [
+    ('drugs', 'drug'),
+    ('routes', 'route'),
+    ('genders', 'gender'),
+    ('admission_types', 'admission'),
+    ('diagnoses', 'diagnosis'),
+]
+# العميل يعيد التحقق في كل مرة (304 رخيص) فيرى الإصدار الجديد فور تبديل النموذج
+CACHE_CONTROL = "no-cache"
+
+
+def _etag_values(header):
+    """قيم ETag في If-None-Match (المقارنة الضعيفة: W/ تُهمل)"""
+    values = set()
+    for value in header.split(','):
+        value = value.strip()
+        if value.startswith('W/'):
+            value = value[2:]
+        if value:
+            values.add(value)
+    return values
+
+
+def accepts_gzip(header):
+    """هل يقبل Accept-Encoding ترميز gzip (مع q=0 كرفض صريح)"""
+    for part in (header or '').split(','):
+        name, _, params = part.strip().partition(';')
+        if name.strip().lower() in ('gzip', '*'):
+            return params.replace(' ', '').lower() not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
+
+
+class CatalogDocument:
+    """مستند JSON مُسلسل مسبقاً بنسختين (عادية و gzip) ولكل منهما ETag قوي"""
+
+    def __init__(self, payload):
+        self.body = json.dumps(payload, ensure_ascii=False, separators=(',', ':'), sort_keys=True).encode('utf-8')
+        # mtime=0 حتى تكون البايتات (و ETag) متطابقة بين العمليات والخوادم لنفس النموذج
+        self.gzip_body = gzip.compress(self.body, compresslevel=9, mtime=0)
+        digest = hashlib.sha256(self.body).hexdigest()[:20]
+        self.etag = f'"{digest}"'
+        self.gzip_etag = f'"{digest}-gzip"'
+
+    def respond(self, if_none_match=None, accept_encoding=None):
+        """(الحالة, الجسم, الترويسات) للطلب؛ 304 بجسم فارغ إذا طابق أي من ETag النسختين"""
+        use_gzip = accepts_gzip(accept_encoding)
+        headers = {
+            'ETag': self.gzip_etag if use_gzip else self.etag,
+            'Cache-Control': CACHE_CONTROL,
+            'Vary': 'Accept-Encoding',
+        }
+        if if_none_match:
+            tags = _etag_values(if_none_match)
+            if '*' in tags or self.etag in tags or self.gzip_etag in tags:
+                return 304, b'', headers
+        if use_gzip:
+            headers['Content-Encoding'] = 'gzip'
+            return 200, self.gzip_body, headers
+        return 200, self.body, headers
+
+
+class Catalog:
+    """مستندات الكتالوج لإصدار واحد: catalog كامل و drugs (نفس صيغة /drugs السابقة)"""
+
+    def __init__(self, model_version, vocabularies, drug_info=None, source="model"):
+        payload = {'model_version': model_version, 'source': source}
+        for key, _ in VOCABULARIES:
+            payload[key] = [str(value) for value in vocabularies.get(key, [])]
+        payload['dose_ranges'] = {
+            str(drug): {'min': info['min'], 'max': info['max'], 'unit': info['unit']}
+            for drug, info in (drug_info or {}).items()
+        }
+        self.payload = payload
+        self.documents = {
+            'catalog': CatalogDocument(payload),
+            'drugs': CatalogDocument({'drugs': payload['drugs']}),
+        }
+
+    @classmethod
+    def from_encoders(cls, model_version, encoders):
+        """من مشفرات النموذج: مفردات LabelEncoder بترتيبها، والأدوية من drug_info إن لم يوجد مشفر"""
+        vocabularies = {key: list(encoders[name].classes_)
+                        for key, name in VOCABULARIES if hasattr(encoders.get(name), 'classes_')}
+        drug_info = encoders.get('drug_info') or {}
+        if 'drugs' not in vocabularies:
+            vocabularies['drugs'] = list(drug_info)
+        return cls(model_version, vocabularies, drug_info)
+
+    def document(self, name):
+        return self.documents[name]
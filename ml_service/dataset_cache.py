@@ -0,0 +1,278 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from model_files import file_sha256
+
+# نسخة عمودية ثنائية من جداول dataset/*.csv تُقرأ بـ mmap بدون نسخ
+# - كل جدول في مجلد باسم <TABLE>-<أول 16 خانة من SHA-256>؛ تغيّر الملف = مجلد جديد
+# - الأعمدة لا تُحوَّل إلا عند أول طلب لها؛ كل تحويل يكتب ملف بيانات group-*.bin
+#   (الأعمدة متتالية ومحاذاة) مع وصف group-*.json فيه موقع ونوع كل عمود
+# - الأعمدة النصية تُخزَّن رموز فئات (int8/16/32) والفئات نفسها في الوصف
+# - عمليات التدريب المتزامنة تقرأ نفس الملفات فتتشارك صفحات الذاكرة عبر ذاكرة نظام التشغيل
+
+CHECKSUMS_FILE = 'SHA256SUMS.txt'
+CACHE_DIR_NAME = '.columnar'
+BUILD_CHUNK_SIZE = 200_000
+# محاذاة بداية كل عمود داخل ملف البيانات
+ALIGNMENT = 64
+
+
+def read_checksums(data_path):
+    """{اسم الملف: sha256} من SHA256SUMS.txt؛ قاموس فارغ إن لم يوجد"""
+    checksums = {}
+    try:
+        with open(os.path.join(data_path, CHECKSUMS_FILE), encoding='utf-8') as f:
+            for line in f:
+                parts = line.split(None, 1)
+                if len(parts) == 2 and not line.startswith('#'):
+                    # صيغة sha256sum: "<hash>  <name>" أو "<hash> *<name>" للوضع الثنائي
+                    checksums[parts[1].strip().lstrip('*')] = parts[0].lower()
+    except FileNotFoundError:
+        pass
+    return checksums
+
+
+def _temp_path(path):
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def _save_json(path, value):
+    temp = _temp_path(path)
+    with open(temp, 'w', encoding='utf-8') as f:
+        json.dump(value, f)
+    os.replace(temp, path)
+
+
+def _load_json(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+class DatasetCache:
+    def __init__(self, data_path, cache_dir=None, verify=False):
+        """verify=True يحسب SHA-256 لكل ملف بدل الوثوق بـ SHA256SUMS.txt عند أول استخدام"""
+        self.data_path = data_path
+        self.cache_dir = cache_dir or os.environ.get('MEDLINK_DATASET_CACHE_DIR') or os.path.join(data_path, CACHE_DIR_NAME)
+        self.verify = verify
+        self.checksums = read_checksums(data_path)
+        self._keys = {}
+        # الملفات لا تتغير بعد كتابتها (المفتاح هو checksum) فتُحفظ نتائج قراءتها
+        self._stored = {}
+        self._maps = {}
+        self._dtypes = {}
+        self._headers = {}
+        self._lock = threading.Lock()
+
+    def source_key(self, filename):
+        """SHA-256 الذي يُفهرس به الجدول
+
+        يُؤخذ من SHA256SUMS.txt عند أول استخدام، ثم يُحفظ مع حجم الملف ووقت تعديله؛
+        إذا تغيّر أيٌّ منهما يُعاد حساب SHA-256 من محتوى الملف فيتغيّر مجلد الذاكرة تلقائياً
+        """
+        path = os.path.join(self.data_path, filename)
+        stat = os.stat(path)
+        with self._lock:
+            cached = self._keys.get(filename)
+            if cached and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+                return cached[2]
+
+        record_path = os.path.join(self.cache_dir, f"{filename}.source.json")
+        record = _load_json(record_path)
+        expected = self.checksums.get(filename)
+        if record and (record.get('size'), record.get('mtime_ns')) == (stat.st_size, stat.st_mtime_ns):
+            key = record['sha256']
+        elif expected and record is None and not self.verify:
+            key = expected
+        else:
+            key = file_sha256(path)
+            if expected and key != expected:
+                print(f"Warning: {filename} does not match {CHECKSUMS_FILE}; caching it under its actual checksum")
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        if record is None or record.get('sha256') != key or record.get('mtime_ns') != stat.st_mtime_ns:
+            _save_json(record_path, {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': key})
+        with self._lock:
+            self._keys[filename] = (stat.st_size, stat.st_mtime_ns, key)
+        return key
+
+    def table_dir(self, filename):
+        stem = os.path.splitext(filename)[0]
+        return os.path.join(self.cache_dir, f"{stem}-{self.source_key(filename)[:16]}")
+
+    def columns(self, filename):
+        """أسماء الأعمدة بترتيب ملف CSV"""
+        table_dir = self.table_dir(filename)
+        with self._lock:
+            header = self._headers.get(table_dir)
+        if header is not None:
+            return header
+        header = _load_json(os.path.join(table_dir, 'header.json'))
+        if header is None:
+            os.makedirs(table_dir, exist_ok=True)
+            header = list(pd.read_csv(os.path.join(self.data_path, filename), nrows=0).columns)
+            _save_json(os.path.join(table_dir, 'header.json'), header)
+            self._remove_stale(filename, table_dir)
+        with self._lock:
+            self._headers[table_dir] = header
+        return header
+
+    def load(self, filename, columns=None):
+        """DataFrame أعمدته مصفوفات mmap للقراءة فقط؛ يحوّل من CSV الأعمدة غير المخزنة فقط"""
+        header = self.columns(filename)
+        columns = list(header if columns is None else columns)
+        unknown = [name for name in columns if name not in header]
+        if unknown:
+            raise KeyError(f"{filename} has no columns: {', '.join(unknown)}")
+
+        table_dir = self.table_dir(filename)
+        stored = self._stored_columns(table_dir)
+        missing = [name for name in columns if name not in stored]
+        if missing:
+            # ربما بنتها عملية أخرى منذ آخر قراءة للمجلد
+            stored = self._stored_columns(table_dir, refresh=True)
+            missing = [name for name in columns if name not in stored]
+        if missing:
+            self._build(filename, table_dir, missing)
+            stored = self._stored_columns(table_dir, refresh=True)
+        return pd.DataFrame({name: self._open(*stored[name]) for name in columns}, columns=columns, copy=False)
+
+    def _stored_columns(self, table_dir, refresh=False):
+        """{اسم العمود: (وصفه، مسار ملف البيانات)} من ملفات وصف المجموعات في مجلد الجدول"""
+        with self._lock:
+            stored = self._stored.get(table_dir)
+        if stored is not None and not refresh:
+            return stored
+        stored = {}
+        for entry in sorted(os.listdir(table_dir)):
+            if entry.startswith('group-') and entry.endswith('.json'):
+                manifest = _load_json(os.path.join(table_dir, entry))
+                data_path = os.path.join(table_dir, manifest['data'])
+                for name, meta in manifest['columns'].items():
+                    stored.setdefault(name, (meta, data_path))
+        with self._lock:
+            self._stored[table_dir] = stored
+        return stored
+
+    def _open(self, meta, data_path):
+        with self._lock:
+            buffer = self._maps.get(data_path)
+            if buffer is None:
+                # ملف واحد لكل مجموعة أعمدة؛ كل عمود منظور (view) عليه بدون نسخ
+                # جدول بلا صفوف = ملف فارغ، و mmap لا يقبل ملفاً فارغاً
+                buffer = (np.memmap(data_path, dtype=np.uint8, mode='r') if os.path.getsize(data_path)
+                          else np.empty(0, dtype=np.uint8))
+                self._maps[data_path] = buffer
+        dtype = np.dtype(meta['dtype'])
+        start = meta['offset']
+        values = buffer[start:start + meta['length'] * dtype.itemsize].view(dtype)
+        if meta['kind'] == 'numeric':
+            return values
+        return pd.Categorical.from_codes(values, dtype=self._category_dtype(data_path, meta))
+
+    def _category_dtype(self, data_path, meta):
+        key = (data_path, meta['offset'])
+        with self._lock:
+            dtype = self._dtypes.get(key)
+        if dtype is None:
+            dtype = pd.CategoricalDtype(pd.Index(meta['categories'], dtype=object))
+            with self._lock:
+                self._dtypes[key] = dtype
+        return dtype
+
+    def _build(self, filename, table_dir, names):
+        """تحويل أعمدة من CSV على دفعات (قراءة واحدة لكل الأعمدة الناقصة) إلى ملف بيانات واحد"""
+        path = os.path.join(self.data_path, filename)
+        start = time.perf_counter()
+        parts = {name: [] for name in names}
+        for chunk in pd.read_csv(path, usecols=names, chunksize=BUILD_CHUNK_SIZE, low_memory=False):
+            for name in names:
+                values = chunk[name]
+                # النصوص تُضغط فئاتٍ فور قراءة الدفعة حتى لا تتراكم كائنات str
+                parts[name].append(values if values.dtype.kind in 'iufb' else values.astype('category'))
+
+        arrays = {}
+        columns = {}
+        for name in names:
+            values = parts.pop(name)
+            if values and all(part.dtype.kind in 'iufb' for part in values):
+                arrays[name] = np.concatenate([part.to_numpy() for part in values])
+                columns[name] = {'kind': 'numeric'}
+                continue
+            if any(not isinstance(part.dtype, pd.CategoricalDtype) for part in values):
+                # أرقام في دفعة ونصوص في أخرى: نعيد قراءة العمود كنص حتى لا يتغير شكل القيم
+                values = [chunk[name].astype('category') for chunk in
+                          pd.read_csv(path, usecols=[name], dtype={name: str}, chunksize=BUILD_CHUNK_SIZE)]
+            combined = union_categoricals(values, sort_categories=True) if values else pd.Categorical([])
+            arrays[name] = combined.codes
+            columns[name] = {'kind': 'categorical', 'categories': [str(c) for c in combined.categories]}
+
+        group = 'group-' + hashlib.sha1('\0'.join(sorted(names)).encode('utf-8')).hexdigest()[:12]
+        data_path = os.path.join(table_dir, group + '.bin')
+        temp = _temp_path(data_path)
+        offset = 0
+        with open(temp, 'wb') as f:
+            for name in names:
+                array = np.ascontiguousarray(arrays.pop(name))
+                padding = -offset % ALIGNMENT
+                f.write(b'\0' * padding)
+                offset += padding
+                columns[name].update(dtype=array.dtype.str, offset=offset, length=len(array))
+                f.write(array.tobytes())
+                offset += array.nbytes
+        # ملف البيانات أولاً ثم الوصف: وجود الوصف يعني أن البيانات كاملة
+        os.replace(temp, data_path)
+        _save_json(os.path.join(table_dir, group + '.json'), {'data': group + '.bin', 'columns': columns})
+        print(f"Cached {len(names)} column(s) of {filename} in {time.perf_counter() - start:.2f}s")
+
+    def _remove_stale(self, filename, table_dir):
+        """حذف نسخ الجدول القديمة (محتوى CSV سابق)"""
+        stem = os.path.splitext(filename)[0]
+        pattern = re.compile(re.escape(stem) + r'-[0-9a-f]{16}$')
+        for entry in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, entry)
+            if pattern.match(entry) and path != table_dir:
+                for name in os.listdir(path):
+                    os.remove(os.path.join(path, name))
+                os.rmdir(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and benchmark the columnar cache of the dataset CSVs")
+    parser.add_argument('data_path', nargs='?', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dataset'))
+    parser.add_argument('--tables', nargs='*', help="CSV file names (default: every CSV listed in SHA256SUMS.txt)")
+    parser.add_argument('--cache-dir')
+    parser.add_argument('--verify', action='store_true', help="hash every CSV instead of trusting SHA256SUMS.txt")
+    args = parser.parse_args()
+
+    cache = DatasetCache(args.data_path, args.cache_dir, verify=args.verify)
+    tables = args.tables or sorted(name for name in cache.checksums
+                                   if name.endswith('.csv') and os.path.exists(os.path.join(args.data_path, name)))
+    print(f"{'table':<24}{'rows':>10}{'csv_s':>10}{'cached_s':>10}{'speedup':>10}")
+    for filename in tables:
+        cache.load(filename)
+        start = time.perf_counter()
+        frame = pd.read_csv(os.path.join(args.data_path, filename), low_memory=False)
+        csv_seconds = time.perf_counter() - start
+        # نسخة جديدة من DatasetCache = ما تراه عملية تدريب جديدة (بدون ذاكرة داخلية)
+        start = time.perf_counter()
+        cached = DatasetCache(args.data_path, cache.cache_dir).load(filename)
+        cached_seconds = time.perf_counter() - start
+        assert len(frame) == len(cached)
+        print(f"{filename:<24}{len(cached):>10}{csv_seconds:>10.4f}{cached_seconds:>10.4f}"
+              f"{csv_seconds / cached_seconds:>9.0f}x")
+
+
+if __name__ == "__main__":
+    main()
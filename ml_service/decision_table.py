@@ -0,0 +1,199 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from featurizer import CompiledFeaturizer
+
+# جدول قرارات محسوب مسبقاً لكل تركيبات القيم التصنيفية مع عمر ووزن مُكمَّمين
+# يُحفظ كمصفوفات .npy تُقرأ بـ mmap فيصبح التوقع بحثاً O(1) في مصفوفة
+
+TABLE_FORMAT_VERSION = 1
+NOT_SPECIFIED = "Not specified"
+
+# (عمود الميزة في النموذج, اسم المشفر في encoders.pkl)
+CATEGORICAL_AXES = [
+    ('drug', 'drug'),
+    ('route', 'route'),
+    ('gender', 'gender'),
+    ('admission_type', 'admission'),
+    ('diagnosis', 'diagnosis'),
+]
+
+
+def _axis_values(encoders):
+    axes = []
+    for column, encoder_name in CATEGORICAL_AXES:
+        values = [str(v) for v in encoders[encoder_name].classes_] if encoder_name in encoders else []
+        if column == 'diagnosis' and NOT_SPECIFIED not in values:
+            # التشخيص المفقود أو غير المعروف يُعامل كـ "Not specified"
+            values.append(NOT_SPECIFIED)
+        axes.append((column, values))
+    return axes
+
+
+def _grid(start, stop, step):
+    return np.round(np.arange(start, stop + step / 2, step), 6)
+
+
+class DecisionTable:
+    """جدول القرارات المحمّل من القرص (للقراءة فقط عبر mmap)"""
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, 'meta.json'), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta['format_version'] != TABLE_FORMAT_VERSION:
+            raise ValueError(f"Unsupported decision table format {self.meta['format_version']}")
+        self.classes = np.load(os.path.join(directory, 'classes.npy'), mmap_mode='r')
+        self.confidence = np.load(os.path.join(directory, 'confidence.npy'), mmap_mode='r')
+        self.class_labels = self.meta['class_labels']
+        self.model_version = self.meta.get('model_version')
+        self.axes = [(column, {value: i for i, value in enumerate(values)})
+                     for column, values in self.meta['axes']]
+        self.age_start, self.age_step, self.n_ages = self.meta['age_grid']
+        self.weight_start, self.weight_step, self.n_weights = self.meta['weight_grid']
+        self._not_specified = self.axes[-1][1].get(NOT_SPECIFIED)
+
+    def _continuous_index(self, value, start, step, count):
+        index = int(round((value - start) / step))
+        return min(max(index, 0), count - 1)
+
+    def index(self, row):
+        """موضع الصف في الجدول، أو None إذا كانت قيمة تصنيفية خارج الجدول"""
+        position = []
+        for column, lookup in self.axes:
+            i = lookup.get(row[column])
+            if i is None:
+                if column != 'diagnosis' or self._not_specified is None:
+                    return None
+                i = self._not_specified
+            position.append(i)
+        position.append(self._continuous_index(row['age'], self.age_start, self.age_step, self.n_ages))
+        position.append(self._continuous_index(row['weight'], self.weight_start, self.weight_step, self.n_weights))
+        return tuple(position)
+
+    def lookup(self, rows):
+        """يعيد (الفئات, مستويات الثقة)؛ يرفع KeyError إذا لم يغطِّ الجدول أحد الصفوف"""
+        predictions, confidences = [], []
+        for row in rows:
+            position = self.index(row)
+            if position is None:
+                raise KeyError(f"Row is outside the decision table: {row}")
+            predictions.append(int(self.class_labels[self.classes[position]]))
+            confidences.append(float(self.confidence[position]))
+        return predictions, confidences
+
+
+def build_table(pipeline, encoders, output_dir, age_range=(0.0, 100.0), age_step=2.0,
+                weight_range=(20.0, 200.0), weight_step=10.0, model_version=None,
+                check_samples=20000, seed=42):
+    """تقييم Pipeline على كامل الشبكة وكتابة الجدول إلى output_dir"""
+    featurizer = CompiledFeaturizer(pipeline)
+    classifier = featurizer.classifier
+    axes = _axis_values(encoders)
+    ages = _grid(age_range[0], age_range[1], age_step)
+    weights = _grid(weight_range[0], weight_range[1], weight_step)
+    shape = tuple(len(values) for _, values in axes) + (len(ages), len(weights))
+
+    os.makedirs(output_dir, exist_ok=True)
+    classes = np.lib.format.open_memmap(os.path.join(output_dir, 'classes.npy'), mode='w+', dtype=np.uint8, shape=shape)
+    confidence = np.lib.format.open_memmap(os.path.join(output_dir, 'confidence.npy'), mode='w+', dtype=np.float16, shape=shape)
+
+    # كل دفعة تغطي دواءً وطريقة إعطاء واحدة وكل ما تبقى من المحاور
+    inner_axes = [values for _, values in axes[2:]] + [ages, weights]
+    inner_grid = np.meshgrid(*[np.arange(len(v)) for v in inner_axes], indexing='ij')
+    inner_shape = inner_grid[0].shape
+    inner_columns = {}
+    for (column, values), grid_index in zip(axes[2:], inner_grid[:-2]):
+        inner_columns[column] = np.asarray(values, dtype=object)[grid_index.ravel()]
+    inner_columns['age'] = ages[inner_grid[-2].ravel()]
+    inner_columns['weight'] = weights[inner_grid[-1].ravel()]
+
+    start = time.perf_counter()
+    n_rows = inner_grid[0].size
+    for d, drug in enumerate(axes[0][1]):
+        for r, route in enumerate(axes[1][1]):
+            columns = dict(inner_columns)
+            columns['drug'] = np.full(n_rows, drug, dtype=object)
+            columns['route'] = np.full(n_rows, route, dtype=object)
+            proba = classifier.predict_proba(featurizer.transform_columns(columns))
+            best = proba.argmax(axis=1)
+            classes[d, r] = best.astype(np.uint8).reshape(inner_shape)
+            confidence[d, r] = proba[np.arange(n_rows), best].astype(np.float16).reshape(inner_shape)
+        print(f"  {drug}: done ({time.perf_counter() - start:.1f}s)")
+    classes.flush()
+    confidence.flush()
+    del classes, confidence
+
+    meta = {
+        'format_version': TABLE_FORMAT_VERSION,
+        'model_version': model_version,
+        'class_labels': [int(c) for c in featurizer.classes_],
+        'axes': axes,
+        'age_grid': [float(ages[0]), float(age_step), len(ages)],
+        'weight_grid': [float(weights[0]), float(weight_step), len(weights)],
+        'cells': int(np.prod(shape)),
+        'build_seconds': time.perf_counter() - start,
+    }
+    with open(os.path.join(output_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    report = check_table(DecisionTable(output_dir), featurizer, axes, age_range, weight_range, check_samples, seed)
+    meta['agreement'] = report
+    with open(os.path.join(output_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return meta
+
+
+def check_table(table, featurizer, axes, age_range, weight_range, n_samples, seed=42):
+    """مقارنة الجدول مع التوقع الدقيق للنموذج على مرضى بأعمار وأوزان مستمرة"""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for _ in range(n_samples):
+        row = {column: values[rng.integers(len(values))] for column, values in axes}
+        row['age'] = float(rng.uniform(*age_range))
+        row['weight'] = float(rng.uniform(*weight_range))
+        rows.append(row)
+
+    exact = featurizer.classifier.predict_proba(featurizer.transform(rows))
+    exact_classes = featurizer.classes_[exact.argmax(axis=1)]
+    exact_confidence = exact.max(axis=1)
+    table_classes, table_confidence = table.lookup(rows)
+
+    disagree = np.asarray(table_classes) != exact_classes
+    return {
+        'samples': n_samples,
+        'class_disagreement_rate': float(disagree.mean()),
+        'mean_confidence_error': float(np.mean(np.abs(np.asarray(table_confidence) - exact_confidence))),
+        'max_confidence_error': float(np.max(np.abs(np.asarray(table_confidence) - exact_confidence))),
+    }
+
+
+def main():
+    from model_bundle import load_model_files
+
+    parser = argparse.ArgumentParser(description="Build the precomputed dosage decision table")
+    parser.add_argument('--model', help="bundle directory or pickle (default: dosage_model.bundle, else dosage_model.pkl)")
+    parser.add_argument('--encoders', help="encoders pickle for a legacy model (default: encoders.pkl next to it)")
+    parser.add_argument('--output', default='dosage_table')
+    parser.add_argument('--age-step', type=float, default=2.0)
+    parser.add_argument('--weight-step', type=float, default=10.0)
+    parser.add_argument('--age-range', type=float, nargs=2, default=(0.0, 100.0))
+    parser.add_argument('--weight-range', type=float, nargs=2, default=(20.0, 200.0))
+    parser.add_argument('--check-samples', type=int, default=20000)
+    args = parser.parse_args()
+
+    source = load_model_files(args.model, args.encoders)
+    meta = build_table(
+        source.model, source.encoders, args.output,
+        age_range=tuple(args.age_range), age_step=args.age_step,
+        weight_range=tuple(args.weight_range), weight_step=args.weight_step,
+        model_version=source.version, check_samples=args.check_samples
+    )
+    print(json.dumps({k: meta[k] for k in ('cells', 'build_seconds', 'agreement')}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
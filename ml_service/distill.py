@@ -0,0 +1,199 @@
+import argparse
+import json
+import os
+import pickle
+import sys
+import time
+
+import numpy as np
+from sklearn.pipeline import Pipeline
+
+from featurizer import unwrap_pipeline
+from model_bundle import load_model_files, save_like
+from synthetic_data import generate_dataset
+from tree_export import export_classifier, save_ensemble, default_export_path, _latency_ms
+
+# تقطير نموذج التصويت (غابة + Gradient Boosting + XGBoost + شبكة عصبية) في نموذج طالب واحد صغير:
+# المعلم يعطي احتمالاته الناعمة على مجموعة نقل اصطناعية كبيرة، والطالب (XGBoost ضحل)
+# يتدرب عليها بنفس المعالجة المسبقة فيبقى بديلاً مباشراً في الواجهة (ومسار الأشجار المصدّرة)
+
+DEFAULT_TRANSFER_ROWS = 200_000
+DEFAULT_HOLDOUT_ROWS = 20_000
+# احتمالات المعلم الأصغر من هذا لا تُكرَّر كصفوف (أثرها على الخسارة مهمل)
+MIN_SOFT_WEIGHT = 1e-3
+# أقصى فرق دقة مقبول لاستخدام الطالب بدل المعلم
+MAX_ACCURACY_GAP = 0.01
+
+
+def default_student():
+    import xgboost as xgb
+
+    return xgb.XGBClassifier(
+        n_estimators=150,
+        learning_rate=0.1,
+        max_depth=5,
+        tree_method='hist',
+        random_state=42,
+        n_jobs=-1,
+        eval_metric='mlogloss'
+    )
+
+
+def teacher_outputs(pipeline, frame, chunk_size=50_000):
+    """(الميزات بعد المعالجة float32، احتمالات المعلم) على دفعات لتحديد الذاكرة"""
+    preprocessor, classifier = pipeline.steps[0][1], pipeline.steps[-1][1]
+    features, probabilities = [], []
+    for start in range(0, len(frame), chunk_size):
+        X = preprocessor.transform(frame.iloc[start:start + chunk_size])
+        X = X.toarray() if hasattr(X, 'toarray') else np.asarray(X)
+        probabilities.append(classifier.predict_proba(X))
+        features.append(X.astype(np.float32))
+    return np.vstack(features), np.vstack(probabilities)
+
+
+def soft_label_rows(X, probabilities, classes, min_weight=MIN_SOFT_WEIGHT):
+    """تكرار كل صف مرة لكل فئة بوزن احتمالها عند المعلم
+
+    log-loss الموزون على الصفوف المكررة يساوي الإنتروبيا المتقاطعة مع احتمالات المعلم،
+    فيتعلم أي مصنف يقبل sample_weight من الأهداف الناعمة مباشرة
+    """
+    rows, columns = np.nonzero(probabilities >= min_weight)
+    return X[rows], np.asarray(classes)[columns], probabilities[rows, columns]
+
+
+def _pickled_mb(obj):
+    return len(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)) / 1e6
+
+
+def compare(teacher, student, X, y, latency_rows=500):
+    """دقة كل نموذج، اتفاق الطالب مع المعلم، الذاكرة وزمن صف واحد (sklearn ومسار الأشجار المصدّرة)"""
+    report = {}
+    teacher_proba = teacher.predict_proba(X)
+    student_proba = student.predict_proba(X)
+    classes = np.asarray(teacher.classes_)
+    teacher_pred = classes[teacher_proba.argmax(axis=1)]
+    student_pred = classes[student_proba.argmax(axis=1)]
+    report['agreement'] = float(np.mean(teacher_pred == student_pred))
+    report['mean_abs_proba_diff'] = float(np.mean(np.abs(teacher_proba - student_proba)))
+    rows = [X[i:i + 1] for i in range(min(latency_rows, len(X)))]
+    for name, model, predictions in (('teacher', teacher, teacher_pred), ('student', student, student_pred)):
+        entry = {
+            'accuracy': float(np.mean(predictions == y)),
+            'pickle_mb': _pickled_mb(model),
+            'sklearn_latency_ms': _latency_ms(model.predict_proba, rows),
+        }
+        try:
+            exported = export_classifier(model)
+            entry['export_mb'] = exported.nbytes() / 1e6
+            entry['numpy_latency_ms'] = _latency_ms(exported.predict_proba, rows)
+        except Exception as e:
+            entry['export'] = f"skipped: {str(e)}"
+        report[name] = entry
+    report['accuracy_gap'] = report['teacher']['accuracy'] - report['student']['accuracy']
+    return report
+
+
+def distill(teacher_path, output_path=None, transfer_rows=DEFAULT_TRANSFER_ROWS,
+            holdout_rows=DEFAULT_HOLDOUT_ROWS, student=None, seed=1000, max_accuracy_gap=MAX_ACCURACY_GAP,
+            verbose=True):
+    """تدريب الطالب وحفظه بجانب المعلم مع تقرير المقارنة؛ يعيد التقرير"""
+    timings = {}
+    source = load_model_files(teacher_path)
+    teacher = unwrap_pipeline(source.model)
+    preprocessor, classifier = teacher.steps[0][1], teacher.steps[-1][1]
+    columns = list(teacher.feature_names_in_)
+
+    # مجموعة النقل: المولّد يغطي كل تركيبات الفئات بتوزيع منتظم مع أعمدة مشتقة متسقة
+    start = time.perf_counter()
+    transfer = generate_dataset(transfer_rows, seed=seed)[columns]
+    X, probabilities = teacher_outputs(teacher, transfer)
+    del transfer
+    timings['teacher_labels'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    X_soft, y_soft, weights = soft_label_rows(X, probabilities, classifier.classes_)
+    student = student if student is not None else default_student()
+    student.fit(X_soft, y_soft, sample_weight=weights)
+    timings['student_fit'] = time.perf_counter() - start
+    del X, X_soft
+
+    # التقييم على بيانات مستبعدة بفئاتها الحقيقية (بذرة مختلفة عن مجموعة النقل)
+    start = time.perf_counter()
+    holdout = generate_dataset(holdout_rows, seed=seed + 1)
+    X_holdout = preprocessor.transform(holdout[columns])
+    X_holdout = X_holdout.toarray() if hasattr(X_holdout, 'toarray') else np.asarray(X_holdout)
+    report = compare(classifier, student, X_holdout, holdout['dosage_class'].to_numpy())
+    timings['evaluate'] = time.perf_counter() - start
+
+    report.update({
+        'teacher_path': source.path,
+        'transfer_rows': transfer_rows,
+        'soft_label_rows': int(len(y_soft)),
+        'holdout_rows': holdout_rows,
+        'student_params': {key: value for key, value in student.get_params().items()
+                           if key in ('n_estimators', 'max_depth', 'learning_rate')},
+        'max_accuracy_gap': max_accuracy_gap,
+        'deployable': report['accuracy_gap'] <= max_accuracy_gap,
+        'timings_s': timings,
+    })
+
+    # حزمة بمشفرات المعلم إن كان المعلم حزمة، وإلا pickle بجانبه مع أشجاره المصدّرة
+    output_path = output_path or (os.path.splitext(source.path)[0]
+                                  + ('_student.bundle' if source.is_bundle else '_student.pkl'))
+    manifest = save_like(source, output_path, Pipeline([('preprocessor', preprocessor), ('classifier', student)]),
+                         training_data={'source': 'distill', 'transfer_rows': transfer_rows, 'seed': seed})
+    report['student_path'] = output_path
+    if manifest is None:
+        try:
+            save_ensemble(export_classifier(student), default_export_path(output_path))
+        except Exception as e:
+            print(f"Tree export skipped: {str(e)}")
+    with open(os.path.splitext(output_path)[0] + '.report.json', 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    if verbose:
+        print(format_report(report))
+    return report
+
+
+def format_report(report):
+    def latency(entry, key):
+        value = entry.get(key)
+        return f"{value['p50']:.3f} / {value['p99']:.3f}" if value else "-"
+
+    teacher, student = report['teacher'], report['student']
+    lines = [f"{'':<26}{'teacher':>18}{'student':>18}"]
+    lines.append(f"{'accuracy':<26}{teacher['accuracy']:>18.4f}{student['accuracy']:>18.4f}")
+    lines.append(f"{'pickle MB':<26}{teacher['pickle_mb']:>18.2f}{student['pickle_mb']:>18.2f}")
+    lines.append(f"{'export MB':<26}{teacher.get('export_mb', 0):>18.2f}{student.get('export_mb', 0):>18.2f}")
+    for key, label in (('sklearn_latency_ms', 'sklearn p50/p99 ms'), ('numpy_latency_ms', 'exported p50/p99 ms')):
+        lines.append(f"{label:<26}{latency(teacher, key):>18}{latency(student, key):>18}")
+    lines.append(f"Agreement {report['agreement']:.4f}, mean |dp| {report['mean_abs_proba_diff']:.4f}, "
+                 f"accuracy gap {report['accuracy_gap']:+.4f} (limit {report['max_accuracy_gap']})")
+    lines.append(f"Student trained on {report['soft_label_rows']} soft-label rows from {report['transfer_rows']} "
+                 f"transfer rows in {report['timings_s']['student_fit']:.1f}s "
+                 f"(teacher labelling {report['timings_s']['teacher_labels']:.1f}s)")
+    verdict = "DEPLOYABLE" if report['deployable'] else "NOT deployable (accuracy gap too large)"
+    lines.append(f"{verdict}: {report['student_path']}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distill the saved ensemble into a single fast student model")
+    parser.add_argument('--teacher', help="bundle directory or pickle (default: the one the API serves)")
+    parser.add_argument('--output', help="student path (default: <teacher>_student.bundle / .pkl)")
+    parser.add_argument('--transfer-rows', type=int, default=DEFAULT_TRANSFER_ROWS)
+    parser.add_argument('--holdout-rows', type=int, default=DEFAULT_HOLDOUT_ROWS)
+    parser.add_argument('--n-estimators', type=int, default=150)
+    parser.add_argument('--max-depth', type=int, default=5)
+    parser.add_argument('--max-accuracy-gap', type=float, default=MAX_ACCURACY_GAP)
+    parser.add_argument('--seed', type=int, default=1000)
+    args = parser.parse_args()
+
+    student = default_student().set_params(n_estimators=args.n_estimators, max_depth=args.max_depth)
+    report = distill(args.teacher, args.output, args.transfer_rows, args.holdout_rows, student,
+                     args.seed, args.max_accuracy_gap)
+    sys.exit(0 if report['deployable'] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+import argparse
+import json
+import queue
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from drug_index import DrugIndex
+from feature_engineering import DosageFeatures, _risk_lookup
+from synthetic_data import (DRUGS, DRUGS_WITH_TYPICAL_DOSES, classify_dosage, classify_dosage_row,
+                            generate_chunk, chunk_to_frame)
+
+# محرك قواعد تصنيف الجرعة: نفس القواعد التي وُلِّدت بها فئات التدريب (synthetic_data.classify_dosage)
+# يعمل دون نموذج، فيُستخدم بديلاً عندما لا يكون هناك نموذج محمّل، ومقارِن ظل يسجل اختلاف
+# القواعد عن النموذج في thread منفصل خارج مسار الطلب
+#
+# القواعد تحتاج نسبة الجرعة من الحد الأقصى للدواء، والطلب لا يحمل جرعة موصوفة:
+# عند غياب dose تُقدَّر بالجرعة المتوقعة في المولّد (منتصف نطاق الدواء معدلاً بالوزن والعمر
+# ومتوسط عامل الطوارئ 1.25)
+
+# متوسط عامل الطوارئ العشوائي uniform(1.0, 1.5) في synthetic_data.generate_chunk
+EMERGENCY_DOSE_FACTOR = 1.25
+REFERENCE_WEIGHT = 70.0
+# الفئة المعادة لدواء خارج جدول الأدوية
+UNKNOWN_CLASS = -1
+
+
+class DosageRules:
+    """قواعد الجرعة لأعمدة كاملة (classify) أو لمريض واحد (classify_row) بنفس النتيجة"""
+
+    def __init__(self):
+        self.features = DosageFeatures().fit(None)
+        self.drugs = list(DRUGS)
+        self.drug_keys = pd.Index(self.drugs)
+        info = [DRUGS_WITH_TYPICAL_DOSES[d] for d in self.drugs]
+        self.drug_mid = np.array([(d['min'] + d['max']) / 2 for d in info], dtype=np.float64)
+        self.drug_max = np.array([d['max'] for d in info], dtype=np.float64)
+        self.drug_age_sensitive = np.array([d['age_factor'] for d in info], dtype=bool)
+        # نفس القيم للمسار الصفي: الدواء -> (منتصف النطاق, الحد الأقصى)
+        self.drug_doses = {d: (float(mid), float(high)) for d, mid, high in
+                           zip(self.drugs, self.drug_mid, self.drug_max)}
+        # حل أسماء الأدوية عندما لا يكون هناك نموذج (ومعه فهرسه)
+        self.drug_index = DrugIndex(self.drugs)
+
+    def dose_percentage(self, columns, codes):
+        """نسبة الجرعة من الحد الأقصى؛ dose المفقود (أو nan) يُقدَّر من المريض"""
+        age = np.asarray(columns['age'], dtype=np.float64)
+        weight = np.asarray(columns['weight'], dtype=np.float64)
+        known = np.where(codes >= 0, codes, 0)
+        sensitive = self.drug_age_sensitive[known]
+        # نفس ترتيب العمليات في المولّد حتى يطابق المسار الصفي بت ببت
+        age_adjustment = np.where(sensitive & (age < 18), age / 18 * 0.7 + 0.3,
+                                  np.where(sensitive & (age > 65), 1 - ((age - 65) / 25) * 0.3, 1.0))
+        dose = self.drug_mid[known] * (weight / REFERENCE_WEIGHT) * age_adjustment
+        dose = np.where(np.asarray(columns['admission_type'], dtype=object) == 'EMERGENCY',
+                        dose * EMERGENCY_DOSE_FACTOR, dose)
+        dose = np.where(age < 18, dose * (age / 18), dose)
+        if 'dose' in columns:
+            given = np.asarray(columns['dose'], dtype=np.float64)
+            dose = np.where(np.isnan(given), dose, given)
+        return dose / self.drug_max[known] * 100
+
+    def classify(self, columns):
+        """الفئات لأعمدة كاملة (DataFrame أو قاموس العمود -> مصفوفة)؛ UNKNOWN_CLASS لدواء غير معروف"""
+        codes = self.drug_keys.get_indexer(np.asarray(columns['drug'], dtype=object))
+        route_risk = _risk_lookup(columns['route'], *self.features.route_table_)
+        diagnosis_risk = _risk_lookup(columns['diagnosis'], *self.features.diagnosis_table_)
+        classes = classify_dosage(
+            self.dose_percentage(columns, codes),
+            np.asarray(columns['age'], dtype=np.float64),
+            np.asarray(columns['admission_type'], dtype=object) == 'EMERGENCY',
+            route_risk, diagnosis_risk, route_risk * diagnosis_risk,
+            self.drug_age_sensitive[np.where(codes >= 0, codes, 0)])
+        classes[codes < 0] = UNKNOWN_CLASS
+        return classes
+
+    def row_dose_percentage(self, row):
+        """نفس dose_percentage لقاموس مريض واحد دون NumPy"""
+        mid, high = self.drug_doses[row['drug']]
+        dose = row.get('dose')
+        if dose is None or dose != dose:
+            age, weight = float(row['age']), float(row['weight'])
+            age_adjustment = 1.0
+            if DRUGS_WITH_TYPICAL_DOSES[row['drug']]['age_factor']:
+                if age < 18:
+                    age_adjustment = age / 18 * 0.7 + 0.3
+                elif age > 65:
+                    age_adjustment = 1 - ((age - 65) / 25) * 0.3
+            dose = mid * (weight / REFERENCE_WEIGHT) * age_adjustment
+            if row['admission_type'] == 'EMERGENCY':
+                dose = dose * EMERGENCY_DOSE_FACTOR
+            if age < 18:
+                dose = dose * (age / 18)
+        return dose / high * 100
+
+    def classify_row(self, row):
+        """فئة مريض واحد (ميكروثوانٍ، قواميس فقط)؛ UNKNOWN_CLASS لدواء غير معروف"""
+        if row['drug'] not in self.drug_doses:
+            return UNKNOWN_CLASS
+        features = self.features
+        route_risk = features.route_risk_.get(row['route'], features.unknown_risk)
+        diagnosis_risk = features.diagnosis_risk_.get(row['diagnosis'], features.unknown_risk)
+        return classify_dosage_row({
+            'dose_percentage': self.row_dose_percentage(row),
+            'age': row['age'],
+            'admission_type': row['admission_type'],
+            'route_risk': route_risk,
+            'diagnosis_risk': diagnosis_risk,
+            'risk_interaction': route_risk * diagnosis_risk,
+            'drug': row['drug'],
+        })
+
+
+class ShadowComparator:
+    """مقارنة توقعات النموذج مع القواعد في thread خلفي
+
+    مسار الطلب يضيف (الإصدار, الصفوف, التوقعات) إلى طابور محدود ولا ينتظر؛
+    عند امتلاء الطابور تُسقط المقارنة وتُعد بدلاً من إبطاء الطلب
+    """
+
+    def __init__(self, rules, max_queue=1000, log_path=None, recent=100):
+        self.rules = rules
+        self.log_path = log_path
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.recent = deque(maxlen=recent)
+        # (إصدار النموذج, النتيجة) -> عدد الصفوف؛ النتيجة agree أو disagree أو unknown_drug
+        self.counts = {}
+        self.dropped = 0
+
+    def submit(self, version, rows, predictions):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="rules-shadow", daemon=True)
+                    self._thread.start()
+        try:
+            self._queue.put_nowait((version, rows, predictions))
+        except queue.Full:
+            with self._lock:
+                self.dropped += len(rows)
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            # كل ما تراكم في الطابور يُقيَّم باستدعاء متجه واحد
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.compare(items)
+            except Exception as e:
+                print(f"Rules shadow comparison failed: {str(e)}")
+            finally:
+                for _ in items:
+                    self._queue.task_done()
+
+    def compare(self, items):
+        rows = [row for _, batch, _ in items for row in batch]
+        versions = [version for version, batch, _ in items for _ in batch]
+        predictions = np.array([p for _, _, batch in items for p in batch], dtype=np.int64)
+        columns = {column: [row.get(column) for row in rows]
+                   for column in ('age', 'weight', 'drug', 'route', 'admission_type', 'diagnosis')}
+        rule_classes = self.rules.classify(columns)
+        outcomes = np.where(rule_classes == UNKNOWN_CLASS, 'unknown_drug',
+                            np.where(rule_classes == predictions, 'agree', 'disagree'))
+
+        disagreements = []
+        for i in np.flatnonzero(outcomes == 'disagree'):
+            disagreements.append({
+                'model_version': versions[i],
+                'model_class': int(predictions[i]),
+                'rules_class': int(rule_classes[i]),
+                'patient': {k: (v.item() if isinstance(v, np.generic) else v) for k, v in rows[i].items()},
+            })
+        with self._lock:
+            for version, outcome in zip(versions, outcomes):
+                key = (version, str(outcome))
+                self.counts[key] = self.counts.get(key, 0) + 1
+            self.recent.extend(disagreements)
+        if disagreements and self.log_path:
+            with open(self.log_path, 'a', encoding='utf-8') as f:
+                for record in disagreements:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def wait(self):
+        """انتظار تقييم كل ما أُرسل (للفحوص وأدوات القياس)"""
+        self._queue.join()
+
+    def totals(self):
+        """عدد الصفوف لكل نتيجة عبر كل الإصدارات"""
+        with self._lock:
+            totals = {}
+            for (_, outcome), count in self.counts.items():
+                totals[outcome] = totals.get(outcome, 0) + count
+            return totals
+
+    def stats(self):
+        totals = self.totals()
+        with self._lock:
+            compared = totals.get('agree', 0) + totals.get('disagree', 0)
+            return {
+                "queue_length": self._queue.qsize(),
+                "dropped": self.dropped,
+                "counts": totals,
+                "agreement_rate": totals.get('agree', 0) / compared if compared else None,
+                "by_model_version": {f"{version}/{outcome}": count
+                                     for (version, outcome), count in sorted(self.counts.items())},
+                "recent_disagreements": list(self.recent),
+            }
+
+
+def check_consistency(n_rows=200_000, seed=0):
+    """يعيد عدد الاختلافات: القواعد مع الجرعة المولّدة مقابل فئات التدريب،
+    والمسار المتجه مقابل مسار الصف الواحد بجرعة مقدّرة (مع دواء وطريقة غير معروفين)"""
+    frame = chunk_to_frame(generate_chunk(n_rows, seed))
+    columns = {column: frame[column].astype(object).to_numpy()
+               for column in ('drug', 'route', 'admission_type', 'diagnosis')}
+    columns['age'] = frame['age'].to_numpy()
+    columns['weight'] = frame['weight'].to_numpy()
+    rules = DosageRules()
+
+    labelled = rules.classify(dict(columns, dose=frame['dose_val_rx'].to_numpy()))
+    report = {'training_labels': int(np.sum(labelled != frame['dosage_class'].to_numpy()))}
+
+    columns['drug'][::97] = 'Unknown drug'
+    columns['route'][::89] = 'Unknown route'
+    estimated = rules.classify(columns)
+    records = pd.DataFrame(columns).to_dict('records')
+    per_row = np.array([rules.classify_row(row) for row in records], dtype=np.int64)
+    report['per_row'] = int(np.sum(estimated != per_row))
+    return report
+
+
+def benchmark(n_rows=1_000_000, seed=0):
+    """زمن تقييم القواعد فقط على n_rows صف (أعمدة نصية كما تصل من الطلبات) ولصف واحد"""
+    frame = chunk_to_frame(generate_chunk(n_rows, seed))
+    columns = {column: frame[column].astype(object).to_numpy()
+               for column in ('drug', 'route', 'admission_type', 'diagnosis')}
+    columns['age'] = frame['age'].to_numpy()
+    columns['weight'] = frame['weight'].to_numpy()
+    rules = DosageRules()
+
+    start = time.perf_counter()
+    classes = rules.classify(columns)
+    vectorized = time.perf_counter() - start
+
+    row = {column: values[0] for column, values in columns.items()}
+    repeats = 10_000
+    start = time.perf_counter()
+    for _ in range(repeats):
+        rules.classify_row(row)
+    per_row = (time.perf_counter() - start) / repeats
+    return {
+        'rows': n_rows,
+        'vectorized_seconds': vectorized,
+        'rows_per_second': n_rows / vectorized,
+        'single_row_microseconds': per_row * 1e6,
+        'class_counts': np.bincount(classes, minlength=4).tolist(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and benchmark the dosage rules engine")
+    parser.add_argument('--check-rows', type=int, default=200_000)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--skip-benchmark', action='store_true')
+    args = parser.parse_args()
+
+    report = check_consistency(args.check_rows)
+    print(f"Rules checked on {args.check_rows} rows: " +
+          ", ".join(f"{name}={count} mismatches" for name, count in report.items()))
+    if not args.skip_benchmark:
+        print(json.dumps(benchmark(args.rows), indent=2))
+    raise SystemExit(1 if any(report.values()) else 0)
+
+
+if __name__ == "__main__":
+    main()
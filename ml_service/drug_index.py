@@ -0,0 +1,113 @@
+import bisect
+from collections import defaultdict
+from difflib import SequenceMatcher
+from functools import lru_cache
+
+import numpy as np
+
+# فهرس n-gram للأحرف لمطابقة أسماء الأدوية التقريبية
+# يربط كل أشكال الاسم (الاسم التجاري، العلمي، POE) بالاسم الذي تدرب عليه النموذج
+# بحيث لا تُقارن SequenceMatcher إلا مع عدد صغير من المرشحين مهما كبر المعجم
+
+
+def normalize_name(name):
+    return " ".join(str(name).lower().split())
+
+
+class DrugIndex:
+    """فهرس مقلوب من n-gram إلى أشكال أسماء الأدوية"""
+
+    def __init__(self, names, aliases=None, ngram=3, candidates=20, memo_size=10000):
+        self.ngram = ngram
+        self.n_candidates = candidates
+        self.canonical = sorted({str(name) for name in names})
+        canonical_set = set(self.canonical)
+
+        # كل شكل للاسم (بعد التطبيع) -> الاسم المعتمد
+        variants = {normalize_name(name): name for name in self.canonical}
+        for alias, name in (aliases or {}).items():
+            if str(name) in canonical_set:
+                variants.setdefault(normalize_name(alias), str(name))
+
+        self.variants = sorted(variants)
+        self.variant_drug = [variants[v] for v in self.variants]
+        self.exact = variants
+
+        postings = defaultdict(list)
+        gram_counts = np.zeros(len(self.variants), dtype=np.int32)
+        for i, variant in enumerate(self.variants):
+            grams = self._grams(variant)
+            gram_counts[i] = len(grams)
+            for gram in grams:
+                postings[gram].append(i)
+        self.postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+        self.gram_counts = gram_counts
+
+        # ذاكرة للأسماء التي تم حلها (بما فيها الأخطاء الإملائية المتكررة)
+        self.resolve = lru_cache(maxsize=memo_size)(self._resolve)
+
+    def __len__(self):
+        return len(self.variants)
+
+    def _grams(self, text):
+        padded = f" {text} "
+        if len(padded) <= self.ngram:
+            return {padded}
+        return {padded[i:i + self.ngram] for i in range(len(padded) - self.ngram + 1)}
+
+    def candidates(self, query, limit=None):
+        """أقرب أشكال الأسماء حسب معامل Dice على n-gram؛ يعيد [(فهرس, الدرجة)]"""
+        limit = limit or self.n_candidates
+        grams = self._grams(query)
+        counts = np.zeros(len(self.variants), dtype=np.int32)
+        for gram in grams:
+            ids = self.postings.get(gram)
+            if ids is not None:
+                counts[ids] += 1
+        matched = np.flatnonzero(counts)
+        if len(matched) == 0:
+            return []
+        scores = 2.0 * counts[matched] / (len(grams) + self.gram_counts[matched])
+        if len(matched) > limit:
+            top = np.argpartition(-scores, limit)[:limit]
+            matched, scores = matched[top], scores[top]
+        order = np.argsort(-scores, kind='stable')
+        return [(int(matched[i]), float(scores[i])) for i in order]
+
+    def _resolve(self, name, threshold=0.7):
+        """الاسم المعتمد لأقرب دواء، أو None إذا لم يتجاوز التشابه الحد"""
+        query = normalize_name(name)
+        if query in self.exact:
+            return self.exact[query]
+
+        best_match = None
+        best_ratio = 0
+        for i, _ in self.candidates(query):
+            ratio = SequenceMatcher(None, query, self.variants[i]).ratio()
+            if ratio > best_ratio and ratio > threshold:
+                best_ratio = ratio
+                best_match = self.variant_drug[i]
+        return best_match
+
+    def search(self, prefix, limit=10):
+        """الإكمال التلقائي: الأسماء التي تبدأ بالنص أولاً ثم الأقرب تقريبياً"""
+        query = normalize_name(prefix)
+        if not query:
+            return []
+        results = []
+        seen = set()
+
+        start = bisect.bisect_left(self.variants, query)
+        for i in range(start, len(self.variants)):
+            if len(results) >= limit or not self.variants[i].startswith(query):
+                break
+            results.append({"name": self.variants[i], "drug": self.variant_drug[i], "score": 1.0})
+            seen.add(i)
+
+        for i, score in self.candidates(query, limit * 2):
+            if len(results) >= limit:
+                break
+            if i not in seen:
+                results.append({"name": self.variants[i], "drug": self.variant_drug[i], "score": round(score, 3)})
+                seen.add(i)
+        return results
@@ -0,0 +1,247 @@
+import argparse
+import time
+from bisect import bisect_left
+
+import numpy as np
+import pandas as pd
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.pipeline import Pipeline
+
+from synthetic_data import ROUTES_RISK, DIAGNOSIS_SEVERITY, AGE_BINS, WEIGHT_BINS, bin_codes
+
+# الأعمدة المشتقة (خطورة طريقة الإعطاء والتشخيص، BMI، فئات العمر والوزن) تُحسب في خطوة
+# واحدة داخل Pipeline المحفوظ، فيمر التدريب والواجهة بنفس الكود ونفس الجداول:
+#   Pipeline([('preprocessor', Pipeline([('features', DosageFeatures()), ('columns', ColumnTransformer)])),
+#             ('classifier', ...)])
+# المسار المتجه: بحث في جداول NumPy بفهارس pd.Index و searchsorted للفئات
+# مسار الصف الواحد (CompiledFeaturizer.transform_one): قواميس و bisect بنفس الحساب
+
+# أعمدة المريض كما يرسلها مسار الطلب
+BASE_FEATURES = ['age', 'weight', 'drug', 'route', 'gender', 'admission_type', 'diagnosis']
+DERIVED_FEATURES = ['route_risk', 'diagnosis_risk', 'risk_interaction', 'bmi', 'age_group', 'weight_group']
+# خطورة طريقة إعطاء أو تشخيص غير معروفين (ومنها "Not specified")
+UNKNOWN_RISK = 0
+# أصغر عمر في بيانات التدريب؛ الأعمار الأصغر (حديثو الولادة) تأخذ BMI هذا العمر بدل قسمة على صفر
+MIN_BMI_AGE = 1.0
+
+
+def _risk_table(table, default):
+    """(فهرس القيم، الخطورة لكل قيمة وفي آخرها default) للبحث المتجه"""
+    keys = pd.Index(list(table))
+    # آخر عنصر = default فيقع عليه الفهرس -1 (غير موجود)
+    return keys, np.append(np.array([table[key] for key in keys], dtype=np.int64), default)
+
+
+def _risk_lookup(values, keys, risks):
+    if isinstance(getattr(values, 'dtype', None), pd.CategoricalDtype):
+        # عمود category: بحث واحد لكل فئة ثم أخذ بالرموز
+        per_category = np.append(risks[keys.get_indexer(values.cat.categories)], risks[-1])
+        return per_category[np.asarray(values.cat.codes)]
+    return risks[keys.get_indexer(np.asarray(values, dtype=object))]
+
+
+def _bin_code(value, edges):
+    """نفس bin_codes لقيمة واحدة (bisect_left == searchsorted side='left')"""
+    code = bisect_left(edges, value) - 1
+    return code if 0 <= code < len(edges) - 1 else -1
+
+
+class DosageFeatures(BaseEstimator, TransformerMixin):
+    """يضيف الأعمدة المشتقة إلى أعمدة المريض؛ الأعمدة المشتقة في المدخلات تُحسب من جديد دائماً
+
+    الجداول تُنسخ إلى النموذج عند fit فلا يتغير نموذج محفوظ إذا تغيرت الثوابت لاحقاً
+    """
+
+    def __init__(self, route_risk=None, diagnosis_risk=None, age_bins=None, weight_bins=None,
+                 unknown_risk=UNKNOWN_RISK):
+        self.route_risk = route_risk
+        self.diagnosis_risk = diagnosis_risk
+        self.age_bins = age_bins
+        self.weight_bins = weight_bins
+        self.unknown_risk = unknown_risk
+
+    def fit(self, X, y=None):
+        self.route_risk_ = dict(ROUTES_RISK if self.route_risk is None else self.route_risk)
+        self.diagnosis_risk_ = dict(DIAGNOSIS_SEVERITY if self.diagnosis_risk is None else self.diagnosis_risk)
+        self.age_bins_ = [float(b) for b in (AGE_BINS if self.age_bins is None else self.age_bins)]
+        self.weight_bins_ = [float(b) for b in (WEIGHT_BINS if self.weight_bins is None else self.weight_bins)]
+        # نفس الجداول بصيغة البحث المتجه
+        self.route_table_ = _risk_table(self.route_risk_, self.unknown_risk)
+        self.diagnosis_table_ = _risk_table(self.diagnosis_risk_, self.unknown_risk)
+        self.age_edges_ = np.asarray(self.age_bins_)
+        self.weight_edges_ = np.asarray(self.weight_bins_)
+        # أعمدة الإدخال اللازمة فقط (المشتقة لا يلزم إرسالها)
+        columns = list(X.columns) if hasattr(X, 'columns') else list(BASE_FEATURES)
+        self.feature_names_in_ = np.array([c for c in columns if c not in DERIVED_FEATURES], dtype=object)
+        self.n_features_in_ = len(self.feature_names_in_)
+        return self
+
+    def derive_columns(self, columns):
+        """الأعمدة المشتقة لأعمدة كاملة (DataFrame أو قاموس العمود -> مصفوفة)"""
+        age = np.asarray(columns['age'], dtype=np.float64)
+        weight = np.asarray(columns['weight'], dtype=np.float64)
+        route_risk = _risk_lookup(columns['route'], *self.route_table_)
+        diagnosis_risk = _risk_lookup(columns['diagnosis'], *self.diagnosis_table_)
+        # نفس تقريب الطول في synthetic_data.py؛ height * height مطابق لـ ** 2 في NumPy ولـ Python
+        height = np.maximum(age, MIN_BMI_AGE) / 100
+        bmi = weight / (height * height)
+        return {
+            'route_risk': route_risk,
+            'diagnosis_risk': diagnosis_risk,
+            'risk_interaction': route_risk * diagnosis_risk,
+            'bmi': bmi,
+            'age_group': bin_codes(age, self.age_edges_),
+            'weight_group': bin_codes(weight, self.weight_edges_),
+        }
+
+    def derive_row(self, row):
+        """نفس derive_columns لقاموس مريض واحد دون NumPy"""
+        age, weight = float(row['age']), float(row['weight'])
+        route_risk = self.route_risk_.get(row['route'], self.unknown_risk)
+        diagnosis_risk = self.diagnosis_risk_.get(row['diagnosis'], self.unknown_risk)
+        # max يعيد age إذا كان nan مثل np.maximum
+        height = max(age, MIN_BMI_AGE) / 100
+        bmi = weight / (height * height)
+        return {
+            'route_risk': route_risk,
+            'diagnosis_risk': diagnosis_risk,
+            'risk_interaction': route_risk * diagnosis_risk,
+            'bmi': bmi,
+            'age_group': _bin_code(age, self.age_bins_),
+            'weight_group': _bin_code(weight, self.weight_bins_),
+        }
+
+    def transform(self, X):
+        frame = X if isinstance(X, pd.DataFrame) else pd.DataFrame(X)
+        # DataFrame واحد من القاموس بدل إدراج الأعمدة واحداً واحداً (أسرع بكثير للصفوف القليلة)
+        data = {column: frame[column] for column in frame.columns if column not in DERIVED_FEATURES}
+        data.update(self.derive_columns(frame))
+        return pd.DataFrame(data, index=frame.index, copy=False)
+
+    def get_feature_names_out(self, input_features=None):
+        return np.array(list(self.feature_names_in_) + DERIVED_FEATURES, dtype=object)
+
+
+def with_engineered_features(column_transformer):
+    """المعالجة المسبقة الكاملة: الأعمدة المشتقة ثم ColumnTransformer"""
+    return Pipeline([('features', DosageFeatures()), ('columns', column_transformer)])
+
+
+def split_preprocessor(preprocessor):
+    """(DosageFeatures أو None، المحوّل الأخير) من المعالجة المسبقة المحفوظة"""
+    steps = getattr(preprocessor, 'steps', None)
+    if steps and len(steps) == 2 and isinstance(steps[0][1], DosageFeatures):
+        return steps[0][1], steps[1][1]
+    return None, preprocessor
+
+
+# ---------------------------------------------------------------- الاتساق والقياس
+
+def reference_features(frame):
+    """طريقة advanced_model.py الأصلية: قوائم Python للخطورة و pd.cut للفئات (للمقارنة فقط)"""
+    out = pd.DataFrame(index=frame.index)
+    out['route_risk'] = [ROUTES_RISK.get(route, UNKNOWN_RISK) for route in frame['route']]
+    out['diagnosis_risk'] = [DIAGNOSIS_SEVERITY.get(diag, UNKNOWN_RISK) for diag in frame['diagnosis']]
+    out['bmi'] = frame['weight'] / ((frame['age'].clip(lower=MIN_BMI_AGE) / 100) ** 2)
+    out['risk_interaction'] = out['route_risk'] * out['diagnosis_risk']
+    out['age_group'] = pd.cut(frame['age'], bins=AGE_BINS, labels=False).fillna(-1).astype(np.int64)
+    out['weight_group'] = pd.cut(frame['weight'], bins=WEIGHT_BINS, labels=False).fillna(-1).astype(np.int64)
+    return out
+
+
+def _mismatches(expected, actual):
+    expected, actual = np.asarray(expected, dtype=np.float64), np.asarray(actual, dtype=np.float64)
+    return int(np.sum(~((expected == actual) | (np.isnan(expected) & np.isnan(actual)))))
+
+
+def check_consistency(n_rows=100_000, seed=0):
+    """عدد الاختلافات لكل عمود مشتق بين: مولّد بيانات التدريب، المسار المتجه، مسار الصف الواحد، والطريقة الأصلية (pd.cut)
+
+    تشمل الصفوف قيماً غير معروفة وأعماراً وأوزاناً خارج الفئات وعلى حدودها تماماً
+    """
+    from synthetic_data import generate_dataset
+
+    frame = generate_dataset(n_rows, seed=seed)
+    ages = np.concatenate([AGE_BINS, WEIGHT_BINS, [-1.0, 150.0, np.nan]])
+    n_extra = len(ages)
+    extra = pd.DataFrame({
+        'age': ages,
+        'weight': np.concatenate([WEIGHT_BINS, AGE_BINS, [250.0, -5.0, 70.0]]),
+        'route': (['Unknown route', None, 'IV'] * n_extra)[:n_extra],
+        'diagnosis': (['Not specified', None, 'Stroke'] * n_extra)[:n_extra],
+    })
+    features = DosageFeatures().fit(frame[BASE_FEATURES])
+    vectorized = features.transform(frame[BASE_FEATURES])
+    edge_rows = features.transform(extra)
+    reference = reference_features(pd.concat([frame[['age', 'weight', 'route', 'diagnosis']], extra],
+                                             ignore_index=True))
+    records = pd.concat([frame[['age', 'weight', 'route', 'diagnosis']], extra],
+                        ignore_index=True).astype(object).to_dict('records')
+    per_row = pd.DataFrame([features.derive_row(row) for row in records])
+
+    report = {}
+    for column in DERIVED_FEATURES:
+        combined = np.concatenate([vectorized[column].to_numpy(), edge_rows[column].to_numpy()])
+        generator = frame[column].cat.codes if column in ('age_group', 'weight_group') else frame[column]
+        report[column] = {
+            'generator': _mismatches(generator, vectorized[column]),
+            'per_row': _mismatches(combined, per_row[column]),
+            'pandas_reference': _mismatches(reference[column], combined),
+        }
+    return report
+
+
+def benchmark(sizes=(1, 1_000, 1_000_000), seed=0):
+    """زمن الأعمدة المشتقة: الطريقة الأصلية (قوائم + pd.cut)، DosageFeatures المتجه، و derive_row لصف واحد"""
+    from synthetic_data import generate_dataset
+
+    results = []
+    frame = generate_dataset(max(sizes), seed=seed)[BASE_FEATURES]
+    features = DosageFeatures().fit(frame)
+    for n in sizes:
+        part = frame.iloc[:n]
+        row = part.astype(object).iloc[0].to_dict()
+        result = {'rows': n}
+        repeats = max(1, 20_000 // n)
+        for name, run in (('pandas_cut', lambda: reference_features(part)),
+                          ('vectorized', lambda: features.transform(part))):
+            start = time.perf_counter()
+            for _ in range(repeats):
+                run()
+            result[name + '_s'] = (time.perf_counter() - start) / repeats
+        if n == 1:
+            start = time.perf_counter()
+            for _ in range(20_000):
+                features.derive_row(row)
+            result['per_row_s'] = (time.perf_counter() - start) / 20_000
+        results.append(result)
+    return results
+
+
+def format_benchmark(results):
+    lines = [f"{'rows':>10}{'lists + pd.cut':>18}{'vectorized':>14}{'derive_row':>14}"]
+    for r in results:
+        per_row = f"{r['per_row_s'] * 1e6:.1f} us" if 'per_row_s' in r else '-'
+        lines.append(f"{r['rows']:>10}{r['pandas_cut_s'] * 1e3:>15.2f} ms{r['vectorized_s'] * 1e3:>11.2f} ms"
+                     f"{per_row:>14}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and benchmark the shared derived-feature transformer")
+    parser.add_argument('--check-rows', type=int, default=100_000)
+    parser.add_argument('--sizes', type=int, nargs='*', default=[1, 1_000, 1_000_000])
+    parser.add_argument('--skip-benchmark', action='store_true')
+    args = parser.parse_args()
+
+    report = check_consistency(args.check_rows)
+    failures = sum(count for column in report.values() for count in column.values())
+    for column, counts in report.items():
+        print(f"{column:<18}" + "  ".join(f"{name}={count}" for name, count in counts.items()))
+    if not args.skip_benchmark:
+        print(format_benchmark(benchmark(args.sizes)))
+    raise SystemExit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+import sys
+import threading
+
+import numpy as np
+
+from feature_engineering import split_preprocessor
+
+# مُحوِّل ميزات مُجمَّع من ColumnTransformer المدرب:
+# يقرأ متوسطات وانحرافات StandardScaler ومفردات OneHotEncoder من النموذج المحفوظ
+# ويكتب متجه الميزات مباشرة في مصفوفة NumPy دون pandas أو تحقق sklearn
+# (مع خطوة DosageFeatures قبله: الأعمدة المشتقة تُحسب بنفس جداولها لكل صف أو لأعمدة كاملة)
+
+
+class NotCompilableError(ValueError):
+    """النموذج يحتوي على خطوة معالجة لا يدعمها المحوّل المجمّع"""
+
+
+def unwrap_pipeline(model):
+    """إرجاع Pipeline الفعلي (GridSearchCV يحفظ أفضل نموذج داخل best_estimator_)"""
+    return getattr(model, 'best_estimator_', model)
+
+
+def _single_step(transformer):
+    """استخراج المحوّل الوحيد من Pipeline بخطوة واحدة"""
+    steps = getattr(transformer, 'steps', None)
+    if steps is None:
+        return transformer
+    if len(steps) != 1:
+        raise NotCompilableError(f"Unsupported transformer chain: {[name for name, _ in steps]}")
+    return steps[0][1]
+
+
+def _lookup_key(value):
+    """توحيد مفاتيح القاموس (numpy.int64 و int لهما نفس المفتاح)"""
+    return value.item() if isinstance(value, np.generic) else value
+
+
+class CompiledFeaturizer:
+    """نسخة مجمّعة من preprocessor + classifier في Pipeline مدرب"""
+
+    def __init__(self, pipeline):
+        pipeline = unwrap_pipeline(pipeline)
+        steps = getattr(pipeline, 'steps', None)
+        if not steps or len(steps) != 2:
+            raise NotCompilableError("Expected a (preprocessor, classifier) pipeline")
+        # الأعمدة المشتقة (إن وُجدت خطوتها) ثم ColumnTransformer
+        self.features, preprocessor = split_preprocessor(steps[0][1])
+        self.classifier = steps[-1][1]
+        self.classes_ = np.asarray(self.classifier.classes_)
+        # الكائن الذي يحسب الاحتمالات (المصنف الأصلي أو بديل مكافئ له)
+        self.scorer = self.classifier
+
+        if not hasattr(preprocessor, 'transformers_'):
+            raise NotCompilableError("Preprocessor is not a fitted ColumnTransformer")
+
+        # الأعمدة العددية: (العمود, موضعه في المخرجات, المتوسط, الانحراف)
+        numeric = []
+        # الأعمدة التصنيفية: (العمود, بداية الكتلة, قاموس الفئة -> الموضع, تجاهل المجهول)
+        categorical = []
+        offset = 0
+        for name, transformer, columns in preprocessor.transformers_:
+            if isinstance(transformer, str):
+                if transformer == 'drop':
+                    continue
+                raise NotCompilableError(f"Unsupported transformer '{transformer}' for {name}")
+            step = _single_step(transformer)
+            step_type = type(step).__name__
+
+            if step_type == 'StandardScaler':
+                mean = step.mean_ if step.with_mean else np.zeros(len(columns))
+                scale = step.scale_ if step.with_std else np.ones(len(columns))
+                for i, column in enumerate(columns):
+                    numeric.append((column, offset + i, mean[i], scale[i]))
+                offset += len(columns)
+            elif step_type == 'OneHotEncoder':
+                if step.drop_idx_ is not None or getattr(step, '_infrequent_enabled', False):
+                    raise NotCompilableError("OneHotEncoder with drop/infrequent categories is not supported")
+                ignore_unknown = step.handle_unknown != 'error'
+                for column, categories in zip(columns, step.categories_):
+                    vocabulary = {_lookup_key(value): i for i, value in enumerate(categories)}
+                    categorical.append((column, offset, vocabulary, ignore_unknown))
+                    offset += len(categories)
+            else:
+                raise NotCompilableError(f"Unsupported transformer {step_type} for {name}")
+
+        self.n_features = offset
+        self.numeric_columns = [c[0] for c in numeric]
+        self.numeric_positions = np.array([c[1] for c in numeric], dtype=np.intp)
+        self.numeric_mean = np.array([c[2] for c in numeric], dtype=np.float64)
+        self.numeric_scale = np.array([c[3] for c in numeric], dtype=np.float64)
+        self.categorical = categorical
+        self.input_columns = self.numeric_columns + [c[0] for c in categorical]
+        if self.features is not None:
+            # المشتقة تُحسب هنا ولا تُرسل
+            self.input_columns = list(self.features.feature_names_in_)
+        self._local = threading.local()
+
+    def _row_buffer(self):
+        """مصفوفة صف واحد محجوزة مسبقاً لكل thread"""
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None:
+            buffer = np.zeros((1, self.n_features), dtype=np.float64)
+            self._local.buffer = buffer
+            self._local.numeric = np.empty(len(self.numeric_columns), dtype=np.float64)
+        return buffer
+
+    def transform_one(self, row):
+        """تحويل قاموس مريض واحد إلى صف ميزات (مطابق لـ preprocessor.transform)"""
+        if self.features is not None:
+            row = dict(row, **self.features.derive_row(row))
+        buffer = self._row_buffer()
+        buffer.fill(0.0)
+        out = buffer[0]
+
+        numeric = self._local.numeric
+        for i, column in enumerate(self.numeric_columns):
+            numeric[i] = row[column]
+        # نفس ترتيب العمليات في StandardScaler.transform: X -= mean ثم X /= scale
+        numeric -= self.numeric_mean
+        numeric /= self.numeric_scale
+        out[self.numeric_positions] = numeric
+
+        for column, start, vocabulary, ignore_unknown in self.categorical:
+            index = vocabulary.get(row[column])
+            if index is not None:
+                out[start + index] = 1.0
+            elif not ignore_unknown:
+                raise ValueError(f"Found unknown category '{row[column]}' in column '{column}'")
+        return buffer
+
+    def transform(self, rows):
+        """تحويل قائمة من قواميس المرضى إلى مصفوفة ميزات"""
+        if len(rows) == 1:
+            return self.transform_one(rows[0]).copy()
+        if self.features is not None:
+            # عمود لكل ميزة ثم المسار المتجه (الأعمدة المشتقة تحتاج المصفوفات كاملة)
+            return self.transform_columns({column: np.array([row[column] for row in rows], dtype=object)
+                                           for column in self.input_columns})
+
+        n_rows = len(rows)
+        X = np.zeros((n_rows, self.n_features), dtype=np.float64)
+        numeric = np.array([[row[c] for c in self.numeric_columns] for row in rows], dtype=np.float64)
+        numeric -= self.numeric_mean
+        numeric /= self.numeric_scale
+        X[:, self.numeric_positions] = numeric
+
+        row_index = np.arange(n_rows)
+        for column, start, vocabulary, ignore_unknown in self.categorical:
+            codes = np.fromiter((vocabulary.get(row[column], -1) for row in rows), dtype=np.intp, count=n_rows)
+            known = codes >= 0
+            if not ignore_unknown and not known.all():
+                unknown = rows[int(np.argmin(known))][column]
+                raise ValueError(f"Found unknown category '{unknown}' in column '{column}'")
+            X[row_index[known], start + codes[known]] = 1.0
+        return X
+
+    def transform_columns(self, columns):
+        """تحويل أعمدة كاملة (قاموس العمود -> مصفوفة) دون بناء قاموس لكل صف
+
+        القيم التصنيفية تُرمَّز مرة واحدة لكل قيمة فريدة
+        """
+        if self.features is not None:
+            columns = dict(columns, **self.features.derive_columns(columns))
+        n_rows = len(columns[self.input_columns[0]])
+        X = np.zeros((n_rows, self.n_features), dtype=np.float64)
+        numeric = np.column_stack([np.asarray(columns[c], dtype=np.float64) for c in self.numeric_columns])
+        numeric -= self.numeric_mean
+        numeric /= self.numeric_scale
+        X[:, self.numeric_positions] = numeric
+
+        row_index = np.arange(n_rows)
+        for column, start, vocabulary, ignore_unknown in self.categorical:
+            uniques, inverse = np.unique(np.asarray(columns[column]), return_inverse=True)
+            unique_codes = np.array([vocabulary.get(_lookup_key(u), -1) for u in uniques], dtype=np.intp)
+            if not ignore_unknown and (unique_codes < 0).any():
+                unknown = uniques[int(np.argmin(unique_codes))]
+                raise ValueError(f"Found unknown category '{unknown}' in column '{column}'")
+            codes = unique_codes[inverse.reshape(-1)]
+            known = codes >= 0
+            X[row_index[known], start + codes[known]] = 1.0
+        return X
+
+    def use_scorer(self, scorer):
+        """استبدال المصنف بكائن مكافئ يملك predict_proba و classes_ بنفس الترتيب"""
+        self.scorer = scorer
+
+    def predict_proba(self, rows):
+        """استدعاء المصنف مرة واحدة على الصفوف المحوّلة"""
+        if len(rows) == 1:
+            return self.scorer.predict_proba(self.transform_one(rows[0]))
+        return self.scorer.predict_proba(self.transform(rows))
+
+    def sample_rows(self, n, seed=0):
+        """صفوف اصطناعية تغطي كل الفئات المعروفة بالإضافة إلى قيمة مجهولة"""
+        rng = np.random.default_rng(seed)
+        rows = []
+        for i in range(n):
+            row = {}
+            for column, mean, scale in zip(self.numeric_columns, self.numeric_mean, self.numeric_scale):
+                if column in self.input_columns:
+                    row[column] = float(mean + scale * rng.normal())
+            for column, _, vocabulary, ignore_unknown in self.categorical:
+                if column not in self.input_columns:
+                    continue
+                values = list(vocabulary)
+                if ignore_unknown:
+                    values.append("__unknown__")
+                row[column] = values[(i + rng.integers(len(values))) % len(values)]
+            rows.append(row)
+        return rows
+
+    def compare_with_pipeline(self, pipeline, rows):
+        """مقارنة المخرجات مع Pipeline الأصلي؛ يعيد أكبر فرق مطلق (0.0 يعني تطابقاً تاماً)"""
+        import pandas as pd
+        frame = pd.DataFrame(rows, columns=self.input_columns)
+        expected_X = unwrap_pipeline(pipeline).steps[0][1].transform(frame)
+        if hasattr(expected_X, 'toarray'):
+            # ColumnTransformer يعيد مصفوفة sparse عندما تكون معظم القيم أصفاراً
+            expected_X = expected_X.toarray()
+        expected_proba = pipeline.predict_proba(frame)
+        compiled_X = self.transform(rows)
+        compiled_proba = np.vstack([self.classifier.predict_proba(self.transform_one(row)) for row in rows])
+        if not np.array_equal(np.asarray(expected_X), compiled_X):
+            return float(np.max(np.abs(np.asarray(expected_X) - compiled_X)))
+        return float(np.max(np.abs(expected_proba - compiled_proba)))
+
+
+def compile_pipeline(pipeline, verify_rows=64):
+    """تجميع النموذج والتحقق من تطابقه التام مع Pipeline الأصلي
+
+    يعيد None إذا لم يكن النموذج قابلاً للتجميع أو لم تتطابق المخرجات
+    """
+    try:
+        featurizer = CompiledFeaturizer(pipeline)
+    except (NotCompilableError, AttributeError) as e:
+        print(f"Compiled featurizer disabled: {str(e)}")
+        return None
+    if verify_rows:
+        difference = featurizer.compare_with_pipeline(pipeline, featurizer.sample_rows(verify_rows))
+        if difference != 0.0:
+            print(f"Compiled featurizer disabled: output differs from pipeline (max diff {difference})")
+            return None
+    return featurizer
+
+
+if __name__ == "__main__":
+    # فحص التطابق: python featurizer.py [dosage_model.bundle | dosage_model.pkl] [عدد الصفوف]
+    from model_bundle import load_model_files
+    model_path = sys.argv[1] if len(sys.argv) > 1 else None
+    n_rows = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    pipeline = unwrap_pipeline(load_model_files(model_path).model)
+    featurizer = CompiledFeaturizer(pipeline)
+    difference = featurizer.compare_with_pipeline(pipeline, featurizer.sample_rows(n_rows))
+    print(f"Features: {featurizer.n_features}, rows checked: {n_rows}, max difference: {difference}")
+    sys.exit(0 if difference == 0.0 else 1)
@@ -0,0 +1,457 @@
+import argparse
+import json
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import (ExtraTreesClassifier, GradientBoostingClassifier, RandomForestClassifier,
+                              VotingClassifier)
+from sklearn.exceptions import ConvergenceWarning
+from sklearn.neural_network import MLPClassifier
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+from sklearn.tree import BaseDecisionTree
+
+from model_files import file_version
+from model_bundle import load_model_files, save_like, frame_sha256
+from feature_engineering import BASE_FEATURES, split_preprocessor
+
+# تحديث النموذج المحفوظ بالوصفات الجديدة فقط بدل إعادة التدريب الكامل:
+# - إحصاءات StandardScaler تُحدَّث تراكمياً (partial_fit) وتُعدَّل عتبات الأشجار
+#   وأوزان الطبقة الأولى للشبكة بحيث تبقى توقعات الأعضاء الحاليين كما هي
+# - الغابات و Gradient Boosting و XGBoost تضيف أشجاراً جديدة مدرَّبة على الدفعة (warm start)
+# - الشبكة العصبية تأخذ خطوات partial_fit على الدفعة
+# - فحص الانحراف والدقة على بيانات مستبعدة قبل حفظ إصدار جديد
+# زمن التحديث يتناسب مع حجم الدفعة الجديدة لا مع كل البيانات السابقة
+
+TARGET_COLUMN = 'dosage_class'
+DEFAULT_NEW_TREES = 10
+DEFAULT_MLP_EPOCHS = 3
+MAX_ACCURACY_DROP = 0.005
+
+# حدود التنبيه بالانحراف
+DRIFT_MEAN_SHIFT = 0.5      # فرق المتوسط بوحدات الانحراف المعياري للتدريب
+DRIFT_UNSEEN_RATE = 0.05    # نسبة القيم الفئوية غير المعروفة للمشفر
+DRIFT_ACCURACY_GAP = 0.05   # دقة النموذج الحالي على الدفعة أقل من دقته على البيانات المستبعدة
+
+# مجموعات الأشجار التي تدعم warm_start بإضافة أشجار إلى estimators_
+TREE_ENSEMBLES = (RandomForestClassifier, ExtraTreesClassifier, GradientBoostingClassifier)
+
+
+class NotRemappable(Exception):
+    """مقدّر لا يمكن تعديل مدخلاته لتوافق إحصاءات التقييس الجديدة"""
+
+
+def split_model(model):
+    """(Pipeline، المعالجة المسبقة، المصنف) من النموذج المحفوظ (Pipeline أو GridSearchCV حوله)"""
+    pipeline = getattr(model, 'best_estimator_', model)
+    if not isinstance(pipeline, Pipeline) or len(pipeline.steps) < 2:
+        raise ValueError(f"Expected a preprocessing + classifier Pipeline, got {type(pipeline).__name__}")
+    preprocessor = pipeline.steps[0][1] if len(pipeline.steps) == 2 else pipeline[:-1]
+    return pipeline, preprocessor, pipeline.steps[-1][1]
+
+
+def scaler_slots(preprocessor):
+    """[(scaler، أعمدة الإدخال، ما قبله في الفرع، أعمدة المخرجات)] لكل StandardScaler يمكن تحديثه"""
+    if isinstance(preprocessor, StandardScaler):
+        return [(preprocessor, None, None, np.arange(preprocessor.n_features_in_))]
+    slots = []
+    if isinstance(preprocessor, ColumnTransformer):
+        for name, transformer, columns in preprocessor.transformers_:
+            before = None
+            if isinstance(transformer, Pipeline):
+                before = transformer[:-1] if len(transformer.steps) > 1 else None
+                transformer = transformer.steps[-1][1]
+            if isinstance(transformer, StandardScaler):
+                output = preprocessor.output_indices_[name]
+                slots.append((transformer, columns, before, np.arange(output.start, output.stop)))
+    return slots
+
+
+def _effective(scaler):
+    mean = scaler.mean_ if scaler.with_mean else np.zeros(scaler.n_features_in_)
+    scale = scaler.scale_ if scaler.with_std else np.ones(scaler.n_features_in_)
+    return mean.copy(), scale.copy()
+
+
+def _members(estimator):
+    """المقدّرات النهائية التي تستقبل مخرجات المعالجة المسبقة مباشرة"""
+    if isinstance(estimator, VotingClassifier):
+        for member in estimator.estimators_:
+            yield from _members(member)
+    else:
+        yield estimator
+
+
+def _check_remappable(estimator):
+    if isinstance(estimator, (*TREE_ENSEMBLES, BaseDecisionTree, MLPClassifier)):
+        return
+    if hasattr(estimator, 'get_booster') or hasattr(estimator, 'coef_'):
+        return
+    raise NotRemappable(type(estimator).__name__)
+
+
+def _anchors(old_values, new_values):
+    """قيم الدفعة بعد التقييس القديم (مرتبة) وصورها بالتقييس الجديد، كما تراها الأشجار (float32)"""
+    old, index = np.unique(old_values.astype(np.float32), return_index=True)
+    return old.astype(np.float64), new_values.astype(np.float32)[index]
+
+
+def _remap_thresholds(thresholds, a_j, b_j, anchors, strict):
+    """z_old = a * z_new + b، والشرط z_old <= t يكافئ z_new <= (t - b) / a
+
+    عتبة تقع على قيمة من البيانات تماماً (مثل رمز عددي في منتصف رمزين) يحدد اتجاهَ تلك القيمة
+    تقريبُ float32، فتُوضع على صورة القيمة الجديدة بحيث تبقى في نفس الفرع
+    strict: المقارنة x < t (XGBoost) بدلاً من x <= t (sklearn)
+    """
+    remapped = (thresholds - b_j) / a_j
+    old, new = anchors
+    if not len(old) or not len(thresholds):
+        return remapped
+    position = np.searchsorted(old, thresholds)
+    below, above = np.clip(position - 1, 0, len(old) - 1), np.clip(position, 0, len(old) - 1)
+    nearest = np.where(np.abs(old[below] - thresholds) <= np.abs(old[above] - thresholds), below, above)
+    tie = np.abs(old[nearest] - thresholds) <= np.spacing(np.abs(thresholds).astype(np.float32))
+    value = new[nearest]
+    if strict:
+        left = old[nearest] < thresholds
+        snapped = np.where(left, np.nextafter(value, np.float32(np.inf)), value)
+    else:
+        left = old[nearest] <= thresholds
+        snapped = np.where(left, value, np.nextafter(value, np.float32(-np.inf)))
+    return np.where(tie, snapped.astype(np.float64), remapped)
+
+
+def _remap_tree(tree, mapping):
+    threshold = tree.threshold
+    for column, a_j, b_j, anchors in mapping:
+        split = tree.feature == column
+        threshold[split] = _remap_thresholds(threshold[split], a_j, b_j, anchors, strict=False)
+
+
+def _remap_booster(estimator, mapping):
+    booster = estimator.get_booster()
+    raw = json.loads(booster.save_raw('json'))
+    for tree in raw['learner']['gradient_booster']['model']['trees']:
+        features = np.asarray(tree['split_indices'])
+        internal = np.asarray(tree['left_children']) != -1
+        # JSON يكتب العتبات بأقصر صيغة عشرية؛ التحويل إلى float32 يعيد قيمها الدقيقة
+        conditions = np.asarray(tree['split_conditions'], dtype=np.float32).astype(np.float64)
+        for column, a_j, b_j, anchors in mapping:
+            split = internal & (features == column)
+            conditions[split] = _remap_thresholds(conditions[split], a_j, b_j, anchors, strict=True)
+        tree['split_conditions'] = conditions.tolist()
+    booster.load_model(bytearray(json.dumps(raw).encode('utf-8')))
+
+
+def remap_inputs(estimator, mapping):
+    """تعديل المقدّر ليعطي على z_new نفس ما كان يعطيه على z_old = a * z_new + b
+
+    mapping: [(عمود المخرجات، a، b، anchors)]
+    """
+    columns = np.array([column for column, a_j, b_j, anchors in mapping])
+    a = np.array([a_j for column, a_j, b_j, anchors in mapping])
+    b = np.array([b_j for column, a_j, b_j, anchors in mapping])
+    if isinstance(estimator, BaseDecisionTree):
+        _remap_tree(estimator.tree_, mapping)
+    elif isinstance(estimator, TREE_ENSEMBLES):
+        for tree in np.ravel(estimator.estimators_):
+            _remap_tree(tree.tree_, mapping)
+    elif isinstance(estimator, MLPClassifier):
+        weights = estimator.coefs_[0]
+        estimator.intercepts_[0] += b @ weights[columns]
+        weights[columns] *= a[:, None]
+    elif hasattr(estimator, 'get_booster'):
+        _remap_booster(estimator, mapping)
+    elif hasattr(estimator, 'coef_'):
+        estimator.intercept_ += estimator.coef_[:, columns] @ b
+        estimator.coef_[:, columns] *= a
+    else:
+        raise NotRemappable(type(estimator).__name__)
+
+
+def refresh_scalers(preprocessor, classifier, X):
+    """partial_fit لكل StandardScaler ثم تعديل المصنف ليبقى مطابقاً؛ يعيد سبب التخطي أو None"""
+    features, preprocessor = split_preprocessor(preprocessor)
+    if features is not None:
+        X = features.transform(X)
+    slots = scaler_slots(preprocessor)
+    if not slots:
+        return "no StandardScaler feeding the classifier directly"
+    try:
+        for member in _members(classifier):
+            _check_remappable(member)
+    except NotRemappable as e:
+        return f"{e} cannot be remapped to new scaler statistics"
+    for scaler, columns, before, output in slots:
+        values = X if columns is None else X[columns]
+        if before is not None:
+            values = before.transform(values)
+        mean_old, scale_old = _effective(scaler)
+        scaled_old = scaler.transform(values)
+        scaler.partial_fit(values)
+        mean_new, scale_new = _effective(scaler)
+        scaled_new = scaler.transform(values)
+        a, b = scale_new / scale_old, (mean_new - mean_old) / scale_old
+        mapping = [(column, a[j], b[j], _anchors(scaled_old[:, j], scaled_new[:, j]))
+                   for j, column in enumerate(output)]
+        for member in _members(classifier):
+            remap_inputs(member, mapping)
+    return None
+
+
+def drift_report(preprocessor, X):
+    """مقارنة الدفعة بإحصاءات التدريب المحفوظة في المشفرات (قبل تحديثها)"""
+    numeric, categorical = {}, {}
+    features, preprocessor = split_preprocessor(preprocessor)
+    if features is not None:
+        X = features.transform(X)
+    for scaler, columns, before, output in scaler_slots(preprocessor):
+        if before is not None:
+            continue
+        values = X if columns is None else X[columns]
+        names = list(getattr(scaler, 'feature_names_in_', values.columns))
+        shift = np.abs(values.to_numpy(dtype=np.float64).mean(axis=0) - scaler.mean_) / scaler.scale_
+        numeric.update({name: float(s) for name, s in zip(names, shift)})
+    transformers = preprocessor.transformers_ if isinstance(preprocessor, ColumnTransformer) else []
+    for name, transformer, columns in transformers:
+        if isinstance(transformer, Pipeline) and len(transformer.steps) == 1:
+            transformer = transformer.steps[0][1]
+        if isinstance(transformer, OneHotEncoder):
+            for column, known in zip(columns, transformer.categories_):
+                categorical[column] = float(1.0 - X[column].isin(known).mean())
+    alerts = [f"{name}: mean shifted {shift:.2f} std" for name, shift in numeric.items() if shift > DRIFT_MEAN_SHIFT]
+    alerts += [f"{name}: {rate:.1%} unseen categories" for name, rate in categorical.items()
+               if rate > DRIFT_UNSEEN_RATE]
+    return {'mean_shift_std': numeric, 'unseen_category_rate': categorical, 'alerts': alerts}
+
+
+def _require_classes(estimator, y):
+    missing = np.setdiff1d(estimator.classes_, np.unique(y))
+    if len(missing):
+        raise ValueError(f"Batch has no rows of dose class(es) {missing.tolist()}; "
+                         f"{type(estimator).__name__} needs every class to add trees")
+
+
+def grow(estimator, X, y, n_trees=DEFAULT_NEW_TREES, mlp_epochs=DEFAULT_MLP_EPOCHS):
+    """إضافة أشجار أو خطوات تدريب على الدفعة فقط؛ يعيد {الاسم: (وصف التحديث، الثواني)}"""
+    start = time.perf_counter()
+    name = type(estimator).__name__
+    if isinstance(estimator, VotingClassifier):
+        y_members = estimator.le_.transform(y)
+        report = {}
+        for member_name, member in zip(estimator.named_estimators_, estimator.estimators_):
+            (_, (change, seconds)), = grow(member, X, y_members, n_trees, mlp_epochs).items()
+            report[f"{member_name} ({type(member).__name__})"] = (change, seconds)
+        return report
+    if isinstance(estimator, TREE_ENSEMBLES):
+        _require_classes(estimator, y)
+        before = len(estimator.estimators_)
+        warm_start = estimator.warm_start
+        estimator.set_params(warm_start=True, n_estimators=before + n_trees)
+        estimator.fit(X, y)
+        estimator.set_params(warm_start=warm_start)
+        change = f"trees {before} -> {len(estimator.estimators_)}"
+    elif hasattr(estimator, 'get_booster'):
+        _require_classes(estimator, y)
+        before = estimator.get_booster().num_boosted_rounds()
+        estimator.set_params(n_estimators=n_trees)
+        estimator.fit(X, y, xgb_model=estimator.get_booster())
+        estimator.set_params(n_estimators=estimator.get_booster().num_boosted_rounds())
+        change = f"rounds {before} -> {estimator.n_estimators}"
+    elif isinstance(estimator, MLPClassifier):
+        # partial_fit لا يقبل early_stopping؛ يُعاد بعد التحديث
+        early_stopping = estimator.early_stopping
+        estimator.early_stopping = False
+        if getattr(estimator, 'best_loss_', None) is None:
+            estimator.best_loss_ = min(estimator.loss_curve_)
+        order = np.random.default_rng(len(estimator.loss_curve_))
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', ConvergenceWarning)
+            for _ in range(mlp_epochs):
+                shuffled = order.permutation(len(y))
+                estimator.partial_fit(X[shuffled], np.asarray(y)[shuffled], classes=estimator.classes_)
+        estimator.early_stopping = early_stopping
+        change = f"{mlp_epochs} partial_fit epoch(s)"
+    elif hasattr(estimator, 'partial_fit'):
+        estimator.partial_fit(X, y, classes=estimator.classes_)
+        change = "1 partial_fit step"
+    else:
+        raise ValueError(f"{name} cannot be updated incrementally; retrain with advanced_model.py")
+    return {name: (change, time.perf_counter() - start)}
+
+
+def read_batch(path):
+    """دفعة وصفات جديدة: CSV أو Parquet أو مجلد كتبه synthetic_data.write_dataset"""
+    if os.path.isdir(path):
+        from synthetic_data import read_dataset
+        return read_dataset(path)
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    return pd.read_csv(path)
+
+
+def default_output_path(model_path):
+    stem, ext = os.path.splitext(model_path)
+    return f"{stem}-{time.strftime('%Y%m%d-%H%M%S')}{ext}"
+
+
+def update_model(model_path, batch, holdout=None, output_path=None, target=TARGET_COLUMN,
+                 n_trees=DEFAULT_NEW_TREES, mlp_epochs=DEFAULT_MLP_EPOCHS, holdout_fraction=0.2,
+                 max_accuracy_drop=MAX_ACCURACY_DROP, smote=False, force=False, verbose=True):
+    """تحديث النموذج بالدفعة وحفظه كإصدار جديد إذا لم تنخفض الدقة؛ يعيد التقرير"""
+    started = time.perf_counter()
+    timings = {}
+    # بدون mmap: التحديث يعدل مصفوفات المقدّرات في مكانها
+    source = load_model_files(model_path, mmap_mode=None)
+    model = source.model
+    pipeline, preprocessor, classifier = split_model(model)
+    if hasattr(pipeline, 'feature_names_in_'):
+        features = list(pipeline.feature_names_in_)
+    else:
+        features = [column for column in BASE_FEATURES if column in batch.columns]
+
+    if holdout is None:
+        from sklearn.model_selection import train_test_split
+        batch, holdout = train_test_split(batch, test_size=holdout_fraction, random_state=42,
+                                          stratify=batch[target])
+    X_new, y_new = batch[features], batch[target].to_numpy()
+    X_holdout, y_holdout = holdout[features], holdout[target].to_numpy()
+
+    # الدقة قبل التحديث: على البيانات المستبعدة وعلى الدفعة نفسها (مؤشر انحراف المفهوم)
+    start = time.perf_counter()
+    proba_before = model.predict_proba(X_holdout)
+    accuracy_before = float(np.mean(model.classes_[proba_before.argmax(axis=1)] == y_holdout))
+    batch_accuracy = float(np.mean(model.predict(X_new) == y_new))
+    drift = drift_report(preprocessor, X_new)
+    if accuracy_before - batch_accuracy > DRIFT_ACCURACY_GAP:
+        drift['alerts'].append(f"accuracy on the new batch {batch_accuracy:.3f} vs {accuracy_before:.3f} held-out")
+    timings['evaluate_before'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    skipped = refresh_scalers(preprocessor, classifier, X_new)
+    # التعديل يجب ألا يغير التوقعات (عدا قيم تقع على عتبة تماماً ولم تظهر في الدفعة)
+    remap_error = float(np.abs(model.predict_proba(X_holdout) - proba_before).max()) if skipped is None else None
+    timings['refresh_scalers'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    X_prep = preprocessor.transform(X_new)
+    y_fit = y_new
+    if smote:
+        from imblearn.over_sampling import SMOTE
+        # أصغر فئة موجودة فعلاً في الدفعة (bincount يعد الفئات الغائبة أصفاراً)
+        smallest = np.unique(y_new, return_counts=True)[1].min()
+        if smallest < 2:
+            warnings.warn(f"SMOTE skipped: the smallest class in the batch has {smallest} row(s)")
+        else:
+            X_prep, y_fit = SMOTE(random_state=42, k_neighbors=min(5, smallest - 1)).fit_resample(X_prep, y_new)
+    timings['transform'] = time.perf_counter() - start
+
+    members = grow(classifier, X_prep, y_fit, n_trees, mlp_epochs)
+    timings['update'] = sum(seconds for change, seconds in members.values())
+
+    start = time.perf_counter()
+    accuracy_after = float(np.mean(model.predict(X_holdout) == y_holdout))
+    timings['evaluate_after'] = time.perf_counter() - start
+    accepted = accuracy_after >= accuracy_before - max_accuracy_drop
+
+    report = {
+        'parent_model': source.path,
+        'parent_version': source.version,
+        'rows': int(len(X_new)),
+        'holdout_rows': int(len(X_holdout)),
+        'scaler_refresh': skipped or 'updated',
+        'remap_max_abs_diff': remap_error,
+        'members': {name: change for name, (change, seconds) in members.items()},
+        'member_seconds': {name: seconds for name, (change, seconds) in members.items()},
+        'accuracy_before': accuracy_before,
+        'accuracy_after': accuracy_after,
+        'batch_accuracy_before': batch_accuracy,
+        'drift': drift,
+        'accepted': accepted,
+    }
+    if accepted or force:
+        start = time.perf_counter()
+        output_path = output_path or default_output_path(source.path)
+        # حزمة جديدة بنفس المشفرات إن كان الأصل حزمة (مع أشجارها المصدّرة)، وإلا pickle
+        manifest = save_like(source, output_path, model, training_data={
+            'source': 'incremental_update', 'rows': int(len(batch)), 'sha256': frame_sha256(batch)})
+        report['model_path'] = output_path
+        report['version'] = manifest['version'] if manifest else file_version(output_path)
+        timings['save'] = time.perf_counter() - start
+        if manifest:
+            if 'skipped' in manifest['tree_export']:
+                report['tree_export'] = f"skipped: {manifest['tree_export']['skipped']}"
+        else:
+            # تصدير الأشجار للمسار السريع في الواجهة كما يفعل advanced_model.py
+            try:
+                from tree_export import export_pipeline, save_ensemble, default_export_path
+                save_ensemble(export_pipeline(pipeline), default_export_path(output_path))
+            except Exception as e:
+                report['tree_export'] = f"skipped: {str(e)}"
+    timings['total'] = time.perf_counter() - started
+    report['timings_s'] = timings
+    if report.get('model_path'):
+        with open(os.path.splitext(report['model_path'])[0] + '.update.json', 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if verbose:
+        print(format_report(report))
+    return report
+
+
+def format_report(report):
+    lines = [f"Updated {report['parent_version']} with {report['rows']} rows "
+             f"(held-out {report['holdout_rows']}) in {report['timings_s']['total']:.2f}s"]
+    lines.append(f"  scaler statistics: {report['scaler_refresh']}"
+                 + (f" (max |dp| after remap {report['remap_max_abs_diff']:.2g})"
+                    if report['remap_max_abs_diff'] is not None else ""))
+    for name, change in report['members'].items():
+        lines.append(f"  {name}: {change} ({report['member_seconds'][name]:.2f}s)")
+    lines.append(f"  held-out accuracy {report['accuracy_before']:.4f} -> {report['accuracy_after']:.4f}, "
+                 f"accuracy on batch before update {report['batch_accuracy_before']:.4f}")
+    for alert in report['drift']['alerts']:
+        lines.append(f"  DRIFT: {alert}")
+    if report.get('model_path'):
+        lines.append(f"Saved version {report['version']} to {report['model_path']}")
+        lines.append(f'Activate with: POST /admin/models/reload {{"model_path": "{report["model_path"]}"}}')
+    else:
+        lines.append("REJECTED: held-out accuracy dropped; model not saved (use --force to save anyway)")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Update a saved dosage model with new prescriptions only")
+    parser.add_argument('--model', help="bundle directory or pickle (default: the one the API serves)")
+    parser.add_argument('--batch', help="new rows: CSV, Parquet or a synthetic_data.py output directory")
+    parser.add_argument('--synthetic', type=int, help="use N generated rows instead of --batch")
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--holdout', help="held-out rows (default: --holdout-fraction of the batch)")
+    parser.add_argument('--holdout-fraction', type=float, default=0.2)
+    parser.add_argument('--output', help="new model path (default: <model>-<timestamp>.bundle / .pkl)")
+    parser.add_argument('--target', default=TARGET_COLUMN)
+    parser.add_argument('--trees', type=int, default=DEFAULT_NEW_TREES, help="trees/rounds added per ensemble")
+    parser.add_argument('--mlp-epochs', type=int, default=DEFAULT_MLP_EPOCHS)
+    parser.add_argument('--max-accuracy-drop', type=float, default=MAX_ACCURACY_DROP)
+    parser.add_argument('--smote', action='store_true', help="resample the batch with SMOTE like advanced_model.py")
+    parser.add_argument('--force', action='store_true', help="save even if held-out accuracy drops")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        from synthetic_data import generate_dataset
+        batch = generate_dataset(args.synthetic, seed=args.seed)
+    elif args.batch:
+        batch = read_batch(args.batch)
+    else:
+        parser.error("one of --batch or --synthetic is required")
+    holdout = read_batch(args.holdout) if args.holdout else None
+    report = update_model(args.model, batch, holdout, args.output, args.target, args.trees, args.mlp_epochs,
+                          args.holdout_fraction, args.max_accuracy_drop, args.smote, args.force)
+    sys.exit(0 if report['accepted'] or args.force else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import asyncio
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# تنفيذ التوقع على threads مخصصة بحد للتزامن وطابور انتظار محدود
+# عند الحمل الزائد يُرفض الطلب فوراً (503 + Retry-After) بدلاً من أن يطول الطابور بلا حد:
+#   - queue_full: الطابور ممتلئ
+#   - deadline: الانتظار المتوقع (طول الطابور × زمن الخدمة المتوسط) يتجاوز مهلة الطلب
+#   - expired: الطلب انتظر أكثر من المهلة قبل أن يبدأ فلا يُحسب (العميل غالباً تخلى عنه)
+
+# وزن آخر قياس في المتوسط المتحرك لزمن الخدمة
+SERVICE_EWMA_WEIGHT = 0.1
+SHED_REASONS = ("queue_full", "deadline", "expired")
+
+
+class Overloaded(Exception):
+    """رفض الطلب لحماية زمن استجابة الطلبات المقبولة؛ retry_after بالثواني"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Server overloaded ({reason}), retry after {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Admission:
+    """قبول العمل في طابور محدود بمهلة لكل طلب، مع عدادات الانتظار والرفض
+
+    admit() في مسار الطلب، start() عندما يبدأ worker العمل، finish() بعد انتهائه.
+    workers = عدد العناصر التي تُخدم بالتوازي (لتقدير زمن الانتظار)
+    """
+
+    def __init__(self, max_queue=64, deadline_ms=1000.0, workers=1, wait_observer=None):
+        self.max_queue = max_queue
+        self.deadline = deadline_ms / 1000.0
+        self.workers = workers
+        # يستقبل زمن انتظار كل عنصر بالثواني (مدرج المقاييس)
+        self.wait_observer = wait_observer
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.running = 0
+        self.admitted = 0
+        self.completed = 0
+        self.shed = dict.fromkeys(SHED_REASONS, 0)
+        # متوسط زمن الخدمة لكل عنصر بالثواني (None قبل أول قياس)
+        self.service_seconds = None
+
+    def _estimated_wait(self):
+        if self.service_seconds is None:
+            return 0.0
+        return self.waiting * self.service_seconds / self.workers
+
+    def _reject(self, reason):
+        # يُستدعى تحت القفل
+        self.shed[reason] += 1
+        return Overloaded(reason, max(1, math.ceil(self._estimated_wait())))
+
+    def admit(self):
+        """حجز مكان في الطابور؛ يعيد وقت القبول أو يرفع Overloaded"""
+        with self._lock:
+            if self.max_queue and self.waiting >= self.max_queue:
+                raise self._reject("queue_full")
+            if self.deadline and self._estimated_wait() > self.deadline:
+                raise self._reject("deadline")
+            self.waiting += 1
+            self.admitted += 1
+        return time.perf_counter()
+
+    def start(self, admitted_at):
+        """بداية الخدمة؛ يرفع Overloaded إذا تجاوز الانتظار المهلة"""
+        now = time.perf_counter()
+        waited = now - admitted_at
+        with self._lock:
+            self.waiting -= 1
+            if self.deadline and waited > self.deadline:
+                raise self._reject("expired")
+            self.running += 1
+        if self.wait_observer is not None:
+            self.wait_observer(waited)
+        return now
+
+    def release(self):
+        """تحرير مكان في الطابور لعمل أُلغي قبل أن يبدأ (مثل انقطاع اتصال العميل)"""
+        with self._lock:
+            self.waiting -= 1
+
+    def finish(self, started_at, n_items=1):
+        """نهاية خدمة n_items عنصراً بدأت معاً عند started_at"""
+        per_item = (time.perf_counter() - started_at) / max(n_items, 1)
+        with self._lock:
+            self.running -= n_items
+            self.completed += n_items
+            if self.service_seconds is None:
+                self.service_seconds = per_item
+            else:
+                self.service_seconds += SERVICE_EWMA_WEIGHT * (per_item - self.service_seconds)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_queue": self.max_queue,
+                "deadline_ms": self.deadline * 1000,
+                "workers": self.workers,
+                "queue_length": self.waiting,
+                "running": self.running,
+                "admitted": self.admitted,
+                "completed": self.completed,
+                "shed": dict(self.shed),
+                "service_ms": self.service_seconds * 1000 if self.service_seconds is not None else None,
+                "estimated_wait_ms": self._estimated_wait() * 1000,
+            }
+
+
+class InferenceExecutor:
+    """ThreadPoolExecutor بعدد workers ثابت يمر كل عمل فيه عبر Admission"""
+
+    def __init__(self, max_workers=1, max_queue=64, deadline_ms=1000.0, wait_observer=None):
+        self.admission = Admission(max_queue, deadline_ms, max_workers, wait_observer)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='inference')
+
+    def _call(self, admitted_at, fn, args):
+        started_at = self.admission.start(admitted_at)
+        try:
+            return fn(*args)
+        finally:
+            self.admission.finish(started_at)
+
+    async def run(self, fn, *args):
+        """تنفيذ fn(*args) على thread من المجمّع؛ يرفع Overloaded عند الحمل الزائد"""
+        admitted_at = self.admission.admit()
+        future = self._executor.submit(self._call, admitted_at, fn, args)
+        # إلغاء الطلب المنتظر يلغي العمل قبل بدئه فلا يصل إلى start(): يُحرَّر مكانه هنا
+        future.add_done_callback(self._release_cancelled)
+        return await asyncio.wrap_future(future)
+
+    def _release_cancelled(self, future):
+        if future.cancelled():
+            self.admission.release()
+
+    def stats(self):
+        return self.admission.stats()
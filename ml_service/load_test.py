@@ -0,0 +1,358 @@
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+# مولّد حمل HTTP متزامن لواجهة الجرعات (تطوير لـ test_server.py)
+# مكتبة Python القياسية فقط حتى يعمل بدون إنترنت: اتصالات keep-alive في threads،
+# مزيج من طلبات /predict و /predict/batch وأسماء أدوية بأخطاء إملائية،
+# ومقارنة مع نتيجة أساس محفوظة تفشل بوضوح عند التراجع
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# نفس عينة test_server.py؛ تُستخدم عندما لا تتوفر encoders.pkl
+DEFAULT_VALUES = {
+    'route': ['Oral'],
+    'gender': ['M'],
+    'admission_type': ['EMERGENCY'],
+    'diagnosis': [None],
+}
+
+PERCENTILES = (50, 95, 99, 99.9)
+
+# الحد المسموح به مقارنة بالأساس قبل اعتبار النتيجة تراجعاً
+DEFAULT_TOLERANCE = 0.15
+
+
+def load_vocabulary(encoders_path, drugs):
+    """القيم التصنيفية التي يعرفها النموذج؛ من encoders.pkl إن أمكن وإلا القيم الافتراضية"""
+    values = dict(DEFAULT_VALUES, drug=drugs)
+    if encoders_path and os.path.exists(encoders_path):
+        try:
+            import joblib
+            encoders = joblib.load(encoders_path)
+            for column, name in (('route', 'route'), ('gender', 'gender'), ('admission_type', 'admission'),
+                                 ('diagnosis', 'diagnosis')):
+                if name in encoders:
+                    values[column] = [str(v) for v in encoders[name].classes_]
+        except Exception as e:
+            print(f"Using default category values ({e})", file=sys.stderr)
+    return values
+
+
+def misspell(name, rng):
+    """اسم دواء غير موجود في المعجم لكنه قريب بما يكفي للمطابقة التقريبية"""
+    if len(name) < 4:
+        return name.lower() + "e"
+    i = rng.randrange(1, len(name) - 1)
+    edit = rng.randrange(3)
+    if edit == 0:
+        return name[:i] + name[i + 1:]  # حذف حرف
+    if edit == 1:
+        return name[:i] + name[i + 1] + name[i] + name[i + 2:]  # تبديل حرفين
+    return name[:i] + name[i] + name[i:]  # تكرار حرف
+
+
+class RequestMix:
+    """يولّد (النوع, المسار, الجسم) حسب النسب المطلوبة"""
+
+    def __init__(self, vocabulary, weights, batch_size, seed):
+        self.vocabulary = vocabulary
+        self.kinds = [kind for kind, weight in weights.items() if weight > 0]
+        self.weights = [weights[kind] for kind in self.kinds]
+        self.batch_size = batch_size
+        self.seed = seed
+
+    def patient(self, rng, drug=None):
+        values = self.vocabulary
+        patient = {
+            'age': round(rng.uniform(1, 95), 1),
+            'weight': round(rng.uniform(30, 150), 1),
+            'drug': drug or rng.choice(values['drug']),
+            'route': rng.choice(values['route']),
+            'gender': rng.choice(values['gender']),
+            'admission_type': rng.choice(values['admission_type']),
+        }
+        diagnosis = rng.choice(values['diagnosis'])
+        if diagnosis is not None:
+            patient['diagnosis'] = diagnosis
+        return patient
+
+    def next(self, rng):
+        kind = rng.choices(self.kinds, self.weights)[0]
+        if kind == 'batch':
+            body = [self.patient(rng) for _ in range(self.batch_size)]
+            return kind, '/predict/batch', body
+        if kind == 'fuzzy':
+            return kind, '/predict', self.patient(rng, misspell(rng.choice(self.vocabulary['drug']), rng))
+        return kind, '/predict', self.patient(rng)
+
+
+def percentile(sorted_values, p):
+    """أقرب رتبة (nearest-rank) على قائمة مرتبة"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(-(-p * len(sorted_values) // 100)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies, errors, statuses, elapsed):
+    latencies = sorted(latencies)
+    total = len(latencies) + errors
+    summary = {
+        'requests': total,
+        'errors': errors,
+        'error_rate': errors / total if total else 0.0,
+        'throughput_rps': len(latencies) / elapsed if elapsed else 0.0,
+        'mean_ms': sum(latencies) / len(latencies) * 1000 if latencies else None,
+        'max_ms': latencies[-1] * 1000 if latencies else None,
+        'status_counts': dict(sorted(statuses.items())),
+    }
+    for p in PERCENTILES:
+        value = percentile(latencies, p)
+        summary[f"p{str(p).replace('.', '')}_ms"] = value * 1000 if value is not None else None
+    return summary
+
+
+class Worker(threading.Thread):
+    def __init__(self, index, host, port, mix, seed, start_at, measure_from, stop_at, max_requests):
+        super().__init__(name=f"load-{index}", daemon=True)
+        self.host = host
+        self.port = port
+        self.mix = mix
+        self.rng = random.Random(seed * 1000 + index)
+        self.start_at = start_at
+        self.measure_from = measure_from
+        self.stop_at = stop_at
+        self.max_requests = max_requests
+        # النوع -> [أزمنة الاستجابة الناجحة, عدد الأخطاء, {رمز الحالة: العدد}]
+        self.results = {}
+
+    def _connect(self):
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        connection.connect()
+        # بدون Nagle حتى لا يضيف تأخير ACK المؤجل ~40ms للطلبات الصغيرة
+        connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return connection
+
+    def run(self):
+        connection = self._connect()
+        sent = 0
+        while time.perf_counter() < self.start_at:
+            time.sleep(0.001)
+        while time.perf_counter() < self.stop_at and (self.max_requests is None or sent < self.max_requests):
+            kind, path, body = self.mix.next(self.rng)
+            payload = json.dumps(body)
+            started = time.perf_counter()
+            status = None
+            try:
+                connection.request('POST', path, payload, {'Content-Type': 'application/json'})
+                response = connection.getresponse()
+                response_body = response.read()
+                status = response.status
+                # طلب الدفعة ينجح حتى لو فشلت بعض سجلاته - نعتبر فشل أي سجل خطأ
+                if status == 200 and kind == 'batch' and json.loads(response_body).get('n_failed'):
+                    status = 'partial'
+            except (OSError, http.client.HTTPException):
+                status = 'connection_error'
+                connection.close()
+                try:
+                    connection = self._connect()
+                except OSError:
+                    time.sleep(0.1)
+            elapsed = time.perf_counter() - started
+            sent += 1
+            if started < self.measure_from:
+                continue  # فترة التسخين
+            latencies, _, statuses = self.results.setdefault(kind, [[], 0, {}])
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            if status == 200:
+                latencies.append(elapsed)
+            else:
+                self.results[kind][1] += 1
+        connection.close()
+
+
+def run_load(host, port, mix, concurrency, duration, warmup, seed, max_requests=None):
+    start_at = time.perf_counter() + 0.2
+    measure_from = start_at + warmup
+    stop_at = measure_from + duration
+    per_worker = None if max_requests is None else -(-max_requests // concurrency)
+    workers = [Worker(i, host, port, mix, seed, start_at, measure_from, stop_at, per_worker)
+               for i in range(concurrency)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = min(time.perf_counter(), stop_at) - measure_from
+
+    by_kind = {}
+    all_latencies, all_errors, all_statuses = [], 0, {}
+    for kind in mix.kinds:
+        latencies, errors, statuses = [], 0, {}
+        for worker in workers:
+            result = worker.results.get(kind)
+            if result is None:
+                continue
+            latencies.extend(result[0])
+            errors += result[1]
+            for status, count in result[2].items():
+                statuses[status] = statuses.get(status, 0) + count
+        by_kind[kind] = summarize(latencies, errors, statuses, elapsed)
+        all_latencies.extend(latencies)
+        all_errors += errors
+        for status, count in statuses.items():
+            all_statuses[status] = all_statuses.get(status, 0) + count
+    return {'overall': summarize(all_latencies, all_errors, all_statuses, elapsed), 'by_kind': by_kind}
+
+
+def compare_with_baseline(report, baseline, tolerance):
+    """قائمة التراجعات: إنتاجية أقل، زمن p50/p99 أعلى، أو معدل أخطاء أعلى"""
+    regressions = []
+    sections = [('overall', report['overall'], baseline.get('overall', {}))]
+    sections += [(kind, summary, baseline.get('by_kind', {}).get(kind, {}))
+                 for kind, summary in report['by_kind'].items()]
+    for name, current, reference in sections:
+        if not reference:
+            continue
+        if reference.get('throughput_rps') and current['throughput_rps'] < reference['throughput_rps'] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {current['throughput_rps']:.1f} rps "
+                               f"< baseline {reference['throughput_rps']:.1f} rps")
+        for key in ('p50_ms', 'p99_ms'):
+            if reference.get(key) and current.get(key) and current[key] > reference[key] * (1 + tolerance):
+                regressions.append(f"{name}: {key} {current[key]:.2f} > baseline {reference[key]:.2f}")
+        if current['error_rate'] > reference.get('error_rate', 0.0) + 0.001:
+            regressions.append(f"{name}: error rate {current['error_rate']:.4f} "
+                               f"> baseline {reference.get('error_rate', 0.0):.4f}")
+    return regressions
+
+
+def _get_json(host, port, path, timeout=5):
+    connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        connection.request('GET', path)
+        response = connection.getresponse()
+        body = response.read()
+        return response.status, json.loads(body) if body else None
+    finally:
+        connection.close()
+
+
+def wait_ready(host, port, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            status, _ = _get_json(host, port, '/ready', timeout=2)
+            if status == 200:
+                return True
+        except (OSError, http.client.HTTPException, ValueError):
+            pass
+        time.sleep(0.1)
+    return False
+
+
+def start_server(launcher, port, workers):
+    if launcher == 'serve':
+        command = [sys.executable, 'serve.py', '--host', '127.0.0.1', '--port', str(port)]
+        if workers:
+            command += ['--workers', str(workers)]
+    else:
+        command = [sys.executable, '-m', 'uvicorn', 'api:app', '--host', '127.0.0.1',
+                   '--port', str(port), '--log-level', 'warning']
+    return subprocess.Popen(command, cwd=BASE_DIR)
+
+
+def parse_mix(text):
+    weights = {}
+    for part in text.split(','):
+        kind, _, weight = part.partition('=')
+        if kind not in ('single', 'batch', 'fuzzy'):
+            raise argparse.ArgumentTypeError(f"unknown request kind '{kind}'")
+        weights[kind] = float(weight)
+    if not any(weights.values()):
+        raise argparse.ArgumentTypeError("the request mix is empty")
+    return weights
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent HTTP load test for the MedLink dosage API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--start-server', choices=('uvicorn', 'serve'),
+                        help="start a local server on --port for the duration of the test")
+    parser.add_argument('--workers', type=int, default=0, help="serve.py worker count (0 = auto)")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30.0, help="measured seconds")
+    parser.add_argument('--warmup', type=float, default=3.0, help="seconds excluded from the results")
+    parser.add_argument('--requests', type=int, default=None, help="stop after this many requests in total")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('single=0.8,batch=0.1,fuzzy=0.1'))
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--encoders', default=os.path.join(BASE_DIR, 'encoders.pkl'))
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="write the JSON report to this file")
+    parser.add_argument('--baseline', help="fail if the results regress against this report")
+    parser.add_argument('--save-baseline', help="store this run as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    server = start_server(args.start_server, args.port, args.workers) if args.start_server else None
+    try:
+        if not wait_ready(args.host, args.port, timeout=180 if server else 10):
+            print(f"Server at {args.host}:{args.port} is not ready", file=sys.stderr)
+            sys.exit(2)
+        _, drugs = _get_json(args.host, args.port, '/drugs')
+        vocabulary = load_vocabulary(args.encoders, [str(d) for d in drugs['drugs']])
+        mix = RequestMix(vocabulary, args.mix, args.batch_size, args.seed)
+        results = run_load(args.host, args.port, mix, args.concurrency, args.duration,
+                           args.warmup, args.seed, args.requests)
+        try:
+            _, server_stats = _get_json(args.host, args.port, '/batching/stats')
+        except (OSError, http.client.HTTPException, ValueError):
+            server_stats = None
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    report = {
+        'config': {
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'warmup': args.warmup,
+            'mix': args.mix,
+            'batch_size': args.batch_size,
+            'server': args.start_server or f"{args.host}:{args.port}",
+            'seed': args.seed,
+        },
+        **results,
+        'server_batching': server_stats,
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare_with_baseline(report, json.load(f), args.tolerance)
+        report['regressions'] = regressions
+
+    text = json.dumps(report, indent=2)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(text)
+    print(text)
+
+    if regressions:
+        print("\nPERFORMANCE REGRESSION against " + args.baseline, file=sys.stderr)
+        for line in regressions:
+            print("  - " + line, file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
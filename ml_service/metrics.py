@@ -0,0 +1,183 @@
+import bisect
+import threading
+import time
+
+# مقاييس بصيغة Prometheus النصية بدون مكتبات خارجية
+# المدرجات التكرارية بحدود ثابتة: كل ملاحظة = بحث ثنائي + زيادة عدّاد تحت قفل
+
+# حدود زمن المراحل بالثواني (من 20 ميكروثانية إلى 2.5 ثانية)
+LATENCY_BUCKETS = (0.00002, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+                   0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name, documentation, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def observe_laps(self, prefix, laps):
+        """تسجيل كل مراحل طلب واحد تحت قفل واحد؛ التسميات = prefix + (اسم المرحلة,)"""
+        buckets = self.buckets
+        with self._lock:
+            for stage, value in laps:
+                labels = prefix + (stage,)
+                series = self._series.get(labels)
+                if series is None:
+                    series = self._series[labels] = [[0] * (len(buckets) + 1), 0.0]
+                series[0][bisect.bisect_left(buckets, value)] += 1
+                series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        for labels, counts, total in sorted(snapshot):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, documentation, label_names):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            snapshot = sorted(self._values.items())
+        for labels, value in snapshot:
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {_number(value)}")
+        return lines
+
+
+class Gauge:
+    """قيمة تُحسب عند كل قراءة لـ /metrics من دالة تعيد رقماً أو {قيم التسميات: رقم}
+
+    kind="counter" لعدّادات تراكمية تحتفظ بها مكونات أخرى (مثل إحصائيات الذاكرة المؤقتة)
+    """
+
+    def __init__(self, name, documentation, read, label_names=(), kind="gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.read = read
+        self.label_names = tuple(label_names)
+        self.kind = kind
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            value = self.read()
+        except Exception:
+            return lines
+        items = sorted(value.items()) if isinstance(value, dict) else [((), value)]
+        for labels, number in items:
+            if number is not None:
+                lines.append(f"{self.name}{_labels(self.label_names, labels)} {_number(number)}")
+        return lines
+
+
+class StageClock:
+    """يقيس زمن كل مرحلة منذ المرحلة السابقة ويحتفظ بها حتى نهاية الطلب"""
+
+    __slots__ = ('last', 'laps')
+
+    def __init__(self):
+        self.last = time.perf_counter()
+        self.laps = []
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.laps.append((stage, now - self.last))
+        self.last = now
+
+    def skip(self):
+        """تجاهل الوقت منذ المرحلة السابقة (عمل لا ينتمي لأي مرحلة)"""
+        self.last = time.perf_counter()
+
+
+class _NullClock:
+    __slots__ = ()
+    laps = ()
+
+    def lap(self, stage):
+        pass
+
+    def skip(self):
+        pass
+
+
+# تُستخدم عندما تكون المقاييس معطلة أو خارج مسار الطلب (التسخين، الاختبارات)
+NULL_CLOCK = _NullClock()
+
+
+class MetricsRegistry:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, label_names, buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, documentation, label_names, buckets))
+
+    def counter(self, name, documentation, label_names):
+        return self._add(Counter(name, documentation, label_names))
+
+    def gauge(self, name, documentation, read, label_names=(), kind="gauge"):
+        return self._add(Gauge(name, documentation, read, label_names, kind))
+
+    def clock(self):
+        return StageClock() if self.enabled else NULL_CLOCK
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,151 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from inference_executor import Overloaded
+
+# مُجدوِل دفعات صغيرة: يجمع طلبات /predict المتزامنة خلال نافذة زمنية قصيرة
+# (أو حتى الحد الأقصى للدفعة) ويشغّل توقعاً واحداً على thread مخصص للنموذج
+
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+WAIT_BUCKETS_MS = (0.5, 1, 2, 5, 10, 25, 50, 100, 250)
+
+
+def _bucket(value, bounds):
+    for i, bound in enumerate(bounds):
+        if value <= bound:
+            return i
+    return len(bounds)
+
+
+class MicroBatcher:
+    """يجمع العناصر من حلقة asyncio ويمررها إلى predict_fn كقائمة واحدة
+
+    predict_fn(items) -> قائمة نتائج بنفس الترتيب، تعمل على worker منفصل؛
+    النتيجة التي هي استثناء تُرفع لصاحب ذلك العنصر فقط.
+    النافذة تكيفية: عند الحمل المنخفض تُرسل الطلبات فوراً دون انتظار.
+    admission (inference_executor.Admission) يحد طول الطابور ومهلة كل طلب
+    """
+
+    def __init__(self, predict_fn, max_batch_size=64, max_wait_ms=2.0, admission=None):
+        self.predict_fn = predict_fn
+        self.admission = admission
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='inference')
+        self._queue = None
+        self._task = None
+        self._last_batch_size = 0
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.size_counts = [0] * (len(SIZE_BUCKETS) + 1)
+        self.wait_counts = [0] * (len(WAIT_BUCKETS_MS) + 1)
+        self.wait_total_ms = 0.0
+        self.wait_max_ms = 0.0
+
+    async def submit(self, item):
+        """إضافة عنصر وانتظار نتيجته الخاصة"""
+        loop = asyncio.get_running_loop()
+        # إعادة إنشاء الطابور إذا تغيرت حلقة الأحداث (مثل إعادة تشغيل الخادم في نفس العملية)
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._queue = asyncio.Queue()
+            self._task = loop.create_task(self._run())
+        enqueued = self.admission.admit() if self.admission is not None else time.perf_counter()
+        future = loop.create_future()
+        self._queue.put_nowait((item, future, enqueued))
+        return await future
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        while len(batch) < self.max_batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+
+        # الانتظار فقط عند وجود تزامن فعلي، حتى لا يضيف الطلب المنفرد أي تأخير
+        if self.max_wait > 0 and (len(batch) > 1 or self._last_batch_size > 1):
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            self._record(batch)
+            # بداية واحدة للدفعة كلها: زمن الخدمة لكل عنصر = زمن الدفعة / عدد عناصرها
+            started_at = time.perf_counter()
+            if self.admission is not None:
+                # الطلبات التي تجاوزت مهلتها في الطابور تُرفض دون حسابها
+                live = []
+                for entry in batch:
+                    if entry[1].cancelled():
+                        # الطلب أُلغي أثناء انتظاره في الطابور
+                        self.admission.release()
+                        continue
+                    try:
+                        self.admission.start(entry[2])
+                        live.append(entry)
+                    except Overloaded as e:
+                        if not entry[1].done():
+                            entry[1].set_exception(e)
+                batch = live
+                if not batch:
+                    continue
+            items = [entry[0] for entry in batch]
+            try:
+                results = await loop.run_in_executor(self._executor, self.predict_fn, items)
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            finally:
+                if self.admission is not None:
+                    self.admission.finish(started_at, len(batch))
+            for (_, future, _), result in zip(batch, results):
+                if future.done():
+                    continue
+                # خطأ خاص بعنصر واحد (مثل قيمة تصنيفية غير معروفة) لا يُفشل بقية الدفعة
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def _record(self, batch):
+        now = time.perf_counter()
+        with self._stats_lock:
+            self._last_batch_size = len(batch)
+            self.batches += 1
+            self.items += len(batch)
+            self.size_counts[_bucket(len(batch), SIZE_BUCKETS)] += 1
+            for _, _, enqueued in batch:
+                wait_ms = (now - enqueued) * 1000
+                self.wait_counts[_bucket(wait_ms, WAIT_BUCKETS_MS)] += 1
+                self.wait_total_ms += wait_ms
+                self.wait_max_ms = max(self.wait_max_ms, wait_ms)
+
+    def stats(self):
+        with self._stats_lock:
+            size_labels = [f"<={b}" for b in SIZE_BUCKETS] + [f">{SIZE_BUCKETS[-1]}"]
+            wait_labels = [f"<={b}ms" for b in WAIT_BUCKETS_MS] + [f">{WAIT_BUCKETS_MS[-1]}ms"]
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "queue_length": self._queue.qsize() if self._queue is not None else 0,
+                "batches": self.batches,
+                "items": self.items,
+                "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+                "batch_size_histogram": dict(zip(size_labels, self.size_counts)),
+                "queue_wait_mean_ms": self.wait_total_ms / self.items if self.items else 0.0,
+                "queue_wait_max_ms": self.wait_max_ms,
+                "queue_wait_histogram": dict(zip(wait_labels, self.wait_counts)),
+            }
@@ -0,0 +1,255 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from dataset_cache import DatasetCache
+
+# قراءة جداول MIMIC-III على دفعات بدلاً من تحميلها كاملة ثم دمجها في الذاكرة:
+# - لا نقرأ إلا الأعمدة المطلوبة وبأنواع مضغوطة (category، int32، float32)
+# - الجداول الصغيرة (PATIENTS، ADMISSIONS) تُحوَّل إلى فهرس تجزئة واحد
+# - PRESCRIPTIONS تُقرأ دفعة دفعة وتُربط بالفهرس، فتبقى ذاكرة العمل محدودة بحجم الدفعة
+
+DEFAULT_CHUNK_SIZE = 200_000
+
+# MIMIC يخفي عمر من تجاوز 89 عاماً بإزاحة تاريخ الميلاد (~300 سنة)
+MAX_AGE = 90
+
+# المعرفات تُقرأ float64 (قد تكون فارغة؛ Int32 القابل للفراغ أبطأ بكثير في التحليل)
+# ثم تُخزَّن int32. الجرعة نص مثل "5-10" فتُقرأ فئات ويُحوَّل كل نص فريد إلى رقم مرة واحدة
+PRESCRIPTION_COLUMNS = {
+    'SUBJECT_ID': 'float64',
+    'HADM_ID': 'float64',
+    'DRUG': 'category',
+    'DOSE_VAL_RX': 'category',
+    'DOSE_UNIT_RX': 'category',
+    'ROUTE': 'category',
+}
+# أسماء بديلة للدواء تُستخدم لبناء drug_aliases إن وُجدت
+ALIAS_COLUMNS = ('DRUG_NAME_GENERIC', 'DRUG_NAME_POE')
+
+PATIENT_COLUMNS = {'SUBJECT_ID': 'int32', 'GENDER': 'category', 'DOB': str}
+ADMISSION_COLUMNS = {
+    'SUBJECT_ID': 'int32',
+    'HADM_ID': 'int32',
+    'ADMITTIME': str,
+    'ADMISSION_TYPE': 'category',
+    'DIAGNOSIS': 'category',
+}
+
+
+def peak_rss_mb():
+    """ذروة الذاكرة المقيمة للعملية بالميغابايت؛ None على ويندوز"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # كيلوبايت على لينكس، بايت على macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _read_csv(path, columns, optional=(), cache=None, chunksize=None):
+    """قراءة الأعمدة المطلوبة فقط مهما كانت حالة أحرف أسمائها (النسخة التجريبية بأحرف صغيرة)
+
+    إذا كان الملف مُدرجاً في SHA256SUMS.txt تُقرأ الأعمدة من dataset_cache (mmap) بدل تحليل CSV
+    """
+    filename = os.path.basename(path)
+    cached = cache is not None and filename in cache.checksums
+    if cached:
+        try:
+            header = cache.columns(filename)
+        except OSError as e:
+            # مجلد البيانات للقراءة فقط مثلاً
+            print(f"Warning: dataset cache unavailable for {filename} ({e}); parsing the CSV file")
+            cached = False
+    if not cached:
+        header = pd.read_csv(path, nrows=0).columns
+    actual = {name.upper(): name for name in header}
+    missing = [name for name in columns if name not in actual]
+    if missing:
+        raise KeyError(f"{filename} is missing columns: {', '.join(missing)}")
+
+    dtypes = dict(columns)
+    dtypes.update({name: 'category' for name in optional if name in actual})
+    if cached:
+        frame = cache.load(filename, [actual[name] for name in dtypes])
+        # إعادة التسمية بدون rename() حتى لا تُنسخ مصفوفات mmap
+        frame.columns = list(dtypes)
+        for name, dtype in dtypes.items():
+            # عمود نصي بلا أي قيمة نصية يُخزَّن رقمياً في الذاكرة العمودية
+            if dtype == 'category' and not isinstance(frame[name].dtype, pd.CategoricalDtype):
+                frame[name] = frame[name].astype('category')
+        if chunksize is None:
+            return frame
+        return (frame.iloc[start:start + chunksize] for start in range(0, len(frame), chunksize))
+
+    reader = pd.read_csv(
+        path,
+        usecols=[actual[name] for name in dtypes],
+        dtype={actual[name]: dtype for name, dtype in dtypes.items()},
+        chunksize=chunksize,
+    )
+    rename = {actual[name]: name for name in dtypes}
+    if chunksize is None:
+        return reader.rename(columns=rename)
+    return (chunk.rename(columns=rename) for chunk in reader)
+
+
+def _admission_key(subject_ids, hadm_ids):
+    # مفتاح int64 واحد بدل MultiIndex: (SUBJECT_ID, HADM_ID)
+    return (np.asarray(subject_ids, dtype=np.int64) << 32) | np.asarray(hadm_ids, dtype=np.int64)
+
+
+def build_admission_index(data_path, cache=None):
+    """ربط ADMISSIONS بـ PATIENTS مرة واحدة وحساب العمر عند الدخول
+
+    يعيد (فهرس تجزئة على (SUBJECT_ID, HADM_ID)، جدول القبولات المكتمل)
+    """
+    patients = _read_csv(os.path.join(data_path, 'PATIENTS.csv'), PATIENT_COLUMNS, cache=cache)
+    admissions = _read_csv(os.path.join(data_path, 'ADMISSIONS.csv'), ADMISSION_COLUMNS, cache=cache)
+
+    patients = patients.drop_duplicates('SUBJECT_ID')
+    patient_pos = pd.Index(patients['SUBJECT_ID']).get_indexer(admissions['SUBJECT_ID'])
+    matched = patient_pos >= 0
+
+    # الطرح بالأيام: فرق 300 سنة يتجاوز مدى timedelta64[ns]
+    dob = pd.to_datetime(patients['DOB'], errors='coerce').to_numpy().astype('datetime64[D]')[patient_pos]
+    admit = pd.to_datetime(admissions['ADMITTIME'], errors='coerce').to_numpy().astype('datetime64[D]')
+    age = (admit - dob).astype(np.float64) / 365.25
+
+    table = pd.DataFrame({
+        'GENDER': patients['GENDER'].take(patient_pos).where(matched).array,
+        'AGE': np.where(matched, np.minimum(age, MAX_AGE), np.nan).astype(np.float32),
+        'ADMISSION_TYPE': admissions['ADMISSION_TYPE'].array,
+        'DIAGNOSIS': admissions['DIAGNOSIS'].array,
+    })
+    # صف لا يمكن استخدامه في التدريب لا داعي لوضعه في الفهرس
+    keep = table.notna().all(axis=1).to_numpy()
+    key = _admission_key(admissions['SUBJECT_ID'], admissions['HADM_ID'])[keep]
+    table = table[keep].reset_index(drop=True)
+
+    first = ~pd.Index(key).duplicated()
+    return pd.Index(key[first]), table[first].reset_index(drop=True)
+
+
+def _parse_dose(values):
+    """تحويل عمود الجرعة (فئات نصية) إلى float32؛ القيم غير الرقمية مثل "1-2" تصبح NaN"""
+    numbers = pd.to_numeric(values.cat.categories, errors='coerce').to_numpy(dtype=np.float32)
+    # رمز -1 (قيمة فارغة) يأخذ NaN من الخانة الإضافية
+    return np.append(numbers, np.float32('nan'))[values.cat.codes.to_numpy()]
+
+
+def _collect_aliases(aliases, drugs, chunk):
+    for column in ALIAS_COLUMNS:
+        if column not in chunk.columns:
+            continue
+        pairs = pd.DataFrame({'DRUG': drugs, 'ALIAS': chunk[column].to_numpy()}).dropna().drop_duplicates()
+        found = aliases.setdefault(column, {})
+        for drug, alias in pairs.itertuples(index=False):
+            found.setdefault(alias, drug)
+
+
+def ingest_mimic(data_path, chunk_size=DEFAULT_CHUNK_SIZE, verbose=True, use_cache=True):
+    """قراءة PRESCRIPTIONS على دفعات وربطها بالمرضى والقبولات
+
+    يعيد (DataFrame بأعمدة مضغوطة، drug_aliases، إحصائيات القراءة)
+    """
+    start = time.perf_counter()
+    cache = DatasetCache(data_path) if use_cache else None
+    index, admissions = build_admission_index(data_path, cache)
+
+    parts = []
+    aliases = {}
+    rows_read = 0
+    reader = _read_csv(os.path.join(data_path, 'PRESCRIPTIONS.csv'), PRESCRIPTION_COLUMNS,
+                       optional=ALIAS_COLUMNS, cache=cache, chunksize=chunk_size)
+    for chunk in reader:
+        rows_read += len(chunk)
+        dose = _parse_dose(chunk['DOSE_VAL_RX'])
+        ids_present = chunk['SUBJECT_ID'].notna() & chunk['HADM_ID'].notna()
+        key = _admission_key(chunk['SUBJECT_ID'].fillna(0), chunk['HADM_ID'].fillna(0))
+        pos = index.get_indexer(key)
+
+        keep = (ids_present.to_numpy() & (pos >= 0) & ~np.isnan(dose)
+                & chunk[['DRUG', 'DOSE_UNIT_RX', 'ROUTE']].notna().all(axis=1).to_numpy())
+        if not keep.any():
+            continue
+        chunk = chunk[keep]
+        pos = pos[keep]
+        matched = admissions.take(pos)
+
+        part = pd.DataFrame({
+            'SUBJECT_ID': chunk['SUBJECT_ID'].to_numpy(dtype=np.int32),
+            'HADM_ID': chunk['HADM_ID'].to_numpy(dtype=np.int32),
+            'DRUG': chunk['DRUG'].cat.remove_unused_categories().array,
+            'DOSE_VAL_RX': dose[keep],
+            'DOSE_UNIT_RX': chunk['DOSE_UNIT_RX'].cat.remove_unused_categories().array,
+            'ROUTE': chunk['ROUTE'].cat.remove_unused_categories().array,
+            'GENDER': matched['GENDER'].array,
+            'AGE': matched['AGE'].to_numpy(),
+            'ADMISSION_TYPE': matched['ADMISSION_TYPE'].array,
+            'DIAGNOSIS': matched['DIAGNOSIS'].array,
+        })
+        _collect_aliases(aliases, part['DRUG'].array, chunk)
+        parts.append(part)
+
+    df = _concat_parts(parts)
+
+    # كما في الكود الأصلي: الاسم العام أولاً ثم اسم POE
+    drug_aliases = {}
+    for column in ALIAS_COLUMNS:
+        for alias, drug in aliases.get(column, {}).items():
+            drug_aliases.setdefault(alias, drug)
+
+    elapsed = time.perf_counter() - start
+    stats = {
+        'rows_read': rows_read,
+        'rows_kept': len(df),
+        'seconds': round(elapsed, 3),
+        'rows_per_second': round(rows_read / elapsed) if elapsed > 0 else None,
+        'peak_rss_mb': peak_rss_mb(),
+        'result_mb': round(df.memory_usage(deep=True).sum() / 1e6, 2),
+        'chunk_size': chunk_size,
+    }
+    if verbose:
+        peak = f"{stats['peak_rss_mb']:.1f} MB" if stats['peak_rss_mb'] is not None else "n/a"
+        print(f"Ingested {rows_read} prescriptions ({len(df)} kept) in {elapsed:.2f}s "
+              f"({stats['rows_per_second'] or 0:,} rows/s), peak RSS {peak}, "
+              f"result {stats['result_mb']} MB")
+    return df, drug_aliases, stats
+
+
+def _concat_parts(parts):
+    """دمج الدفعات مع توحيد فئات الأعمدة النصية بدل تحويلها إلى object"""
+    if not parts:
+        columns = list(PRESCRIPTION_COLUMNS) + ['GENDER', 'AGE', 'ADMISSION_TYPE', 'DIAGNOSIS']
+        return pd.DataFrame(columns=columns)
+    columns = {}
+    for name in parts[0].columns:
+        values = [part[name] for part in parts]
+        if isinstance(values[0].dtype, pd.CategoricalDtype):
+            columns[name] = union_categoricals(values, sort_categories=True, ignore_order=True)
+        else:
+            columns[name] = np.concatenate([v.to_numpy() for v in values])
+    return pd.DataFrame(columns)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream MIMIC-III prescriptions into compact training columns")
+    parser.add_argument('data_path', nargs='?', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dataset'))
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--no-cache', action='store_true', help="always parse the CSV files")
+    args = parser.parse_args()
+
+    df, drug_aliases, stats = ingest_mimic(args.data_path, args.chunk_size, use_cache=not args.no_cache)
+    print(df.dtypes.to_string())
+    print(f"{len(drug_aliases)} drug aliases")
+
+
+if __name__ == "__main__":
+    main()
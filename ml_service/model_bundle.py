@@ -0,0 +1,403 @@
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+
+import joblib
+import numpy as np
+
+from model_files import file_sha256, file_version
+
+# حزمة النموذج: مجلد واحد بإصدار ومخطط ميزات وبصمات ملفات بدل ملفي pickle منفصلين
+#
+#   dosage_model.bundle/
+#     manifest.json       الإصدار، مخطط الميزات، بصمة بيانات التدريب، SHA-256 لكل ملف
+#     model.joblib        Pipeline الكامل (غير مضغوط: مصفوفاته تُربط بالذاكرة بـ mmap_mode)
+#     encoders.joblib     المشفرات
+#     preprocessor.joblib المعالجة المسبقة وحدها (صغيرة)
+#     trees/*.npy         الأشجار المصدّرة (tree_export) مصفوفة لكل ملف
+#
+# أشجار sklearn و XGBoost تُنسخ إلى ذاكرة العملية عند فك pickle مهما كان mmap_mode،
+# لذلك تخدم الواجهة الحزمة بـ preprocessor + الأشجار المصدّرة المربوطة بالذاكرة:
+# التحميل يكاد يقتصر على قراءة الصفحات عند أول لمس، والعمليات تتشارك نفس الصفحات.
+# النموذج الكامل يُحمَّل عند الطلب فقط (الأدوات، إعادة التدريب، النماذج غير القابلة للتصدير)
+
+BUNDLE_FORMAT_VERSION = 1
+MANIFEST = 'manifest.json'
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BUNDLE = os.path.join(BASE_DIR, 'dosage_model.bundle')
+LEGACY_MODEL = os.path.join(BASE_DIR, 'dosage_model.pkl')
+LEGACY_ENCODERS = os.path.join(BASE_DIR, 'encoders.pkl')
+# عدد الصفوف للتحقق من تطابق الأشجار المصدّرة مع المصنف عند الحفظ
+VERIFY_ROWS = 2000
+
+
+def is_bundle(path):
+    return path is not None and os.path.isfile(os.path.join(path, MANIFEST))
+
+
+def resolve_model_paths(model_path=None, encoders_path=None):
+    """(مسار النموذج، مسار المشفرات) لنقاط الدخول
+
+    الترتيب: المعامل ثم MEDLINK_MODEL_PATH ثم dosage_model.bundle بجانب الكود ثم ملفات pickle القديمة؛
+    الحزمة تحمل مشفراتها فيكون مسار المشفرات None
+    """
+    model_path = model_path or os.environ.get('MEDLINK_MODEL_PATH')
+    if model_path is None:
+        model_path = DEFAULT_BUNDLE if is_bundle(DEFAULT_BUNDLE) else LEGACY_MODEL
+    if is_bundle(model_path):
+        return model_path, None
+    encoders_path = (encoders_path or os.environ.get('MEDLINK_ENCODERS_PATH')
+                     or os.path.join(os.path.dirname(model_path), 'encoders.pkl'))
+    return model_path, encoders_path
+
+
+def model_files_exist(model_path, encoders_path=None):
+    if is_bundle(model_path):
+        return True
+    return os.path.isfile(model_path) and encoders_path is not None and os.path.isfile(encoders_path)
+
+
+def feature_schema(model):
+    """أعمدة الإدخال وأنواعها وفئات الإخراج كما تعلمها Pipeline"""
+    from featurizer import unwrap_pipeline
+    from feature_engineering import split_preprocessor, DERIVED_FEATURES
+
+    pipeline = unwrap_pipeline(model)
+    features, preprocessor = split_preprocessor(pipeline.steps[0][1] if hasattr(pipeline, 'steps') else None)
+    schema = {
+        'columns': [str(c) for c in getattr(pipeline, 'feature_names_in_', [])],
+        # أعمدة يحسبها النموذج نفسه (DosageFeatures) ولا تُرسل
+        'derived': list(DERIVED_FEATURES) if features is not None else [],
+        'classes': np.asarray(pipeline.classes_).tolist() if hasattr(pipeline, 'classes_') else None,
+        'numeric': [],
+        'categorical': {},
+    }
+    for name, transformer, columns in getattr(preprocessor, 'transformers_', []):
+        step = transformer.steps[-1][1] if hasattr(transformer, 'steps') else transformer
+        if hasattr(step, 'categories_'):
+            for column, categories in zip(columns, step.categories_):
+                schema['categorical'][str(column)] = [c.item() if isinstance(c, np.generic) else c
+                                                      for c in categories.tolist()]
+        elif hasattr(step, 'mean_'):
+            schema['numeric'].extend(str(c) for c in columns)
+    return schema
+
+
+def frame_sha256(frame):
+    """بصمة DataFrame للتدريب (قيم الصفوف، مستقلة عن الفهرس)"""
+    import pandas as pd
+    return hashlib.sha256(pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes()).hexdigest()
+
+
+def _library_versions():
+    versions = {'python': platform.python_version(), 'numpy': np.__version__}
+    for name in ('sklearn', 'xgboost', 'pandas'):
+        module = sys.modules.get(name)
+        if module is not None:
+            versions[name] = module.__version__
+    return versions
+
+
+def _export_trees(model, directory):
+    """تصدير الأشجار والتحقق منها؛ يعيد وصفها في البيان أو سبب التخطي"""
+    from featurizer import CompiledFeaturizer, unwrap_pipeline
+    from tree_export import export_pipeline, save_ensemble, DEFAULT_TOLERANCE
+
+    try:
+        pipeline = unwrap_pipeline(model)
+        featurizer = CompiledFeaturizer(pipeline)
+        ensemble = export_pipeline(pipeline)
+    except Exception as e:
+        return {'skipped': str(e)}
+    X = featurizer.transform(featurizer.sample_rows(VERIFY_ROWS))
+    difference = float(np.max(np.abs(ensemble.predict_proba(X) - featurizer.classifier.predict_proba(X))))
+    if difference > DEFAULT_TOLERANCE or not np.array_equal(ensemble.classes_, featurizer.classes_):
+        return {'skipped': f"export differs from classifier (max diff {difference})"}
+    save_ensemble(ensemble, os.path.join(directory, 'trees'))
+    joblib.dump(pipeline.steps[0][1], os.path.join(directory, 'preprocessor.joblib'))
+    return {'path': 'trees', 'max_difference': difference, 'verified_rows': VERIFY_ROWS}
+
+
+def save_bundle(directory, model, encoders, training_data=None, parent_version=None):
+    """كتابة الحزمة في مجلد مؤقت ثم استبدال المجلد القديم؛ يعيد البيان"""
+    directory = os.path.abspath(directory)
+    staging = f"{directory}.tmp-{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    # بدون ضغط حتى يمكن ربط المصفوفات بالذاكرة عند التحميل
+    joblib.dump(model, os.path.join(staging, 'model.joblib'))
+    joblib.dump(encoders, os.path.join(staging, 'encoders.joblib'))
+    tree_export = _export_trees(model, staging)
+
+    files = {}
+    for root, _, names in os.walk(staging):
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            files[os.path.relpath(path, staging).replace(os.sep, '/')] = {
+                'sha256': file_sha256(path), 'bytes': os.path.getsize(path)}
+    digest = hashlib.sha256(json.dumps({name: entry['sha256'] for name, entry in sorted(files.items())},
+                                       sort_keys=True).encode('utf-8'))
+    classifier = getattr(getattr(model, 'best_estimator_', model), 'steps', [(None, model)])[-1][1]
+    manifest = {
+        'format_version': BUNDLE_FORMAT_VERSION,
+        'version': digest.hexdigest()[:12],
+        'parent_version': parent_version,
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'model_type': type(classifier).__name__,
+        'feature_schema': feature_schema(model),
+        'training_data': training_data or {},
+        'tree_export': tree_export,
+        'libraries': _library_versions(),
+        'files': files,
+    }
+    with open(os.path.join(staging, MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    # os.replace لا يستبدل مجلداً غير فارغ: نقل القديم جانباً ثم حذفه
+    retired = f"{directory}.old-{os.getpid()}"
+    if os.path.exists(directory):
+        os.replace(directory, retired)
+    os.replace(staging, directory)
+    shutil.rmtree(retired, ignore_errors=True)
+    return manifest
+
+
+class ModelBundle:
+    """نموذج ومشفرات محمّلة من حزمة أو من ملفي pickle قديمين؛ الأجزاء تُحمَّل عند أول استخدام"""
+
+    def __init__(self, path, manifest=None, encoders_path=None, mmap_mode='r'):
+        self.path = path
+        self.manifest = manifest
+        self.encoders_path = encoders_path
+        self.mmap_mode = mmap_mode
+        self._model = None
+        self._encoders = None
+        self._version = manifest['version'] if manifest else None
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    @property
+    def is_bundle(self):
+        return self.manifest is not None
+
+    @property
+    def model(self):
+        """Pipeline الكامل كما حُفظ"""
+        if self._model is None:
+            if self.is_bundle:
+                self._model = joblib.load(self._file('model.joblib'), mmap_mode=self.mmap_mode)
+            else:
+                self._model = joblib.load(self.path)
+        return self._model
+
+    @property
+    def encoders(self):
+        return self.load_encoders()
+
+    def load_encoders(self):
+        """فك المشفرات عند أول استدعاء (encoders.joblib أو encoders.pkl)؛ الاستدعاءات التالية تعيد نفس الكائن"""
+        if self._encoders is None:
+            if self.is_bundle:
+                self._encoders = joblib.load(self._file('encoders.joblib'), mmap_mode=self.mmap_mode)
+            elif self.encoders_path is not None:
+                self._encoders = joblib.load(self.encoders_path)
+        return self._encoders
+
+    @property
+    def version(self):
+        if self._version is None:
+            self._version = file_version(self.path)
+        return self._version
+
+    @property
+    def tree_export_path(self):
+        """الأشجار المصدّرة المتحقق منها (مجلد mmap في الحزمة، أو ملف _trees.npz بجانب pickle)"""
+        if self.is_bundle:
+            export = self.manifest.get('tree_export') or {}
+            return self._file(export['path']) if 'path' in export else None
+        from tree_export import default_export_path
+        path = default_export_path(self.path)
+        return path if os.path.exists(path) else None
+
+    def serving_model(self):
+        """النموذج الذي تستخدمه الواجهة
+
+        في الحزمة مع أشجار مصدّرة: Pipeline من المعالجة المسبقة والأشجار المربوطة بالذاكرة
+        (نفس predict_proba و classes_ دون فك أشجار sklearn/xgboost)؛ وإلا النموذج الكامل
+        """
+        if self.is_bundle and self.tree_export_path is not None:
+            from sklearn.pipeline import Pipeline
+            from tree_export import load_ensemble
+            preprocessor = joblib.load(self._file('preprocessor.joblib'), mmap_mode=self.mmap_mode)
+            return Pipeline([('preprocessor', preprocessor),
+                             ('classifier', load_ensemble(self.tree_export_path, self.mmap_mode))])
+        return self.model
+
+    def verify(self):
+        """مطابقة SHA-256 لكل ملف مع البيان؛ يعيد قائمة الملفات المختلفة"""
+        if not self.is_bundle:
+            return []
+        return [name for name, entry in self.manifest['files'].items()
+                if not os.path.isfile(self._file(name)) or file_sha256(self._file(name)) != entry['sha256']]
+
+
+def load_bundle(directory, mmap_mode='r', verify=False):
+    """قراءة البيان والتحقق من وجود الملفات وأحجامها (verify=True يقارن SHA-256 أيضاً)"""
+    with open(os.path.join(directory, MANIFEST), encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('format_version') != BUNDLE_FORMAT_VERSION:
+        raise ValueError(f"Unsupported bundle format {manifest.get('format_version')} in {directory}")
+    for name, entry in manifest['files'].items():
+        path = os.path.join(directory, name)
+        if not os.path.isfile(path) or os.path.getsize(path) != entry['bytes']:
+            raise ValueError(f"Bundle file {name} is missing or truncated in {directory}")
+    bundle = ModelBundle(directory, manifest, mmap_mode=mmap_mode)
+    if verify:
+        mismatched = bundle.verify()
+        if mismatched:
+            raise ValueError(f"Checksum mismatch in {directory}: {', '.join(mismatched)}")
+    return bundle
+
+
+def load_model_files(model_path=None, encoders_path=None, mmap_mode='r', verify=False):
+    """المدخل الموحد لكل نقاط الدخول: حزمة أو ملفا pickle قديمان (بالمسارات الافتراضية إن لم تُحدد)"""
+    model_path, encoders_path = resolve_model_paths(model_path, encoders_path)
+    if is_bundle(model_path):
+        return load_bundle(model_path, mmap_mode, verify)
+    if not os.path.isfile(model_path):
+        raise FileNotFoundError(f"Model not found: {model_path}")
+    return ModelBundle(model_path, encoders_path=encoders_path)
+
+
+def save_like(source, output_path, model, training_data=None):
+    """حفظ نموذج مشتق (تحديث تدريجي، تقطير) بنفس صيغة مصدره: حزمة بمشفراته أو pickle"""
+    if source.is_bundle:
+        return save_bundle(output_path, model, source.encoders, training_data, parent_version=source.version)
+    joblib.dump(model, output_path)
+    return None
+
+
+# ---------------------------------------------------------------- القياس
+
+def _bench_child(model_path, encoders_path):
+    """عملية فرعية: تحميل مثل الواجهة ثم انتظار قراءة ذاكرتها من العملية الأم"""
+    from model_registry import ModelVersion
+
+    # رسائل التحميل إلى stderr؛ stdout للنتيجة فقط
+    result, sys.stdout = sys.stdout, sys.stderr
+    start = time.perf_counter()
+    version = ModelVersion(model_path, encoders_path)
+    loaded = time.perf_counter() - start
+    # صفوف بكل أعمدة النموذج (بما فيها المشتقة التي لا يرسلها مسار الطلب) لتمرير كل الأشجار
+    import pandas as pd
+    from featurizer import CompiledFeaturizer, unwrap_pipeline
+    sampler = CompiledFeaturizer(unwrap_pipeline(version.model))
+    for size in (1, 64, 512):
+        version.model.predict_proba(pd.DataFrame(sampler.sample_rows(size)))
+    print(json.dumps({'load_s': loaded, 'ready_s': time.perf_counter() - start,
+                      'phases_ms': version.timer.report()['phases_ms']}), file=result, flush=True)
+    sys.stdin.read()
+
+
+def bench_processes(model_path, encoders_path, processes):
+    """تشغيل عدة عمليات مستقلة تحمّل نفس النموذج؛ الزمن و RSS/PSS لكل منها"""
+    from serve import process_memory
+
+    code = f"import sys; sys.path.insert(0, {BASE_DIR!r}); import model_bundle; " \
+           f"model_bundle._bench_child({model_path!r}, {encoders_path!r})"
+    children = [subprocess.Popen([sys.executable, '-c', code], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                 stderr=subprocess.DEVNULL, text=True, cwd=BASE_DIR)
+                for _ in range(processes)]
+    results = []
+    for child in children:
+        line = child.stdout.readline()
+        if not line:
+            raise RuntimeError(f"Benchmark process failed to load {model_path}")
+        results.append(json.loads(line))
+    for child, result in zip(children, results):
+        result.update(process_memory(child.pid))
+    for child in children:
+        child.stdin.close()
+        child.wait()
+    return results
+
+
+def _drop_page_cache(paths):
+    """إخراج الملفات من page cache (لقياس التحميل البارد) إن سمح النظام"""
+    for root in paths:
+        targets = [root] if os.path.isfile(root) else [os.path.join(r, n) for r, _, ns in os.walk(root) for n in ns]
+        for path in targets:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+                os.close(fd)
+            except (OSError, AttributeError):
+                pass
+
+
+def benchmark(pickle_paths, bundle_path, processes=4):
+    rows = []
+    for name, (model_path, encoders_path) in (('pickle', pickle_paths), ('bundle', (bundle_path, None))):
+        _drop_page_cache([p for p in (model_path, encoders_path) if p])
+        for label, count in (('cold', 1), ('warm', processes)):
+            results = bench_processes(model_path, encoders_path, count)
+            rows.append({
+                'format': name, 'start': label, 'processes': count,
+                'load_s': float(np.median([r['load_s'] for r in results])),
+                'ready_s': float(np.median([r['ready_s'] for r in results])),
+                'rss_mb': float(np.median([r.get('rss', 0.0) for r in results])),
+                'pss_mb_total': float(sum(r.get('pss', 0.0) for r in results)),
+            })
+    return rows
+
+
+def format_benchmark(rows):
+    lines = [f"{'format':<8}{'start':<6}{'procs':>6}{'load_s':>9}{'ready_s':>9}{'RSS_MB':>9}{'PSS_MB_total':>14}"]
+    for r in rows:
+        lines.append(f"{r['format']:<8}{r['start']:<6}{r['processes']:>6}{r['load_s']:>9.3f}{r['ready_s']:>9.3f}"
+                     f"{r['rss_mb']:>9.1f}{r['pss_mb_total']:>14.1f}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create, inspect and benchmark model bundles")
+    commands = parser.add_subparsers(dest='command', required=True)
+    pack = commands.add_parser('pack', help="convert dosage_model.pkl + encoders.pkl into a bundle")
+    pack.add_argument('--model', default=LEGACY_MODEL)
+    pack.add_argument('--encoders', default=LEGACY_ENCODERS)
+    pack.add_argument('--output', default=DEFAULT_BUNDLE)
+    verify = commands.add_parser('verify', help="check every file against the manifest checksums")
+    verify.add_argument('bundle', nargs='?', default=DEFAULT_BUNDLE)
+    bench = commands.add_parser('bench', help="load time and RSS/PSS: pickles vs bundle")
+    bench.add_argument('--model', default=LEGACY_MODEL)
+    bench.add_argument('--encoders', default=LEGACY_ENCODERS)
+    bench.add_argument('--bundle', default=DEFAULT_BUNDLE)
+    bench.add_argument('--processes', type=int, default=4)
+    args = parser.parse_args()
+
+    if args.command == 'pack':
+        source = load_model_files(args.model, args.encoders)
+        manifest = save_bundle(args.output, source.model, source.encoders,
+                               {'source': os.path.basename(args.model), 'sha256': file_sha256(args.model)})
+        export = manifest['tree_export']
+        print(f"Bundle {manifest['version']} written to {args.output} ({len(manifest['files'])} files, "
+              f"tree export: {export.get('path') or export.get('skipped')})")
+    elif args.command == 'verify':
+        bundle = load_bundle(args.bundle)
+        mismatched = bundle.verify()
+        print(f"Bundle {bundle.version}: " + (f"MISMATCH {mismatched}" if mismatched else "all checksums match"))
+        sys.exit(1 if mismatched else 0)
+    else:
+        print(format_benchmark(benchmark((args.model, args.encoders), args.bundle, args.processes)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import hashlib
+
+# أدوات مشتركة لملفات النموذج المحفوظة
+
+
+def file_sha256(path):
+    """SHA-256 للملف كاملاً (بصيغة hex) بقراءة 1MB في كل مرة"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_version(path):
+    """إصدار النموذج = أول 12 خانة من SHA-256 لملف النموذج"""
+    return file_sha256(path)[:12]
+
+
+def limit_estimator_threads(model, n_threads):
+    """ضبط n_jobs لكل المقدّرات داخل النموذج (Pipeline، GridSearchCV، VotingClassifier...)
+
+    النماذج المحفوظة تحمل n_jobs=-1 فيتوزع كل طلب على كل الأنوية
+    """
+    seen = set()
+    stack = [model]
+    while stack:
+        estimator = stack.pop()
+        if id(estimator) in seen or not hasattr(estimator, '__dict__'):
+            continue
+        seen.add(id(estimator))
+
+        if 'n_jobs' in vars(estimator):
+            estimator.n_jobs = n_threads
+        if hasattr(estimator, 'get_booster'):
+            try:
+                estimator.get_booster().set_param('nthread', n_threads)
+            except Exception:
+                pass
+
+        for name, step in getattr(estimator, 'steps', []):
+            stack.append(step)
+        for name, transformer, columns in getattr(estimator, 'transformers_', []):
+            stack.append(transformer)
+        if hasattr(estimator, 'best_estimator_'):
+            stack.append(estimator.best_estimator_)
+        members = getattr(estimator, 'estimators_', None)
+        if isinstance(members, list):
+            stack.extend(members)
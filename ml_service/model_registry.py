@@ -0,0 +1,252 @@
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+import numpy as np
+
+from featurizer import compile_pipeline
+from tree_export import FlatEnsemble, attach_exported_ensemble
+from model_bundle import load_model_files
+from feature_engineering import BASE_FEATURES
+from decision_table import DecisionTable, NOT_SPECIFIED
+from drug_index import DrugIndex
+from catalog import Catalog
+from model_files import limit_estimator_threads
+from startup_timing import StartupTimer
+from metrics import NULL_CLOCK
+
+# سجل إصدارات النموذج في الذاكرة: تحميل الإصدار الجديد وتسخينه في الخلفية
+# ثم تبديله دفعة واحدة؛ الطلبات الجارية تكمل على الإصدار الذي بدأت به
+
+# أعمدة الإدخال بالترتيب الذي تدرب عليه النموذج (المشتقة تُحسب داخل Pipeline)
+FEATURE_COLUMNS = BASE_FEATURES
+
+
+class ModelVersion:
+    """كل ما يلزم لخدمة إصدار واحد: النموذج، المشفرات، الفهارس والمسارات السريعة"""
+
+    def __init__(self, model_path, encoders_path, predict_mode="model", inference_threads=0,
+                 tree_export_path=None, decision_table_path=None):
+        start = time.perf_counter()
+        # زمن كل مرحلة من مراحل التحميل (يظهر في /ready و /admin/models)
+        self.timer = StartupTimer()
+        # حزمة (dosage_model.bundle) أو ملفا pickle قديمان؛ None = المسارات الافتراضية
+        self.bundle = load_model_files(model_path, encoders_path)
+        self.model_path = self.bundle.path
+        self.encoders_path = self.bundle.encoders_path
+        modules_before = len(sys.modules)
+        with self.timer.phase("unpickle_model"):
+            # يشمل استيراد sklearn/xgboost التي يحتاجها الملف عند أول تحميل؛
+            # في الحزمة: المعالجة المسبقة + الأشجار المصدّرة المربوطة بالذاكرة فقط
+            self.model = self.bundle.serving_model()
+        self.modules_imported = len(sys.modules) - modules_before
+        with self.timer.phase("unpickle_encoders"):
+            self.encoders = self.bundle.load_encoders()
+        with self.timer.phase("model_version"):
+            # الحزمة تحمل إصدارها في البيان؛ ملف pickle القديم يُحسب إصداره من SHA-256 محتواه
+            self.version = self.bundle.version
+        if inference_threads > 0:
+            limit_estimator_threads(self.model, inference_threads)
+
+        with self.timer.phase("build_indexes"):
+            # جداول بحث ثابتة بدلاً من استدعاء transform لكل قيمة
+            self.category_codes = {
+                name: {value: code for code, value in enumerate(encoder.classes_)}
+                for name, encoder in self.encoders.items()
+                if hasattr(encoder, 'classes_')
+            }
+            # فهرس n-gram لكل أشكال أسماء الأدوية (مع الأسماء البديلة من بيانات التدريب إن وجدت)
+            self.drug_index = DrugIndex(self.category_codes.get('drug', {}), self.encoders.get('drug_aliases'))
+
+        with self.timer.phase("build_catalog"):
+            # /catalog و /drugs: مستندات JSON و gzip جاهزة مع ETag لهذا الإصدار
+            self.catalog = Catalog.from_encoders(self.version, self.encoders)
+
+        with self.timer.phase("compile_featurizer"):
+            # مسار توقع بدون pandas - يُستخدم فقط إذا طابق Pipeline الأصلي تماماً
+            self.featurizer = compile_pipeline(self.model) if hasattr(self.model, 'predict_proba') else None
+
+        # تقييم الأشجار المصدّرة بـ NumPy بدلاً من آلية التوقع في sklearn/xgboost
+        # (النموذج المحمّل من حزمة بأشجار مصدّرة هو الأشجار نفسها)
+        tree_export_path = tree_export_path or self.bundle.tree_export_path
+        if (self.featurizer is not None and not isinstance(self.featurizer.classifier, FlatEnsemble)
+                and tree_export_path is not None and os.path.exists(tree_export_path)):
+            with self.timer.phase("attach_tree_export"):
+                attach_exported_ensemble(self.featurizer, tree_export_path)
+
+        self.decision_table = None
+        if predict_mode == "table":
+            table_path = decision_table_path or os.path.join(os.path.dirname(self.model_path), 'dosage_table')
+            try:
+                table = DecisionTable(table_path)
+                if table.model_version != self.version:
+                    print(f"Decision table disabled: built for model {table.model_version}, loaded {self.version}")
+                else:
+                    self.decision_table = table
+                    print(f"Decision table loaded from {table_path}")
+            except Exception as e:
+                print(f"Decision table disabled: {str(e)}")
+
+        self.load_seconds = time.perf_counter() - start
+        self.warmup_seconds = None
+        self.loaded_at = time.time()
+
+    def predict_rows(self, feature_rows, code_rows, clock=NULL_CLOCK):
+        """تشغيل النموذج مرة واحدة على مجموعة من المرضى
+
+        يعيد (الفئات, مستويات الثقة) بنفس ترتيب المدخلات
+        """
+        if self.decision_table is not None:
+            try:
+                result = self.decision_table.lookup(feature_rows)
+                clock.lap("table_lookup")
+                return result
+            except KeyError:
+                clock.lap("table_lookup")  # صف خارج الجدول - التوقع بالنموذج
+
+        if self.featurizer is not None:
+            # المسار المجمّع: كتابة الميزات مباشرة في مصفوفة NumPy واستدعاء المصنف مرة واحدة
+            featurizer = self.featurizer
+            if len(feature_rows) == 1:
+                features = featurizer.transform_one(feature_rows[0])
+            else:
+                features = featurizer.transform(feature_rows)
+            clock.lap("preprocess")
+            probabilities = featurizer.scorer.predict_proba(features)
+            clock.lap("classifier")
+            best = probabilities.argmax(axis=1)
+            predictions = self.featurizer.classes_[best]
+            confidences = probabilities[np.arange(len(best)), best]
+        elif hasattr(self.model, 'predict_proba'):
+            # نموذج يدعم احتمالات التوقع - استدعاء واحد لكل المصفوفة
+            import pandas as pd
+            feature_df = pd.DataFrame(feature_rows, columns=FEATURE_COLUMNS)
+            clock.lap("preprocess")
+            # Pipeline غير المجمّع: التحويل والمصنف في استدعاء واحد
+            probabilities = self.model.predict_proba(feature_df)
+            clock.lap("classifier")
+            best = probabilities.argmax(axis=1)
+            predictions = np.asarray(self.model.classes_)[best]
+            confidences = probabilities[np.arange(len(best)), best]
+        else:
+            # طريقة احتياطية للنماذج البسيطة
+            predictions = self.model.predict(code_rows)
+            clock.lap("classifier")
+            confidences = np.full(len(code_rows), 0.8)  # قيمة افتراضية
+        return [int(p) for p in predictions], [float(c) for c in confidences]
+
+    def synthetic_rows(self, n):
+        """طلبات اصطناعية صالحة من القيم التي تعرفها المشفرات (للتسخين)"""
+        columns = [('drug', 'drug'), ('route', 'route'), ('gender', 'gender'), ('admission_type', 'admission')]
+        vocabularies = {column: list(self.category_codes.get(name, {}).items()) for column, name in columns}
+        feature_rows, code_rows = [], []
+        for i in range(n):
+            row = {'age': float(1 + (i * 7) % 90), 'weight': float(40 + (i * 11) % 80), 'diagnosis': NOT_SPECIFIED}
+            codes = [row['age']]
+            for column, _ in columns:
+                values = vocabularies[column]
+                value, code = values[i % len(values)] if values else (None, -1)
+                row[column] = value
+                codes.append(code)
+            feature_rows.append(row)
+            code_rows.append(codes)
+        return feature_rows, code_rows
+
+    def warm_up(self, batch_sizes=(1, 1, 8, 64)):
+        """تشغيل توقعات اصطناعية لتهيئة المسارات والذاكرة قبل استقبال الطلبات"""
+        start = time.perf_counter()
+        for size in batch_sizes:
+            self.predict_rows(*self.synthetic_rows(size))
+        self.warmup_seconds = time.perf_counter() - start
+        self.timer.record("warm_up", self.warmup_seconds)
+        return self.warmup_seconds
+
+    def info(self):
+        return {
+            "version": self.version,
+            "model_path": self.model_path,
+            "encoders_path": self.encoders_path,
+            "loaded_at": self.loaded_at,
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "phases_ms": self.timer.report()["phases_ms"],
+            "modules_imported_by_unpickle": self.modules_imported,
+            "compiled_featurizer": self.featurizer is not None,
+            "tree_evaluator": self.featurizer is not None and isinstance(self.featurizer.scorer, FlatEnsemble),
+            "bundle": self.bundle.is_bundle,
+            "decision_table": self.decision_table is not None,
+        }
+
+
+class ModelRegistry:
+    """يحتفظ بآخر keep إصدارات في الذاكرة للتراجع الفوري"""
+
+    def __init__(self, keep=2, on_activate=None, **load_options):
+        self.keep = max(1, keep)
+        self.on_activate = on_activate
+        self.load_options = load_options
+        self._versions = OrderedDict()
+        self._current = None
+        self._lock = threading.Lock()
+        self.reload_status = {"state": "idle"}
+
+    def current(self):
+        """الإصدار النشط؛ يجب أخذه مرة واحدة في بداية كل طلب"""
+        return self._current
+
+    def load(self, model_path, encoders_path, warm_up=True):
+        """تحميل وتسخين إصدار ثم تفعيله (متزامن)"""
+        version = ModelVersion(model_path, encoders_path, **self.load_options)
+        if warm_up:
+            version.warm_up()
+        with self._lock:
+            self._versions[version.version] = version
+            self._versions.move_to_end(version.version)
+            self._activate_locked(version)
+            while len(self._versions) > self.keep:
+                oldest = next(v for v in self._versions if v != self._current.version)
+                del self._versions[oldest]
+        print(f"Model {version.version} active (load {version.load_seconds:.2f}s, warm-up {version.warmup_seconds or 0:.2f}s)")
+        return version
+
+    def activate(self, version_id):
+        """التراجع إلى إصدار ما زال محمّلاً في الذاكرة"""
+        with self._lock:
+            version = self._versions[version_id]
+            self._activate_locked(version)
+        return version
+
+    def _activate_locked(self, version):
+        # تبديل المرجع عملية ذرية؛ الطلبات الجارية تحتفظ بمرجع الإصدار القديم
+        self._current = version
+        if self.on_activate is not None:
+            self.on_activate(version)
+
+    def reload_async(self, model_path, encoders_path):
+        """بدء التحميل في thread خلفي؛ يعيد False إذا كان هناك تحميل جارٍ"""
+        with self._lock:
+            if self.reload_status["state"] == "loading":
+                return False
+            self.reload_status = {"state": "loading", "model_path": model_path, "started_at": time.time()}
+        threading.Thread(target=self._reload, args=(model_path, encoders_path),
+                         name="model-reload", daemon=True).start()
+        return True
+
+    def _reload(self, model_path, encoders_path):
+        try:
+            version = self.load(model_path, encoders_path)
+            status = {"state": "idle", "last_version": version.version,
+                      "load_seconds": version.load_seconds, "warmup_seconds": version.warmup_seconds}
+        except Exception as e:
+            traceback.print_exc()
+            status = {"state": "failed", "model_path": model_path, "error": str(e)}
+        with self._lock:
+            self.reload_status = {**status, "finished_at": time.time()}
+
+    def versions(self):
+        with self._lock:
+            current = self._current
+            return [dict(v.info(), active=v is current) for v in reversed(self._versions.values())]
@@ -0,0 +1,328 @@
+import argparse
+import csv
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import time
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+import scipy.sparse as sp
+from joblib import Parallel, delayed, parallel_backend
+from sklearn.base import clone
+from sklearn.exceptions import ConvergenceWarning
+from sklearn.model_selection import StratifiedKFold
+
+from model_files import limit_estimator_threads
+from training_orchestrator import build_preprocessor, default_candidates, plan_workers
+
+# ضبط المعاملات بالتقسيم المتتالي (successive halving):
+# - المعالجة المسبقة و SMOTE تُطبَّق مرة واحدة لكل طية وتُحفظ .npy تقرؤها العمليات بـ mmap
+# - كل عائلة نماذج تبدأ بكل توليفاتها بميزانية صغيرة (عدد الأشجار أو الحقب)،
+#   ثم يبقى أفضل 1/eta منها وتُضرب الميزانية في eta حتى الميزانية الكاملة
+# - ميزانية زمن اختيارية: المرشح الأبطأ منها في توقع صف واحد يُرتَّب بعد كل من يلتزم بها
+
+# المعامل الذي يمثل الميزانية لكل عائلة؛ قيمته في النموذج الأساسي = الميزانية الكاملة
+BUDGET_PARAMS = {
+    'Random Forest': 'n_estimators',
+    'Gradient Boosting': 'n_estimators',
+    'XGBoost': 'n_estimators',
+    'Neural Network': 'max_iter',
+}
+
+# التوليفات المجرَّبة حول القيم الافتراضية في training_orchestrator.default_candidates
+SEARCH_SPACE = {
+    'Random Forest': {'max_depth': [15, 30], 'min_samples_leaf': [1, 2, 4]},
+    'Gradient Boosting': {'learning_rate': [0.05, 0.1], 'max_depth': [3, 5, 7]},
+    'XGBoost': {'learning_rate': [0.05, 0.1], 'max_depth': [4, 6, 7]},
+    'Neural Network': {'hidden_layer_sizes': [(200, 100, 50), (100, 50), (64,)], 'alpha': [0.0001, 0.001]},
+}
+
+LEADERBOARD_FIELDS = ['rank', 'model', 'params', 'budget', 'rounds', 'accuracy', 'accuracy_std',
+                      'fit_seconds', 'predict_us_per_row', 'single_row_ms', 'within_latency_budget']
+
+
+def expand_grid(grid):
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+class FoldCache:
+    """طيات التحقق بعد المعالجة المسبقة وإعادة الموازنة، محفوظة في مجلد ومقروءة بـ mmap"""
+
+    def __init__(self, X, y, preprocessor, resampler=None, n_splits=3, random_state=42, directory=None):
+        self.n_splits = n_splits
+        self.owned = directory is None
+        self.directory = directory or tempfile.mkdtemp(prefix='medlink-folds-')
+        os.makedirs(self.directory, exist_ok=True)
+        start = time.perf_counter()
+        y = np.asarray(y)
+        folds = StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=random_state)
+        for index, (train, val) in enumerate(folds.split(X, y)):
+            fold_preprocessor = clone(preprocessor)
+            # y لترميز الهدف في مسار MEDLINK_SPARSE=target
+            X_train = fold_preprocessor.fit_transform(X.iloc[train], y[train])
+            X_val = fold_preprocessor.transform(X.iloc[val])
+            y_train = y[train]
+            if resampler is not None:
+                X_train, y_train = clone(resampler).fit_resample(X_train, y_train)
+            for name, array in (('X_train', X_train), ('y_train', y_train), ('X_val', X_val), ('y_val', y[val])):
+                if sp.issparse(array):
+                    # مخرجات المعالجة المتفرقة (MEDLINK_SPARSE) تُحفظ CSR كما هي وتُقرأ دون mmap
+                    sp.save_npz(self._path(index, name, '.npz'), array.tocsr(), compressed=False)
+                else:
+                    np.save(self._path(index, name), np.asarray(array))
+        self.build_seconds = time.perf_counter() - start
+
+    def _path(self, index, name, suffix='.npy'):
+        return os.path.join(self.directory, f"fold-{index}-{name}{suffix}")
+
+    def _load(self, index, name):
+        path = self._path(index, name, '.npz')
+        if os.path.exists(path):
+            return sp.load_npz(path)
+        return np.load(self._path(index, name), mmap_mode='r')
+
+    def load(self, index):
+        return tuple(self._load(index, name) for name in ('X_train', 'y_train', 'X_val', 'y_val'))
+
+    def close(self):
+        if self.owned:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def _run_trial(estimator, fold_cache, fold, threads, keep_model):
+    X_train, y_train, X_val, y_val = fold_cache.load(fold)
+    limit_estimator_threads(estimator, threads)
+    with warnings.catch_warnings():
+        # الميزانيات الصغيرة تنتهي قبل التقارب عمداً
+        warnings.simplefilter('ignore', ConvergenceWarning)
+        start = time.perf_counter()
+        estimator.fit(X_train, y_train)
+        fit_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    accuracy = float(np.mean(estimator.predict(X_val) == y_val))
+    predict_seconds = time.perf_counter() - start
+
+    # النموذج المدرَّب على طية واحدة يعود للعملية الرئيسية لقياس زمن الصف الواحد
+    return accuracy, fit_seconds, predict_seconds / len(y_val) * 1e6, estimator if keep_model else None
+
+
+def _single_row_ms(estimator, row, repeats=15):
+    """زمن طلب API واحد: توقع صف واحد (الوسيط لعدة محاولات)
+
+    يُقاس تسلسلياً في العملية الرئيسية؛ داخل عمال Parallel تتنافس المهام على الأنوية فيتضخم الزمن
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        estimator.predict(row)
+        times.append(time.perf_counter() - start)
+    return float(np.median(times) * 1000)
+
+
+class Trial:
+    def __init__(self, family, params, base):
+        self.family = family
+        self.params = params
+        self.base = base
+        self.budget = None
+        self.rounds = 0
+        self.scores = None
+
+    def estimator(self, budget):
+        return clone(self.base).set_params(**self.params, **{BUDGET_PARAMS[self.family]: budget})
+
+    def objective(self, latency_budget_ms):
+        accuracy = self.scores['accuracy']
+        if latency_budget_ms is not None and not self.within_budget(latency_budget_ms):
+            # خارج ميزانية الزمن: يبقى في الترتيب لكن بعد كل المرشحين الملتزمين بها
+            return accuracy - 1.0
+        return accuracy
+
+    def within_budget(self, latency_budget_ms):
+        if latency_budget_ms is None:
+            return True
+        return self.scores['single_row_ms'] <= latency_budget_ms
+
+    def row(self, latency_budget_ms):
+        return {
+            'model': self.family,
+            'params': json.dumps(self.params, default=list),
+            'budget': self.budget,
+            'rounds': self.rounds,
+            'accuracy': round(self.scores['accuracy'], 4),
+            'accuracy_std': round(self.scores['accuracy_std'], 4),
+            'fit_seconds': round(self.scores['fit_seconds'], 3),
+            'predict_us_per_row': round(self.scores['predict_us_per_row'], 2),
+            'single_row_ms': round(self.scores['single_row_ms'], 3),
+            'within_latency_budget': self.within_budget(latency_budget_ms),
+        }
+
+
+class TuningResult:
+    def __init__(self, trials, latency_budget_ms, seconds):
+        self.latency_budget_ms = latency_budget_ms
+        self.seconds = seconds
+        # الأعمق (ميزانية أكبر) أولاً ثم الأفضل هدفاً
+        self.trials = sorted(trials, key=lambda t: (-t.rounds, -t.objective(latency_budget_ms)))
+
+    def leaderboard(self):
+        return [dict(rank=rank, **trial.row(self.latency_budget_ms))
+                for rank, trial in enumerate(self.trials, start=1)]
+
+    def best_params(self):
+        """أفضل معاملات لكل عائلة (بدون معامل الميزانية؛ التدريب النهائي بالميزانية الكاملة)"""
+        best = OrderedDict()
+        for trial in self.trials:
+            best.setdefault(trial.family, dict(trial.params))
+        return best
+
+    def write(self, path):
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=LEADERBOARD_FIELDS)
+            writer.writeheader()
+            writer.writerows(self.leaderboard())
+
+
+def format_leaderboard(rows, limit=None):
+    lines = [f"{'#':>3} {'model':<18}{'budget':>7}{'acc':>8}{'fit_s':>8}{'us/row':>9}{'1row_ms':>9}  params"]
+    for row in rows[:limit]:
+        flag = '' if row['within_latency_budget'] else ' (over latency budget)'
+        lines.append(f"{row['rank']:>3} {row['model']:<18}{row['budget']:>7}{row['accuracy']:>8.4f}"
+                     f"{row['fit_seconds']:>8.2f}{row['predict_us_per_row']:>9.2f}{row['single_row_ms']:>9.3f}"
+                     f"  {row['params']}{flag}")
+    return "\n".join(lines)
+
+
+def tune(candidates, X, y, search_space=None, n_splits=3, eta=3, min_fraction=None,
+         latency_budget_ms=None, workers=None, threads_per_job=None, resampler='smote',
+         preprocessor=None, fold_dir=None, leaderboard_path='tuning_leaderboard.csv', verbose=True):
+    """ضبط {اسم العائلة: المقدّر الأساسي} على X (أعمدة خام) بالتقسيم المتتالي
+
+    preprocessor: نفس المعالجة المسبقة (غير المدرَّبة) التي يستخدمها التدريب، مثل مسار
+    MEDLINK_SPARSE في advanced_model.py؛ الافتراضي build_preprocessor()
+
+    min_fraction: نسبة الميزانية في الجولة الأولى (الافتراضي eta^-(عدد الجولات-1)
+    بحيث تنتهي آخر جولة بالميزانية الكاملة لمرشح واحد من كل عائلة)
+    """
+    started = time.perf_counter()
+    search_space = SEARCH_SPACE if search_space is None else search_space
+    if resampler == 'smote':
+        from imblearn.over_sampling import SMOTE
+        resampler = SMOTE(random_state=42)
+
+    brackets = OrderedDict()
+    for family, base in candidates.items():
+        if family in BUDGET_PARAMS:
+            grid = expand_grid(search_space.get(family, {})) or [{}]
+            brackets[family] = [Trial(family, params, base) for params in grid]
+
+    largest = max(len(trials) for trials in brackets.values())
+    rounds = 1
+    while largest > 1:
+        largest = max(1, largest // eta)
+        rounds += 1
+    fraction = min_fraction if min_fraction is not None else eta ** -(rounds - 1)
+
+    preprocessor = build_preprocessor() if preprocessor is None else preprocessor
+    folds = FoldCache(X, y, preprocessor, resampler, n_splits=n_splits, directory=fold_dir)
+    # صف التحقق الذي يُقاس عليه زمن التوقع الفردي لكل مرشح
+    latency_row = folds.load(0)[2][:1]
+    latency_row = latency_row if sp.issparse(latency_row) else np.array(latency_row)
+    if verbose:
+        print(f"Fold cache: {n_splits} folds preprocessed once in {folds.build_seconds:.2f}s ({folds.directory})")
+
+    total_jobs = sum(len(trials) for trials in brackets.values()) * n_splits
+    workers, threads = plan_workers(total_jobs, workers, threads_per_job)
+    try:
+        with parallel_backend('loky', inner_max_num_threads=threads):
+            with Parallel(n_jobs=workers) as parallel:
+                alive = {family: list(trials) for family, trials in brackets.items()}
+                while True:
+                    jobs = []
+                    for family, trials in alive.items():
+                        full = candidates[family].get_params()[BUDGET_PARAMS[family]]
+                        budget = max(1, int(round(full * min(1.0, fraction))))
+                        for trial in trials:
+                            trial.budget = budget
+                            for fold in range(n_splits):
+                                jobs.append((trial, fold))
+                    if verbose:
+                        print(f"Round at {min(1.0, fraction):.0%} budget: "
+                              f"{sum(len(t) for t in alive.values())} candidates x {n_splits} folds")
+                    outputs = parallel(
+                        delayed(_run_trial)(trial.estimator(trial.budget), folds, fold, threads, fold == 0)
+                        for trial, fold in jobs
+                    )
+                    _record(jobs, outputs, latency_row)
+                    if fraction >= 1.0:
+                        break
+                    for family, trials in alive.items():
+                        trials.sort(key=lambda t: -t.objective(latency_budget_ms))
+                        alive[family] = trials[:max(1, len(trials) // eta)]
+                    fraction *= eta
+    finally:
+        folds.close()
+
+    result = TuningResult([t for trials in brackets.values() for t in trials], latency_budget_ms,
+                          time.perf_counter() - started)
+    if leaderboard_path:
+        result.write(leaderboard_path)
+    if verbose:
+        print(format_leaderboard(result.leaderboard(), limit=15))
+        where = f", leaderboard written to {leaderboard_path}" if leaderboard_path else ""
+        print(f"Tuning finished in {result.seconds:.1f}s{where}")
+    return result
+
+
+def _record(jobs, outputs, latency_row):
+    per_trial = OrderedDict()
+    for (trial, fold), output in zip(jobs, outputs):
+        per_trial.setdefault(id(trial), (trial, []))[1].append(output)
+    for trial, results in per_trial.values():
+        accuracy = [r[0] for r in results]
+        trial.rounds += 1
+        trial.scores = {
+            'accuracy': float(np.mean(accuracy)),
+            'accuracy_std': float(np.std(accuracy)),
+            'fit_seconds': float(np.mean([r[1] for r in results])),
+            'predict_us_per_row': float(np.mean([r[2] for r in results])),
+            'single_row_ms': _single_row_ms(next(r[3] for r in results if r[3] is not None), latency_row),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Successive-halving hyperparameter search for the advanced model")
+    parser.add_argument('--samples', type=int, default=20000, help="synthetic rows to tune on")
+    parser.add_argument('--folds', type=int, default=3)
+    parser.add_argument('--eta', type=int, default=3)
+    parser.add_argument('--min-fraction', type=float, help="budget fraction of the first round")
+    parser.add_argument('--latency-budget-ms', type=float, help="max single-row predict time")
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--threads-per-job', type=int)
+    parser.add_argument('--models', nargs='*', help="families to tune (default: all)")
+    parser.add_argument('--output', default='tuning_leaderboard.csv')
+    args = parser.parse_args()
+
+    from synthetic_data import generate_dataset
+    from feature_engineering import BASE_FEATURES
+
+    df = generate_dataset(args.samples, seed=42)
+    candidates = default_candidates()
+    if args.models:
+        candidates = OrderedDict((name, candidates[name]) for name in args.models)
+    result = tune(candidates, df[BASE_FEATURES], df['dosage_class'],
+                  n_splits=args.folds, eta=args.eta, min_fraction=args.min_fraction,
+                  latency_budget_ms=args.latency_budget_ms, workers=args.workers,
+                  threads_per_job=args.threads_per_job, leaderboard_path=args.output)
+    for family, params in result.best_params().items():
+        print(f"Best {family}: {params}")
+
+
+if __name__ == "__main__":
+    main()
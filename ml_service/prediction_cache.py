@@ -0,0 +1,77 @@
+import threading
+import time
+from collections import OrderedDict
+
+# ذاكرة مؤقتة LRU محدودة الحجم لنتائج التوقع داخل العملية
+# المفتاح هو صف الميزات بعد التطبيع (اسم الدواء المصحح، الوزن الافتراضي...)
+
+
+class PredictionCache:
+    """ذاكرة LRU مع مدة صلاحية وعدادات، تُفرغ عند تغيير إصدار النموذج"""
+
+    def __init__(self, max_size=10000, ttl_seconds=300.0):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.model_version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def get(self, key):
+        """إرجاع القيمة المخزنة أو None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if self.ttl_seconds and expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds else 0.0
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def reset(self, model_version):
+        """تفريغ الذاكرة عند تحميل إصدار جديد من النموذج"""
+        with self._lock:
+            self._entries.clear()
+            self.model_version = model_version
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "model_version": self.model_version,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,172 @@
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+# مشغّل الإنتاج: تحميل النموذج مرة واحدة في العملية الأم قبل fork
+# فتتشارك العمليات الفرعية صفحات الذاكرة (copy-on-write)،
+# مع تحديد عدد العمليات من الأنوية المتاحة وميزانية threads ثابتة لكل عملية
+
+THREAD_ENV_VARS = (
+    'OMP_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+    'MKL_NUM_THREADS',
+    'VECLIB_MAXIMUM_THREADS',
+    'NUMEXPR_NUM_THREADS',
+)
+
+
+def available_cores():
+    """الأنوية المسموح بها لهذه العملية (تحترم cgroups/taskset على لينكس)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def autosize_workers(threads_per_worker):
+    return max(1, available_cores() // max(1, threads_per_worker))
+
+
+def apply_thread_budget(n_threads):
+    """يجب استدعاؤها قبل استيراد numpy/sklearn حتى تلتزم مكتبات BLAS/OpenMP بالميزانية"""
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(n_threads)
+    os.environ['MEDLINK_INFERENCE_THREADS'] = str(n_threads)
+
+
+def limit_threadpools(n_threads):
+    """ضبط مجمعات threads المحمّلة فعلاً (threadpoolctl يأتي مع scikit-learn)"""
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(n_threads)
+    except ImportError:
+        pass
+
+
+def process_memory(pid):
+    """RSS و PSS بالميغابايت؛ PSS يقسم الصفحات المشتركة على العمليات التي تشاركها"""
+    memory = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in ('Rss', 'Pss', 'Shared_Clean', 'Private_Dirty'):
+                    memory[key.lower()] = int(value.split()[0]) / 1024
+    except OSError:
+        pass
+    return memory
+
+
+def serve_single(args):
+    import uvicorn
+    import api
+    uvicorn.run(api.app, host=args.host, port=args.port, log_level=args.log_level)
+
+
+def serve_prefork(args, workers):
+    import uvicorn
+
+    start = time.perf_counter()
+    # التحميل والتسخين يجب أن يكتملا في العملية الأم قبل fork
+    os.environ['MEDLINK_BACKGROUND_LOAD'] = '0'
+    import api  # يحمّل النموذج والمشفرات مرة واحدة قبل fork
+    runtime = api.registry.current()
+    if runtime is None:
+        print("Model not loaded; refusing to start workers")
+        sys.exit(1)
+    print(f"Model {runtime.version} preloaded in {time.perf_counter() - start:.2f}s")
+
+    # نقل الكائنات المحمّلة إلى جيل دائم حتى لا يلمسها جامع القمامة فتُنسخ صفحاتها
+    gc.collect()
+    gc.freeze()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(args.backlog)
+    sock.set_inheritable(True)
+
+    children = {}
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            limit_threadpools(args.threads_per_worker)
+            config = uvicorn.Config(api.app, log_level=args.log_level, timeout_keep_alive=args.keep_alive)
+            uvicorn.Server(config).run(sockets=[sock])
+            os._exit(0)
+        children[pid] = index
+
+    for index in range(workers):
+        spawn(index)
+    print(f"Serving on http://{args.host}:{args.port} with {workers} workers "
+          f"x {args.threads_per_worker} inference threads ({available_cores()} cores)")
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    last_report = time.monotonic()
+    while children:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            index = children.pop(pid, None)
+            if index is not None and not stopping:
+                print(f"Worker {pid} exited with status {status}; restarting")
+                spawn(index)
+            continue
+
+        if args.memory_report and time.monotonic() - last_report >= args.memory_report:
+            last_report = time.monotonic()
+            for pid, index in sorted(children.items(), key=lambda item: item[1]):
+                memory = process_memory(pid)
+                print(f"worker {index} pid={pid} " + " ".join(f"{k}={v:.1f}MB" for k, v in memory.items()))
+        time.sleep(0.5)
+    sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MedLink dosage API production launcher")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=0, help="0 = available cores / threads per worker")
+    parser.add_argument('--threads-per-worker', type=int, default=1)
+    parser.add_argument('--backlog', type=int, default=2048)
+    parser.add_argument('--keep-alive', type=int, default=5)
+    parser.add_argument('--log-level', default='warning')
+    parser.add_argument('--memory-report', type=float, default=0.0,
+                        help="print per-worker RSS/PSS every N seconds")
+    args = parser.parse_args()
+
+    apply_thread_budget(args.threads_per_worker)
+    workers = args.workers or autosize_workers(args.threads_per_worker)
+
+    if not hasattr(os, 'fork'):
+        # ويندوز لا يدعم fork: عملية واحدة بنفس ميزانية threads
+        print("fork() not available; starting a single worker")
+        serve_single(args)
+    else:
+        serve_prefork(args, workers)
+
+
+if __name__ == "__main__":
+    main()
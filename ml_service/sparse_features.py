@@ -0,0 +1,174 @@
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.compose import ColumnTransformer
+from sklearn.feature_extraction import FeatureHasher
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder, StandardScaler, TargetEncoder
+
+from training_orchestrator import NUMERIC_FEATURES, CATEGORICAL_FEATURES
+from feature_engineering import with_engineered_features
+
+# مسار معالجة مسبقة يبقى sparse (CSR) من المشفرات حتى المقدّرات:
+# - الأعمدة الفئوية العادية: OneHotEncoder بمخرجات CSR (float32)
+# - الأعمدة ذات الفئات الكثيرة جداً (آلاف الأدوية أو رموز ICD):
+#   hash  = تجزئة إلى عدد ثابت من الأعمدة مهما زادت الفئات (تبقى sparse)
+#   target = متوسط فئة الجرعة لكل قيمة (عمود كثيف واحد؛ فئات الجرعة مرتبة 0..3)
+# sparse_threshold=1.0 يمنع ColumnTransformer من تحويل الناتج إلى مصفوفة كثيفة
+
+# فوق هذا العدد من الفئات لا يُستخدم one-hot للعمود
+ONEHOT_MAX_CATEGORIES = 2000
+HASH_FEATURES = 2 ** 14
+
+
+class HashingEncoder(BaseEstimator, TransformerMixin):
+    """تجزئة "العمود=القيمة" لكل الأعمدة في فضاء مشترك من n_features عمود CSR"""
+
+    def __init__(self, n_features=HASH_FEATURES):
+        self.n_features = n_features
+
+    def fit(self, X, y=None):
+        self.columns_ = list(X.columns) if hasattr(X, 'columns') else [str(i) for i in range(np.shape(X)[1])]
+        self.n_features_in_ = len(self.columns_)
+        return self
+
+    def transform(self, X):
+        values = X.to_numpy() if hasattr(X, 'to_numpy') else np.asarray(X)
+        tokens = ([f"{column}={value}" for column, value in zip(self.columns_, row)] for row in values)
+        hasher = FeatureHasher(n_features=self.n_features, input_type='string', alternate_sign=False,
+                               dtype=np.float32)
+        return hasher.transform(tokens).tocsr()
+
+    def get_feature_names_out(self, input_features=None):
+        return np.array([f"hash_{i}" for i in range(self.n_features)], dtype=object)
+
+
+def high_cardinality_columns(X, columns, max_categories=ONEHOT_MAX_CATEGORIES):
+    # الأعمدة المشتقة (فئات العمر والوزن) قد لا تكون في المدخلات وفئاتها قليلة دائماً
+    return [column for column in columns if column in X.columns and X[column].nunique() > max_categories]
+
+
+def build_sparse_preprocessor(X, numeric=NUMERIC_FEATURES, categorical=CATEGORICAL_FEATURES,
+                              high_cardinality='hash', max_categories=ONEHOT_MAX_CATEGORIES,
+                              hash_features=HASH_FEATURES):
+    """الأعمدة المشتقة ثم ColumnTransformer بمخرجات CSR؛ high_cardinality: 'hash' أو 'target' أو 'onehot' (بدون بديل)"""
+    wide = [] if high_cardinality == 'onehot' else high_cardinality_columns(X, categorical, max_categories)
+    narrow = [column for column in categorical if column not in wide]
+    transformers = [
+        ('num', Pipeline(steps=[('scaler', StandardScaler())]), list(numeric)),
+        ('cat', Pipeline(steps=[
+            ('onehot', OneHotEncoder(handle_unknown='ignore', sparse_output=True, dtype=np.float32))
+        ]), narrow),
+    ]
+    if wide and high_cardinality == 'hash':
+        transformers.append(('hashed', HashingEncoder(hash_features), wide))
+    elif wide and high_cardinality == 'target':
+        # scikit-learn 1.3 لا يدعم multiclass؛ فئات الجرعة مرتبة فمتوسطها هدف مستمر ذو معنى
+        transformers.append(('target', TargetEncoder(target_type='continuous', random_state=42), wide))
+    elif wide:
+        raise ValueError(f"Unknown high_cardinality strategy: {high_cardinality}")
+    return with_engineered_features(ColumnTransformer(transformers=transformers, sparse_threshold=1.0))
+
+
+def matrix_bytes(X):
+    if sp.issparse(X):
+        return X.data.nbytes + X.indices.nbytes + X.indptr.nbytes
+    return np.asarray(X).nbytes
+
+
+def with_vocabulary(df, n_drugs, seed=0):
+    """نسخة من البيانات الاصطناعية بـ n_drugs اسم دواء و n_drugs/10 تشخيص (توزيع Zipf مثل الوصفات الحقيقية)"""
+    rng = np.random.default_rng(seed)
+    df = df.copy()
+    for column, n in (('drug', n_drugs), ('diagnosis', max(16, n_drugs // 10))):
+        weights = 1.0 / np.arange(1, n + 1)
+        codes = rng.choice(n, size=len(df), p=weights / weights.sum())
+        df[column] = pd.Categorical.from_codes(codes, categories=[f"{column}_{i}" for i in range(n)])
+    return df
+
+
+def _dense_preprocessor():
+    from training_orchestrator import build_preprocessor
+    return build_preprocessor()
+
+
+def benchmark(categories=(1000, 5000, 20000), rows=20000, dense_limit_mb=1500, n_estimators=50, seed=42):
+    """ذاكرة وزمن المعالجة + SMOTE + تدريب غابة عشوائية لكل طريقة ترميز وعدد فئات"""
+    from imblearn.over_sampling import SMOTE
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.model_selection import train_test_split
+    from synthetic_data import generate_dataset
+
+    base = generate_dataset(rows, seed=seed)
+    results = []
+    for n_drugs in categories:
+        df = with_vocabulary(base, n_drugs, seed)
+        X_train, X_test, y_train, y_test = train_test_split(
+            df[NUMERIC_FEATURES + CATEGORICAL_FEATURES], df['dosage_class'], test_size=0.25,
+            random_state=seed, stratify=df['dosage_class'])
+        n_onehot = sum(X_train[c].nunique() for c in CATEGORICAL_FEATURES) + len(NUMERIC_FEATURES)
+        modes = [
+            ('dense onehot', _dense_preprocessor),
+            ('sparse onehot', lambda: build_sparse_preprocessor(X_train, high_cardinality='onehot')),
+            ('sparse + hash', lambda: build_sparse_preprocessor(X_train, high_cardinality='hash', max_categories=100)),
+            ('sparse + target', lambda: build_sparse_preprocessor(X_train, high_cardinality='target', max_categories=100)),
+        ]
+        for mode, make in modes:
+            row = {'categories': n_drugs, 'mode': mode}
+            if mode == 'dense onehot' and len(X_train) * n_onehot * 8 / 1e6 > dense_limit_mb:
+                row['skipped'] = f"dense matrix would be {len(X_train) * n_onehot * 8 / 1e6:,.0f} MB"
+                results.append(row)
+                continue
+            tracemalloc.start()
+            start = time.perf_counter()
+            preprocessor = make()
+            X_prep = preprocessor.fit_transform(X_train, y_train)
+            row['preprocess_s'] = time.perf_counter() - start
+            row['matrix_mb'] = matrix_bytes(X_prep) / 1e6
+            row['columns'] = X_prep.shape[1]
+
+            start = time.perf_counter()
+            X_res, y_res = SMOTE(random_state=seed).fit_resample(X_prep, y_train)
+            row['smote_s'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            model = RandomForestClassifier(n_estimators=n_estimators, max_depth=30, random_state=seed, n_jobs=-1)
+            model.fit(X_res, y_res)
+            row['fit_s'] = time.perf_counter() - start
+            row['peak_mb'] = tracemalloc.get_traced_memory()[1] / 1e6
+            tracemalloc.stop()
+            row['accuracy'] = float(np.mean(model.predict(preprocessor.transform(X_test)) == y_test.to_numpy()))
+            results.append(row)
+    return results
+
+
+def format_results(results):
+    lines = [f"{'categories':>10} {'mode':<16}{'columns':>8}{'matrix_MB':>10}{'peak_MB':>9}"
+             f"{'prep_s':>8}{'smote_s':>8}{'fit_s':>8}{'acc':>7}"]
+    for r in results:
+        if 'skipped' in r:
+            lines.append(f"{r['categories']:>10} {r['mode']:<16}  skipped: {r['skipped']}")
+            continue
+        lines.append(f"{r['categories']:>10} {r['mode']:<16}{r['columns']:>8}{r['matrix_mb']:>10.1f}{r['peak_mb']:>9.0f}"
+                     f"{r['preprocess_s']:>8.2f}{r['smote_s']:>8.2f}{r['fit_s']:>8.2f}{r['accuracy']:>7.3f}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dense vs sparse/hashed/target-encoded preprocessing")
+    parser.add_argument('--categories', type=int, nargs='*', default=[1000, 5000, 20000])
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--dense-limit-mb', type=float, default=1500)
+    parser.add_argument('--n-estimators', type=int, default=50)
+    args = parser.parse_args()
+    results = benchmark(args.categories, args.rows, args.dense_limit_mb, args.n_estimators)
+    print(format_results(results))
+
+
+if __name__ == "__main__":
+    main()
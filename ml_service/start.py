@@ -1,4 +1,3 @@
-import os
 import subprocess
 import sys
 import time
@@ -26,11 +25,13 @@ run_command("pip install -r requirements.txt")
 print("\nTraining advanced model with high accuracy...")
 run_command("python advanced_model.py")
 
-# التحقق من وجود ملفات النموذج
-model_exists = os.path.exists("D:\untitled6\ml_service\dosage_model.pkl")
-encoders_exist = os.path.exists("D:\untitled6\ml_service\encoders.pkl")
+# التحقق من وجود ملفات النموذج (الحزمة أو ملفا pickle بجانب الكود)
+# الاستيراد هنا لأن model_bundle يحتاج joblib/numpy المثبتة أعلاه
+from model_bundle import resolve_model_paths, model_files_exist
 
-if not model_exists or not encoders_exist:
+model_path, encoders_path = resolve_model_paths()
+
+if not model_files_exist(model_path, encoders_path):
     print("\n❌ فشل في إنشاء ملفات النموذج!")
     sys.exit(1)
 
@@ -40,4 +41,4 @@ print("\n⚡ بدء تشغيل الخادم على http://localhost:8000")
 print("اضغط على Ctrl+C للخروج من الخادم.")
 
 # تشغيل الخادم
-run_command("python -m uvicorn api:app --host 0.0.0.0 --port 8000") 
\ No newline at end of file
+run_command("python serve.py --host 0.0.0.0 --port 8000") 
\ No newline at end of file
@@ -3,6 +3,8 @@ import subprocess
 import sys
 import time
 
+from model_bundle import resolve_model_paths, model_files_exist
+
 print("""
 ╔════════════════════════════════════════╗
 ║   MedLink Advanced Dosage API Server   ║
@@ -11,17 +13,13 @@ print("""
 print("Starting API server...")
 print("Checking model files...")
 
-# استخدم raw strings لتجنب أخطاء unicode
-model_path = r"D:\untitled6\ml_service\dosage_model.pkl"
-encoders_path = r"D:\untitled6\ml_service\encoders.pkl"
-
-model_exists = os.path.exists(model_path)
-encoders_exist = os.path.exists(encoders_path)
+# dosage_model.bundle أو dosage_model.pkl + encoders.pkl بجانب الكود (أو MEDLINK_MODEL_PATH)
+model_path, encoders_path = resolve_model_paths()
+files_exist = model_files_exist(model_path, encoders_path)
 
-print(f"✓ Model file exists: {model_exists}")
-print(f"✓ Encoders file exists: {encoders_exist}")
+print(f"✓ Model: {model_path} (exists: {files_exist})")
 
-if not model_exists or not encoders_exist:
+if not files_exist:
     print("\n⚠️ WARNING: Model or encoders not found!")
     print("You need to train the model first using:")
     print("    python advanced_model.py")
@@ -33,11 +31,10 @@ if not model_exists or not encoders_exist:
         try:
             os.system("python advanced_model.py")
 
-            # Check again if files were created
-            model_exists = os.path.exists(model_path)
-            encoders_exist = os.path.exists(encoders_path)
+            # Check again if files were created (training now writes a bundle)
+            model_path, encoders_path = resolve_model_paths()
 
-            if not model_exists or not encoders_exist:
+            if not model_files_exist(model_path, encoders_path):
                 print("\n❌ Training failed to create model files!")
                 sys.exit(1)
             else:
@@ -53,6 +50,7 @@ print("\n✓ All required files found!")
 print("\n⚡ Starting server on http://localhost:8000")
 print("Press Ctrl+C to stop the server.")
 
-# Run the API server
-os.system("python ml_service/api.py")
+# Run the API server (pre-fork launcher: model loaded once, one worker per core)
+launcher = os.path.join(os.path.dirname(os.path.abspath(__file__)), "serve.py")
+os.system(f'"{sys.executable}" "{launcher}"')
 
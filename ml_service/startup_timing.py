@@ -0,0 +1,77 @@
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# قياس زمن الإقلاع لكل مرحلة (الاستيراد، فك التخزين، التسخين) حتى يعرف
+# المُوسِّع التلقائي متى تصبح النسخة الجديدة جاهزة لاستقبال الطلبات
+
+
+def process_uptime():
+    """الثواني منذ بدء العملية (تشمل تهيئة المفسّر)؛ None خارج لينكس"""
+    try:
+        with open('/proc/self/stat') as f:
+            # الحقل الثاني (اسم الأمر) قد يحتوي مسافات
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime') as f:
+            system_uptime = float(f.read().split()[0])
+        return system_uptime - int(fields[19]) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class StartupTimer:
+    """مراحل الإقلاع بالترتيب مع حالة الجاهزية"""
+
+    def __init__(self, started=None):
+        # started: perf_counter عند أول سطر في الوحدة، حتى يشمل ready_seconds زمن الاستيرادات
+        self.started = time.perf_counter() if started is None else started
+        self.interpreter_seconds = process_uptime()
+        self.phases = OrderedDict()
+        self.state = "starting"
+        self.error = None
+        self.ready_seconds = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.phases[name] = seconds
+
+    def mark_ready(self):
+        with self._lock:
+            self.state = "ready"
+            self.error = None
+            self.ready_seconds = time.perf_counter() - self.started
+
+    def mark_failed(self, error):
+        with self._lock:
+            self.state = "failed"
+            self.error = str(error)
+
+    @property
+    def ready(self):
+        return self.state == "ready"
+
+    def report(self):
+        with self._lock:
+            report = {
+                "state": self.state,
+                "phases_ms": {name: round(seconds * 1000, 2) for name, seconds in self.phases.items()},
+                "ready_seconds": self.ready_seconds,
+                # زمن المفسّر قبل أول سطر في api.py (غير متاح خارج لينكس)
+                "interpreter_seconds": self.interpreter_seconds,
+                "modules_loaded": len(sys.modules),
+            }
+            if self.error is not None:
+                report["error"] = self.error
+            return report
@@ -0,0 +1,324 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+# مولّد البيانات الاصطناعية للتدريب بعمليات مصفوفات بدلاً من حلقات Python و df.apply
+# يُولَّد على دفعات (chunks) لكل منها مولد أرقام عشوائية مستقل مشتق من (seed, رقم الدفعة)،
+# فتكون النتيجة متطابقة بت ببت لنفس seed و chunk_size مهما كان عدد العمليات
+
+# قائمة الأدوية مع تركيزاتها النموذجية
+DRUGS_WITH_TYPICAL_DOSES = {
+    'Aspirin': {'min': 75, 'max': 1000, 'unit': 'mg', 'age_factor': True},
+    'Ibuprofen': {'min': 200, 'max': 800, 'unit': 'mg', 'age_factor': True},
+    'Paracetamol': {'min': 500, 'max': 1000, 'unit': 'mg', 'age_factor': True},
+    'Amoxicillin': {'min': 250, 'max': 1000, 'unit': 'mg', 'age_factor': True},
+    'Omeprazole': {'min': 10, 'max': 40, 'unit': 'mg', 'age_factor': False},
+    'Atorvastatin': {'min': 10, 'max': 80, 'unit': 'mg', 'age_factor': True},
+    'Simvastatin': {'min': 5, 'max': 40, 'unit': 'mg', 'age_factor': True},
+    'Metformin': {'min': 500, 'max': 2000, 'unit': 'mg', 'age_factor': False},
+    'Lisinopril': {'min': 5, 'max': 40, 'unit': 'mg', 'age_factor': True},
+    'Amlodipine': {'min': 2.5, 'max': 10, 'unit': 'mg', 'age_factor': True},
+    'Warfarin': {'min': 1, 'max': 10, 'unit': 'mg', 'age_factor': True},
+    'Levothyroxine': {'min': 25, 'max': 200, 'unit': 'mcg', 'age_factor': True},
+    'Sertraline': {'min': 25, 'max': 200, 'unit': 'mg', 'age_factor': True},
+    'Fluoxetine': {'min': 10, 'max': 60, 'unit': 'mg', 'age_factor': True},
+    'Diazepam': {'min': 2, 'max': 10, 'unit': 'mg', 'age_factor': True},
+    'Tramadol': {'min': 50, 'max': 400, 'unit': 'mg', 'age_factor': True},
+    'Morphine': {'min': 5, 'max': 30, 'unit': 'mg', 'age_factor': True},
+    'Losartan': {'min': 25, 'max': 100, 'unit': 'mg', 'age_factor': False},
+    'Citalopram': {'min': 10, 'max': 40, 'unit': 'mg', 'age_factor': True},
+    'Gabapentin': {'min': 300, 'max': 3600, 'unit': 'mg', 'age_factor': False}
+}
+
+# قوائم خيارات البيانات
+DRUGS = list(DRUGS_WITH_TYPICAL_DOSES.keys())
+ROUTES = ['Oral', 'IV', 'Topical', 'Nasal', 'Rectal', 'Subcutaneous', 'Intramuscular']
+ROUTES_RISK = {'Oral': 1, 'Topical': 0, 'Nasal': 1, 'Rectal': 1, 'IV': 3, 'Intramuscular': 2, 'Subcutaneous': 2}
+GENDERS = ['M', 'F']
+ADMISSION_TYPES = ['EMERGENCY', 'ELECTIVE', 'URGENT', 'NEWBORN', 'OTHER']
+DIAGNOSES = ['Hypertension', 'Diabetes', 'Pneumonia', 'Asthma', 'COPD', 'Heart Failure',
+             'Stroke', 'Cancer', 'Arthritis', 'Depression', 'Anxiety', 'Infection',
+             'Fracture', 'Renal Failure', 'Liver Disease', 'Thyroid Disorder']
+
+# تصنيف خطورة التشخيصات
+DIAGNOSIS_SEVERITY = {
+    'Hypertension': 2, 'Diabetes': 2, 'Pneumonia': 3, 'Asthma': 2,
+    'COPD': 3, 'Heart Failure': 4, 'Stroke': 4, 'Cancer': 4,
+    'Arthritis': 1, 'Depression': 1, 'Anxiety': 1, 'Infection': 2,
+    'Fracture': 2, 'Renal Failure': 4, 'Liver Disease': 4, 'Thyroid Disorder': 2
+}
+
+# حدود فئات العمر والوزن (نفس pd.cut في advanced_model.py: فترات مغلقة من اليمين)
+AGE_BINS = np.array([0, 2, 12, 18, 65, 80, 100], dtype=np.float64)
+WEIGHT_BINS = np.array([0, 20, 40, 70, 100, 150, 200], dtype=np.float64)
+
+DEFAULT_CHUNK_SIZE = 1_000_000
+
+# جداول بحث بترتيب الرموز لتحويل رمز الدواء/الطريقة/التشخيص إلى قيمه دفعة واحدة
+_DRUG_MIN = np.array([DRUGS_WITH_TYPICAL_DOSES[d]['min'] for d in DRUGS], dtype=np.float64)
+_DRUG_MAX = np.array([DRUGS_WITH_TYPICAL_DOSES[d]['max'] for d in DRUGS], dtype=np.float64)
+_DRUG_AGE_FACTOR = np.array([DRUGS_WITH_TYPICAL_DOSES[d]['age_factor'] for d in DRUGS], dtype=bool)
+_DRUG_UNITS = sorted({info['unit'] for info in DRUGS_WITH_TYPICAL_DOSES.values()})
+_DRUG_UNIT_CODE = np.array([_DRUG_UNITS.index(DRUGS_WITH_TYPICAL_DOSES[d]['unit']) for d in DRUGS], dtype=np.int8)
+_ROUTE_RISK = np.array([ROUTES_RISK[r] for r in ROUTES], dtype=np.int64)
+_DIAGNOSIS_RISK = np.array([DIAGNOSIS_SEVERITY[d] for d in DIAGNOSES], dtype=np.int64)
+_EMERGENCY = ADMISSION_TYPES.index('EMERGENCY')
+
+
+def chunk_rng(seed, chunk_index):
+    """مولد مستقل لكل دفعة؛ لا يعتمد على ترتيب التنفيذ أو عدد العمليات"""
+    return np.random.default_rng(np.random.SeedSequence([seed, chunk_index]))
+
+
+def bin_codes(values, bins):
+    """رمز الفئة مثل pd.cut(values, bins, labels=range(n)) و -1 خارج الحدود"""
+    codes = np.searchsorted(bins, values, side='left') - 1
+    codes[(codes < 0) | (codes >= len(bins) - 1)] = -1
+    return codes.astype(np.int8)
+
+
+def classify_dosage(dose_percentage, age, is_emergency, route_risk, diagnosis_risk,
+                    risk_interaction, age_sensitive):
+    """قواعد تصنيف الجرعة على مصفوفات كاملة (نفس منطق classify_dosage_row)"""
+    # تصنيف أساسي حسب النسبة المئوية: <=25، <=50، <=75، أكثر
+    base_class = np.searchsorted(np.array([25.0, 50.0, 75.0]), dose_percentage, side='left')
+    above_low = base_class > 0
+
+    # زيادة خطورة للأطفال وكبار السن في الأدوية المتأثرة بالعمر
+    age_factor = age_sensitive & above_low & ((age < 12) | (age > 70))
+    # الحالات الطارئة تخفض الفئة ما لم تكن مرتفعة أصلاً
+    emergency_factor = is_emergency & (base_class < 3)
+    # خطورة طريقة الإعطاء والتشخيص والتفاعل بينهما
+    risk_factor = ((route_risk >= 3) & above_low).astype(np.int64) \
+        + ((diagnosis_risk >= 3) & above_low) \
+        + (risk_interaction > 9)
+
+    final_class = base_class + age_factor - emergency_factor + risk_factor
+    return np.clip(final_class, 0, 3).astype(np.int64)
+
+
+def classify_dosage_row(row):
+    """النسخة الأصلية لكل صف - مرجع للتحقق من تطابق النسخة المتجهة"""
+    percentage = row['dose_percentage']
+    age = row['age']
+    is_emergency = row['admission_type'] == 'EMERGENCY'
+    route_risk = row['route_risk']
+    diagnosis_risk = row['diagnosis_risk']
+    risk_interaction = row['risk_interaction']
+    age_sensitive = DRUGS_WITH_TYPICAL_DOSES[row['drug']]['age_factor']
+
+    if percentage <= 25:
+        base_class = 0
+    elif percentage <= 50:
+        base_class = 1
+    elif percentage <= 75:
+        base_class = 2
+    else:
+        base_class = 3
+
+    age_factor = 0
+    if age_sensitive:
+        if age < 12 and base_class > 0:
+            age_factor = 1
+        elif age > 70 and base_class > 0:
+            age_factor = 1
+
+    emergency_factor = -1 if is_emergency and base_class < 3 else 0
+
+    risk_factor = 0
+    if route_risk >= 3 and base_class > 0:
+        risk_factor += 1
+    if diagnosis_risk >= 3 and base_class > 0:
+        risk_factor += 1
+    if risk_interaction > 9:
+        risk_factor += 1
+
+    return int(max(0, min(3, base_class + age_factor + emergency_factor + risk_factor)))
+
+
+def generate_chunk(n, seed=42, chunk_index=0):
+    """دفعة واحدة كقاموس مصفوفات؛ الأعمدة التصنيفية رموز صحيحة (فهارس في القوائم أعلاه)"""
+    rng = chunk_rng(seed, chunk_index)
+
+    weights = rng.normal(70, 15, n)  # Mean 70kg, SD 15kg
+    drug = rng.integers(len(DRUGS), size=n).astype(np.int8)
+
+    # أعمار واقعية: 15% أطفال، 60% بالغين، 25% مسنين (بنسب ثابتة في كل دفعة)
+    n_children = int(n * 0.15)
+    n_adults = int(n * 0.6)
+    ages = np.concatenate([
+        rng.uniform(1, 18, n_children),
+        rng.uniform(18, 65, n_adults),
+        rng.uniform(65, 90, n - n_children - n_adults)
+    ])
+    ages = ages[rng.permutation(n)]
+
+    # الجرعة الأساسية ضمن نطاق الدواء ثم تعديلها حسب الوزن والعمر
+    base_dose = rng.uniform(_DRUG_MIN[drug], _DRUG_MAX[drug])
+    weight_factor = weights / 70
+    age_sensitive = _DRUG_AGE_FACTOR[drug]
+    age_adjustment = np.ones(n)
+    children = age_sensitive & (ages < 18)
+    elderly = age_sensitive & (ages > 65)
+    age_adjustment[children] = ages[children] / 18 * 0.7 + 0.3
+    age_adjustment[elderly] = 1 - ((ages[elderly] - 65) / 25) * 0.3
+    doses = base_dose * weight_factor * age_adjustment
+
+    route = rng.integers(len(ROUTES), size=n).astype(np.int8)
+    gender = rng.integers(len(GENDERS), size=n).astype(np.int8)
+    admission = rng.integers(len(ADMISSION_TYPES), size=n).astype(np.int8)
+    diagnosis = rng.integers(len(DIAGNOSES), size=n).astype(np.int8)
+
+    # الحالات الطارئة: زيادة الجرعة بعامل عشوائي بين 1.0 و 1.5
+    is_emergency = admission == _EMERGENCY
+    emergency_factor = rng.uniform(1.0, 1.5, n)
+    doses = np.where(is_emergency, doses * emergency_factor, doses)
+    # الأطفال: تخفيض إضافي متناسب مع العمر
+    doses = np.where(ages < 18, doses * (ages / 18), doses)
+
+    route_risk = _ROUTE_RISK[route]
+    diagnosis_risk = _DIAGNOSIS_RISK[diagnosis]
+    risk_interaction = route_risk * diagnosis_risk
+    max_dose = _DRUG_MAX[drug]
+    dose_percentage = doses / max_dose * 100
+
+    return {
+        'age': ages,
+        'weight': weights,
+        'drug': drug,
+        'dose_val_rx': doses,
+        'dose_unit_rx': _DRUG_UNIT_CODE[drug],
+        'route': route,
+        'gender': gender,
+        'admission_type': admission,
+        'diagnosis': diagnosis,
+        'route_risk': route_risk,
+        'diagnosis_risk': diagnosis_risk,
+        # تقريب بسيط للطول بناءً على العمر
+        'bmi': weights / ((ages / 100) ** 2),
+        'risk_interaction': risk_interaction,
+        'age_group': bin_codes(ages, AGE_BINS),
+        'weight_group': bin_codes(weights, WEIGHT_BINS),
+        'max_dose': max_dose,
+        'dose_percentage': dose_percentage,
+        'dosage_class': classify_dosage(dose_percentage, ages, is_emergency, route_risk,
+                                        diagnosis_risk, risk_interaction, age_sensitive),
+    }
+
+
+# الأعمدة المخزنة كرموز وقوائم قيمها
+CATEGORIES = {
+    'drug': DRUGS,
+    'dose_unit_rx': _DRUG_UNITS,
+    'route': ROUTES,
+    'gender': GENDERS,
+    'admission_type': ADMISSION_TYPES,
+    'diagnosis': DIAGNOSES,
+    'age_group': list(range(len(AGE_BINS) - 1)),
+    'weight_group': list(range(len(WEIGHT_BINS) - 1)),
+}
+
+
+def chunk_to_frame(chunk):
+    """DataFrame بأعمدة category للقيم النصية (ذاكرة أقل بكثير من object)"""
+    columns = {}
+    for name, values in chunk.items():
+        if name in CATEGORIES:
+            columns[name] = pd.Categorical.from_codes(values, categories=CATEGORIES[name])
+        else:
+            columns[name] = values
+    return pd.DataFrame(columns)
+
+
+def chunk_bounds(n_rows, chunk_size):
+    return [(i, start, min(chunk_size, n_rows - start))
+            for i, start in enumerate(range(0, n_rows, chunk_size))]
+
+
+def generate_dataset(n_rows, seed=42, chunk_size=DEFAULT_CHUNK_SIZE):
+    """كل الصفوف في DataFrame واحد"""
+    frames = [chunk_to_frame(generate_chunk(n, seed, i)) for i, _, n in chunk_bounds(n_rows, chunk_size)]
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+
+def _write_chunk(task):
+    output_dir, seed, index, n = task
+    chunk = generate_chunk(n, seed, index)
+    path = os.path.join(output_dir, f'chunk-{index:05d}.npz')
+    np.savez(path, **chunk)
+    return index, n
+
+
+def write_dataset(output_dir, n_rows, seed=42, chunk_size=DEFAULT_CHUNK_SIZE, workers=1):
+    """توليد الدفعات وكتابتها إلى القرص (ملف .npz لكل دفعة) دون تجميعها في الذاكرة"""
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = [(output_dir, seed, index, n) for index, _, n in chunk_bounds(n_rows, chunk_size)]
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(_write_chunk, tasks))
+    else:
+        for task in tasks:
+            _write_chunk(task)
+    meta = {'n_rows': n_rows, 'seed': seed, 'chunk_size': chunk_size,
+            'chunks': len(tasks), 'categories': CATEGORIES}
+    with open(os.path.join(output_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return meta
+
+
+def read_dataset(output_dir, columns=None):
+    """قراءة الدفعات المكتوبة بـ write_dataset بالترتيب"""
+    with open(os.path.join(output_dir, 'meta.json'), encoding='utf-8') as f:
+        meta = json.load(f)
+    frames = []
+    for index in range(meta['chunks']):
+        with np.load(os.path.join(output_dir, f'chunk-{index:05d}.npz')) as data:
+            chunk = {name: data[name] for name in (columns or data.files)}
+        frames.append(chunk_to_frame(chunk))
+    return pd.concat(frames, ignore_index=True)
+
+
+def check_rules(n_rows=200000, seed=0):
+    """مقارنة القواعد والفئات المتجهة مع النسخة الأصلية (df.apply و pd.cut)؛ يعيد عدد الاختلافات"""
+    frame = chunk_to_frame(generate_chunk(n_rows, seed))
+    frame = frame.astype({'drug': str, 'admission_type': str})
+    mismatches = int(np.sum(frame.apply(classify_dosage_row, axis=1).to_numpy() != frame['dosage_class'].to_numpy()))
+    for column, source, bins in (('age_group', 'age', AGE_BINS), ('weight_group', 'weight', WEIGHT_BINS)):
+        expected = pd.cut(frame[source], bins=bins, labels=CATEGORIES[column])
+        mismatches += int((expected.cat.codes.to_numpy() != frame[column].cat.codes.to_numpy()).sum())
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the synthetic dosage training set")
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--output', help="directory for chunk-*.npz files (default: generate in memory only)")
+    parser.add_argument('--check', type=int, default=0, metavar='N',
+                        help="compare the vectorized rules with the row-wise version on N rows")
+    args = parser.parse_args()
+
+    if args.check:
+        mismatches = check_rules(args.check)
+        print(f"Rules checked on {args.check} rows: {mismatches} mismatches")
+        raise SystemExit(1 if mismatches else 0)
+
+    start = time.perf_counter()
+    if args.output:
+        write_dataset(args.output, args.rows, args.seed, args.chunk_size, args.workers)
+    else:
+        for index, _, n in chunk_bounds(args.rows, args.chunk_size):
+            generate_chunk(n, args.seed, index)
+    elapsed = time.perf_counter() - start
+    print(f"Generated {args.rows} rows in {elapsed:.2f}s ({args.rows / elapsed:,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# وحدات ml_service مسطحة وتُستورد بأسمائها (كما عند تشغيلها من هذا المجلد)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
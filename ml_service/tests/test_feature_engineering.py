@@ -0,0 +1,113 @@
+import importlib
+import os
+
+import numpy as np
+import pytest
+from sklearn.ensemble import GradientBoostingClassifier
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import LabelEncoder
+
+from feature_engineering import (BASE_FEATURES, DERIVED_FEATURES, DosageFeatures, check_consistency,
+                                 reference_features)
+from synthetic_data import DRUGS_WITH_TYPICAL_DOSES, generate_dataset
+from training_orchestrator import build_preprocessor
+
+CATEGORICAL = ['drug', 'route', 'gender', 'admission_type', 'diagnosis']
+
+
+@pytest.fixture(scope="module")
+def frame():
+    # أعمدة object كما في DataFrame التدريب المبني من CSV
+    frame = generate_dataset(20000, seed=11)
+    return frame.astype({column: object for column in CATEGORICAL})
+
+
+def _assert_columns_equal(expected, actual):
+    for column in DERIVED_FEATURES:
+        np.testing.assert_array_equal(np.asarray(expected[column], dtype=np.float64),
+                                      np.asarray(actual[column], dtype=np.float64), err_msg=column)
+
+
+def test_matches_original_pandas_formulation(frame):
+    features = DosageFeatures().fit(frame[BASE_FEATURES])
+    _assert_columns_equal(reference_features(frame), features.transform(frame[BASE_FEATURES]))
+
+
+def test_matches_training_data_generator(frame):
+    transformed = DosageFeatures().fit(frame[BASE_FEATURES]).transform(frame[BASE_FEATURES])
+    generated = frame[DERIVED_FEATURES].copy()
+    for column in ('age_group', 'weight_group'):
+        generated[column] = frame[column].cat.codes
+    _assert_columns_equal(generated, transformed)
+
+
+def test_single_row_matches_same_row_in_large_batch(frame):
+    features = DosageFeatures().fit(frame[BASE_FEATURES])
+    batch = features.transform(frame[BASE_FEATURES])
+    for i in [0, 1, 17, 999, len(frame) - 1]:
+        single = features.transform(frame[BASE_FEATURES].iloc[[i]])
+        row = frame[BASE_FEATURES].iloc[i].to_dict()
+        derived = features.derive_row(row)
+        for column in DERIVED_FEATURES:
+            assert single[column].iloc[0] == batch[column].iloc[i], column
+            assert derived[column] == batch[column].iloc[i], column
+
+
+def test_edge_rows_agree_on_every_path():
+    report = check_consistency(n_rows=5000)
+    assert all(count == 0 for counts in report.values() for count in counts.values()), report
+
+
+@pytest.fixture(scope="module")
+def served(tmp_path_factory, frame):
+    """نموذج صغير محفوظ كحزمة ومحمّل عبر api.py كما في الخدمة"""
+    from model_bundle import save_bundle
+
+    X, y = frame[BASE_FEATURES].iloc[:4000], frame['dosage_class'].to_numpy()[:4000]
+    pipeline = Pipeline([
+        ('preprocessor', build_preprocessor()),
+        ('classifier', GradientBoostingClassifier(n_estimators=15, max_depth=3, random_state=0)),
+    ]).fit(X, y)
+    encoders = {name: LabelEncoder().fit(frame[column].astype(str))
+                for name, column in [('drug', 'drug'), ('route', 'route'), ('gender', 'gender'),
+                                     ('admission', 'admission_type'), ('diagnosis', 'diagnosis')]}
+    encoders['drug_info'] = DRUGS_WITH_TYPICAL_DOSES
+    bundle = str(tmp_path_factory.mktemp("model") / "dosage_model.bundle")
+    save_bundle(bundle, pipeline, encoders, training_data={'source': 'tests', 'rows': len(X)})
+
+    settings = {"MEDLINK_MODEL_PATH": bundle, "MEDLINK_MICROBATCH_MAX": "0", "MEDLINK_SHADOW_RULES": "0"}
+    previous = {key: os.environ.get(key) for key in settings}
+    os.environ.update(settings)
+    try:
+        import api
+        api = importlib.reload(api)
+    finally:
+        for key, value in previous.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+    return api, pipeline
+
+
+def test_saved_pipeline_matches_training_frame_through_request_path(served, frame):
+    api, pipeline = served
+    runtime = api.registry.current()
+    assert runtime is not None
+    rows = frame[BASE_FEATURES].iloc[4000:4200]
+    expected_features = DosageFeatures().fit(rows).transform(rows)
+    # النموذج المحفوظ على DataFrame التدريب كما هو
+    expected_proba = runtime.model.predict_proba(rows)
+
+    for i, (_, row) in enumerate(rows.iterrows()):
+        data = api.PatientData(**{column: row[column] for column in BASE_FEATURES})
+        feature_dict, codes, _, _ = api.prepare_patient(data, runtime)
+        # الميزات المشتقة من مسار الطلب = ميزات DataFrame التدريب
+        derived = runtime.featurizer.features.derive_row(feature_dict)
+        for column in DERIVED_FEATURES:
+            assert derived[column] == expected_features[column].iloc[i], column
+        predictions, confidences = runtime.predict_rows([feature_dict], [codes])
+        assert predictions[0] == runtime.featurizer.classes_[expected_proba[i].argmax()]
+        assert confidences[0] == expected_proba[i].max()
+    # والنموذج المحفوظ يطابق Pipeline المدرب في الفئات
+    assert np.array_equal(expected_proba.argmax(axis=1), pipeline.predict_proba(rows).argmax(axis=1))
@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import GradientBoostingClassifier
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+from feature_engineering import BASE_FEATURES
+from featurizer import CompiledFeaturizer, compile_pipeline
+from synthetic_data import generate_dataset
+from training_orchestrator import build_preprocessor
+
+
+def _classifier():
+    return GradientBoostingClassifier(n_estimators=15, max_depth=3, random_state=0)
+
+
+@pytest.fixture(scope="module")
+def training_frame():
+    frame = generate_dataset(3000, seed=7)
+    return frame[BASE_FEATURES].astype({c: object for c in BASE_FEATURES if c not in ('age', 'weight')}), \
+        frame['dosage_class'].to_numpy()
+
+
+@pytest.fixture(scope="module", params=["engineered", "plain_sparse"])
+def pipeline(request, training_frame):
+    X, y = training_frame
+    if request.param == "engineered":
+        preprocessor = build_preprocessor()
+    else:
+        # مثل النموذج المشحون: ColumnTransformer مباشرة ومخرجات one-hot متفرقة
+        preprocessor = ColumnTransformer(transformers=[
+            ('num', Pipeline(steps=[('scaler', StandardScaler())]), ['age', 'weight']),
+            ('cat', Pipeline(steps=[('onehot', OneHotEncoder(handle_unknown='ignore'))]),
+             ['drug', 'route', 'gender', 'admission_type', 'diagnosis']),
+        ])
+    return Pipeline([('preprocessor', preprocessor), ('classifier', _classifier())]).fit(X, y)
+
+
+def _rows(featurizer, training_frame):
+    # صفوف حقيقية + صفوف اصطناعية تشمل قيماً تصنيفية غير معروفة
+    X, _ = training_frame
+    rows = X.iloc[:200].to_dict('records') + featurizer.sample_rows(100, seed=3)
+    rows.append(dict(rows[0], drug="Unknown drug", route="Unknown route", diagnosis="Not specified"))
+    return rows
+
+
+def _expected(pipeline, featurizer, rows):
+    frame = pd.DataFrame(rows, columns=featurizer.input_columns)
+    X = pipeline.steps[0][1].transform(frame)
+    X = X.toarray() if hasattr(X, 'toarray') else np.asarray(X)
+    return X, pipeline.predict_proba(frame)
+
+
+def test_batch_path_is_bit_identical(pipeline, training_frame):
+    featurizer = CompiledFeaturizer(pipeline)
+    rows = _rows(featurizer, training_frame)
+    expected_X, expected_proba = _expected(pipeline, featurizer, rows)
+
+    compiled_X = featurizer.transform(rows)
+    assert np.array_equal(compiled_X, expected_X)
+    assert np.array_equal(featurizer.scorer.predict_proba(compiled_X), expected_proba)
+    assert np.array_equal(featurizer.predict_proba(rows), expected_proba)
+
+
+def test_single_row_path_is_bit_identical(pipeline, training_frame):
+    featurizer = CompiledFeaturizer(pipeline)
+    rows = _rows(featurizer, training_frame)
+    expected_X, expected_proba = _expected(pipeline, featurizer, rows)
+
+    for i, row in enumerate(rows):
+        assert np.array_equal(featurizer.transform_one(row)[0], expected_X[i])
+        assert np.array_equal(featurizer.predict_proba([row])[0], expected_proba[i])
+
+
+def test_column_path_is_bit_identical(pipeline, training_frame):
+    featurizer = CompiledFeaturizer(pipeline)
+    rows = _rows(featurizer, training_frame)
+    expected_X, _ = _expected(pipeline, featurizer, rows)
+    columns = {column: np.array([row[column] for row in rows], dtype=object)
+               for column in featurizer.input_columns}
+    assert np.array_equal(featurizer.transform_columns(columns), expected_X)
+
+
+def test_unknown_category_is_ignored(pipeline, training_frame):
+    featurizer = CompiledFeaturizer(pipeline)
+    row = dict(training_frame[0].iloc[0].to_dict(), drug="Unknown drug")
+    known = dict(row, drug=training_frame[0].iloc[0]['drug'])
+    # المجهول = كل أعمدة الدواء أصفار، فيختلف عن الصف المعروف في عمود الدواء المعروف فقط
+    # (transform_one يعيد مصفوفة مشتركة لكل thread فتُنسخ قبل الاستدعاء التالي)
+    unknown_X = featurizer.transform_one(row).copy()
+    known_X = featurizer.transform_one(known)
+    assert np.flatnonzero(unknown_X[0] != known_X[0]).size == 1
+    assert np.array_equal(featurizer.transform([row, row])[0], unknown_X[0])
+
+
+def test_unknown_category_raises_when_encoder_does(training_frame):
+    X, y = training_frame
+    preprocessor = ColumnTransformer(transformers=[
+        ('num', StandardScaler(), ['age', 'weight']),
+        ('cat', OneHotEncoder(handle_unknown='error', sparse_output=False), ['drug', 'route']),
+    ])
+    pipeline = Pipeline([('preprocessor', preprocessor), ('classifier', _classifier())]).fit(X, y)
+    featurizer = CompiledFeaturizer(pipeline)
+    row = dict(X.iloc[0].to_dict(), drug="Unknown drug")
+    with pytest.raises(ValueError):
+        featurizer.transform_one(row)
+    with pytest.raises(ValueError):
+        featurizer.transform([row, X.iloc[1].to_dict()])
+
+
+def test_compile_pipeline_verifies_at_load(pipeline):
+    assert compile_pipeline(pipeline, verify_rows=64) is not None
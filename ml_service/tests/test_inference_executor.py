@@ -0,0 +1,65 @@
+import asyncio
+import threading
+
+from inference_executor import Admission, InferenceExecutor
+from micro_batcher import MicroBatcher
+
+
+async def _wait_until(condition, timeout=2.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline
+        await asyncio.sleep(0.005)
+
+
+def test_cancelled_queued_call_releases_its_slot():
+    executor = InferenceExecutor(max_workers=1, max_queue=4, deadline_ms=0)
+    gate = threading.Event()
+
+    async def scenario():
+        running = asyncio.ensure_future(executor.run(gate.wait))
+        await _wait_until(lambda: executor.stats()["running"] == 1)
+        queued = asyncio.ensure_future(executor.run(lambda: "late"))
+        await _wait_until(lambda: executor.stats()["queue_length"] == 1)
+
+        # انقطاع العميل أثناء انتظار الطلب في الطابور
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+        gate.set()
+        await running
+        await _wait_until(lambda: executor.stats()["running"] == 0)
+        assert await executor.run(lambda: "next") == "next"
+
+    asyncio.run(scenario())
+    stats = executor.stats()
+    assert executor.admission.waiting == 0
+    assert stats["queue_length"] == 0 and stats["running"] == 0
+    assert stats["admitted"] == 3 and stats["completed"] == 2
+
+
+def test_cancelled_micro_batch_entry_releases_its_slot():
+    admission = Admission(max_queue=4, deadline_ms=0)
+    gate = threading.Event()
+
+    def predict(items):
+        gate.wait()
+        return list(items)
+
+    batcher = MicroBatcher(predict, max_batch_size=1, max_wait_ms=0, admission=admission)
+
+    async def scenario():
+        first = asyncio.ensure_future(batcher.submit("a"))
+        await _wait_until(lambda: admission.running == 1)
+        queued = asyncio.ensure_future(batcher.submit("b"))
+        await _wait_until(lambda: admission.waiting == 1)
+
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+        gate.set()
+        assert await first == "a"
+        assert await batcher.submit("c") == "c"
+
+    asyncio.run(scenario())
+    assert admission.waiting == 0 and admission.running == 0
+    assert admission.completed == 2
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from sklearn.dummy import DummyClassifier
+from sklearn.ensemble import (ExtraTreesClassifier, GradientBoostingClassifier, RandomForestClassifier,
+                              VotingClassifier)
+from sklearn.neural_network import MLPClassifier
+from xgboost import XGBClassifier
+
+from tree_export import DEFAULT_TOLERANCE, export_classifier, load_ensemble, save_ensemble
+
+
+@pytest.fixture(scope="module")
+def data():
+    rng = np.random.default_rng(3)
+    X = rng.normal(size=(1500, 8))
+    y = (X[:, 0] + 0.5 * X[:, 1] ** 2 - X[:, 2] * X[:, 3] > 0.4).astype(int) + (X[:, 4] > 0.8)
+    return X, y
+
+
+def _members():
+    return [
+        ('rf', RandomForestClassifier(n_estimators=20, max_depth=6, random_state=0)),
+        ('et', ExtraTreesClassifier(n_estimators=20, max_depth=6, random_state=0)),
+        ('gb', GradientBoostingClassifier(n_estimators=30, max_depth=3, random_state=0)),
+        ('xgb', XGBClassifier(n_estimators=30, max_depth=3, random_state=0)),
+        ('mlp', MLPClassifier(hidden_layer_sizes=(16,), max_iter=300, random_state=0)),
+    ]
+
+
+def _assert_matches(classifier, X):
+    ensemble = export_classifier(classifier)
+    expected = classifier.predict_proba(X)
+    assert np.array_equal(ensemble.classes_, classifier.classes_)
+    assert np.max(np.abs(ensemble.predict_proba(X) - expected)) <= DEFAULT_TOLERANCE
+    assert np.array_equal(ensemble.predict(X), classifier.classes_[expected.argmax(axis=1)])
+    return ensemble
+
+
+@pytest.mark.parametrize("name", [name for name, _ in _members()])
+def test_single_classifier_matches_predict_proba(data, name):
+    X, y = data
+    classifier = dict(_members())[name].fit(X, y)
+    _assert_matches(classifier, X)
+
+
+@pytest.mark.parametrize("init", [None, 'zero', DummyClassifier(strategy='uniform')])
+@pytest.mark.parametrize("binary", [False, True])
+def test_gradient_boosting_init(data, init, binary):
+    X, y = data
+    y = (y > 0).astype(int) if binary else y
+    classifier = GradientBoostingClassifier(n_estimators=20, max_depth=3, init=init, random_state=0).fit(X, y)
+    _assert_matches(classifier, X)
+
+
+def test_voting_weights_skip_dropped_members(data, tmp_path):
+    X, y = data
+    members = _members()
+    members[1] = ('et', 'drop')
+    voting = VotingClassifier(members, voting='soft', weights=[1, 5, 2, 3, 0.5]).fit(X, y)
+    ensemble = _assert_matches(voting, X)
+    assert ensemble.weights.tolist() == [1, 2, 3, 0.5]
+
+    path = str(tmp_path / "trees.npz")
+    save_ensemble(ensemble, path)
+    assert np.array_equal(load_ensemble(path).predict_proba(X), ensemble.predict_proba(X))
@@ -5,67 +5,52 @@ from sklearn.ensemble import RandomForestClassifier
 from sklearn.preprocessing import StandardScaler, LabelEncoder
 from sklearn.pipeline import Pipeline
 from sklearn.metrics import classification_report, accuracy_score
-import joblib
 import os
+from mimic_ingest import ingest_mimic, DEFAULT_CHUNK_SIZE
+from dataset_cache import read_checksums
+from model_bundle import save_bundle, frame_sha256, DEFAULT_BUNDLE
 
 # Path to the MIMIC-III dataset
 # Note: User needs to download this dataset from Kaggle: 
 # https://www.kaggle.com/datasets/asjad99/mimiciii
 
-def load_and_preprocess_data(data_path):
-    # Load prescriptions data
-    prescriptions = pd.read_csv(os.path.join(data_path, 'PRESCRIPTIONS.csv'))
-    
-    # Load patients data
-    patients = pd.read_csv(os.path.join(data_path, 'PATIENTS.csv'))
-    
-    # Load admissions data
-    admissions = pd.read_csv(os.path.join(data_path, 'ADMISSIONS.csv'))
-    
-    # Merge datasets
-    df = prescriptions.merge(patients, on='SUBJECT_ID', how='left')
-    df = df.merge(admissions, on=['SUBJECT_ID', 'HADM_ID'], how='left')
-    
-    # Select relevant features
-    features = df[['SUBJECT_ID', 'HADM_ID', 'DRUG', 'DOSE_VAL_RX', 'DOSE_UNIT_RX', 
-                  'ROUTE', 'GENDER', 'AGE', 'ADMISSION_TYPE', 'DIAGNOSIS']]
-    
-    # Clean up data
-    features = features.dropna()
-    
-    # Convert age to numeric
-    features['AGE'] = pd.to_numeric(features['AGE'], errors='coerce')
-    features = features.dropna(subset=['AGE'])
+def label_encoder(values):
+    """LabelEncoder from a categorical column without refitting on millions of strings.
+
+    Returns the encoder and the codes it would produce (classes_ sorted like fit()).
+    """
+    values = values.cat.remove_unused_categories()
+    values = values.cat.reorder_categories(sorted(values.cat.categories))
+    encoder = LabelEncoder()
+    encoder.classes_ = np.asarray(values.cat.categories, dtype=object)
+    return encoder, values.cat.codes.to_numpy()
+
+def load_and_preprocess_data(data_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    # Stream PRESCRIPTIONS in chunks and join PATIENTS/ADMISSIONS through a hash index
+    # (only the needed columns, compact dtypes, rows with missing values already dropped)
+    features, drug_aliases, stats = ingest_mimic(data_path, chunk_size)
     
     # Create categorical features
-    le_drug = LabelEncoder()
-    le_route = LabelEncoder()
-    le_gender = LabelEncoder()
-    le_admission = LabelEncoder()
-    
-    features['DRUG_CODE'] = le_drug.fit_transform(features['DRUG'])
-    features['ROUTE_CODE'] = le_route.fit_transform(features['ROUTE'])
-    features['GENDER_CODE'] = le_gender.fit_transform(features['GENDER'])
-    features['ADMISSION_CODE'] = le_admission.fit_transform(features['ADMISSION_TYPE'])
+    le_drug, drug_codes = label_encoder(features['DRUG'])
+    le_route, route_codes = label_encoder(features['ROUTE'])
+    le_gender, gender_codes = label_encoder(features['GENDER'])
+    le_admission, admission_codes = label_encoder(features['ADMISSION_TYPE'])
     
     # Create dosage classes based on percentiles
     dosage_thresholds = features['DOSE_VAL_RX'].quantile([0.25, 0.5, 0.75]).values
     
-    def classify_dosage(val):
-        if val <= dosage_thresholds[0]:
-            return 0  # Low dose
-        elif val <= dosage_thresholds[1]:
-            return 1  # Medium-low dose
-        elif val <= dosage_thresholds[2]:
-            return 2  # Medium-high dose
-        else:
-            return 3  # High dose
-    
-    features['DOSAGE_CLASS'] = features['DOSE_VAL_RX'].apply(classify_dosage)
+    # 0 = low, 1 = medium-low, 2 = medium-high, 3 = high (value <= threshold falls in the lower class)
+    dosage_class = np.searchsorted(dosage_thresholds, features['DOSE_VAL_RX'].to_numpy(), side='left')
     
     # Select final features for training
-    X = features[['AGE', 'DRUG_CODE', 'ROUTE_CODE', 'GENDER_CODE', 'ADMISSION_CODE']]
-    y = features['DOSAGE_CLASS']
+    X = pd.DataFrame({
+        'AGE': features['AGE'].to_numpy(),
+        'DRUG_CODE': drug_codes,
+        'ROUTE_CODE': route_codes,
+        'GENDER_CODE': gender_codes,
+        'ADMISSION_CODE': admission_codes,
+    })
+    y = pd.Series(dosage_class, name='DOSAGE_CLASS')
     
     # Store encoders for later use
     encoders = {
@@ -73,7 +58,8 @@ def load_and_preprocess_data(data_path):
         'route': le_route,
         'gender': le_gender,
         'admission': le_admission,
-        'dosage_thresholds': dosage_thresholds
+        'dosage_thresholds': dosage_thresholds,
+        'drug_aliases': drug_aliases
     }
     
     return X, y, encoders
@@ -109,11 +95,17 @@ def main():
         X, y, encoders = load_and_preprocess_data(data_path)
         model = train_model(X, y)
         
-        # Save the model and encoders
-        joblib.dump(model, 'E:\k\ml_service\dosage_model.pkl')
-        joblib.dump(encoders, 'encoders.pkl')
+        # Save the model and encoders as one bundle next to this script,
+        # recording which data it was trained on
+        training_data = {
+            'source': os.path.abspath(data_path),
+            'rows': len(X),
+            'sha256': frame_sha256(X.assign(DOSAGE_CLASS=y.to_numpy())),
+            'files': read_checksums(data_path),
+        }
+        manifest = save_bundle(DEFAULT_BUNDLE, model, encoders, training_data)
         
-        print("Model and encoders saved successfully!")
+        print(f"Model and encoders saved successfully! (bundle {manifest['version']} in {DEFAULT_BUNDLE})")
     except Exception as e:
         print(f"Error during training: {str(e)}")
 
@@ -0,0 +1,168 @@
+import os
+import time
+from collections import OrderedDict
+
+import numpy as np
+from joblib import Parallel, delayed, parallel_backend
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier, VotingClassifier
+from sklearn.metrics import accuracy_score
+from sklearn.neural_network import MLPClassifier
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import LabelEncoder, OneHotEncoder, StandardScaler
+from sklearn.utils import Bunch
+
+from model_files import limit_estimator_threads
+from feature_engineering import with_engineered_features
+
+# تدريب النماذج المرشحة المستقلة بالتوازي ثم بناء نموذج التصويت منها مباشرة
+# بدل أن يعيد VotingClassifier.fit تدريب نسخ جديدة من كل عضو
+
+NUMERIC_FEATURES = ['age', 'weight', 'route_risk', 'diagnosis_risk', 'risk_interaction', 'bmi']
+CATEGORICAL_FEATURES = ['drug', 'route', 'gender', 'admission_type', 'diagnosis', 'age_group', 'weight_group']
+
+
+def build_preprocessor():
+    """المعالجة المسبقة للنموذج المتقدم: الأعمدة المشتقة ثم تقييس الأعمدة الرقمية و one-hot للفئوية
+
+    المدخلات أعمدة المريض فقط (BASE_FEATURES)؛ الأعمدة المشتقة تُحسب داخل النموذج المحفوظ
+    """
+    numeric_transformer = Pipeline(steps=[
+        ('scaler', StandardScaler())
+    ])
+    categorical_transformer = Pipeline(steps=[
+        ('onehot', OneHotEncoder(handle_unknown='ignore', sparse_output=False))
+    ])
+    return with_engineered_features(ColumnTransformer(
+        transformers=[
+            ('num', numeric_transformer, NUMERIC_FEATURES),
+            ('cat', categorical_transformer, CATEGORICAL_FEATURES)
+        ]))
+
+
+def default_candidates():
+    """النماذج المرشحة للأنسامبل بمعاملاتها الافتراضية (model_tuning يضبطها عند الطلب)"""
+    import xgboost as xgb
+
+    return OrderedDict([
+        ('Random Forest', RandomForestClassifier(
+            n_estimators=200,
+            max_depth=30,
+            min_samples_split=5,
+            min_samples_leaf=2,
+            class_weight='balanced',
+            random_state=42,
+            n_jobs=-1
+        )),
+        ('Gradient Boosting', GradientBoostingClassifier(
+            n_estimators=200,
+            learning_rate=0.05,
+            max_depth=7,
+            min_samples_split=5,
+            min_samples_leaf=2,
+            random_state=42
+        )),
+        ('XGBoost', xgb.XGBClassifier(
+            n_estimators=200,
+            learning_rate=0.05,
+            max_depth=7,
+            gamma=0.1,
+            reg_alpha=0.1,
+            reg_lambda=1,
+            random_state=42,
+            n_jobs=-1,
+            use_label_encoder=False,
+            eval_metric='mlogloss'
+        )),
+        ('Neural Network', MLPClassifier(
+            hidden_layer_sizes=(200, 100, 50),
+            activation='relu',
+            solver='adam',
+            alpha=0.0001,
+            batch_size='auto',
+            learning_rate='adaptive',
+            max_iter=200,
+            early_stopping=True,
+            random_state=42
+        )),
+    ])
+
+
+def plan_workers(n_jobs, workers=None, threads_per_job=None):
+    """(عدد العمليات، عدد الخيوط لكل مهمة) بحيث لا يتجاوز المجموع عدد الأنوية"""
+    cores = os.cpu_count() or 1
+    workers = max(1, min(n_jobs, workers or cores))
+    threads = threads_per_job or max(1, cores // workers)
+    return workers, threads
+
+
+def _fit_one(name, estimator, X, y, threads):
+    # حد الأنوية للتدريب فقط؛ النموذج المحفوظ يحتفظ بـ n_jobs الأصلي
+    original = {key: value for key, value in estimator.get_params().items()
+                if key == 'n_jobs' or key.endswith('__n_jobs')}
+    limit_estimator_threads(estimator, threads)
+    start = time.perf_counter()
+    estimator.fit(X, y)
+    seconds = time.perf_counter() - start
+    estimator.set_params(**original)
+    return name, estimator, seconds
+
+
+def fit_candidates(candidates, X, y, workers=None, threads_per_job=None):
+    """تدريب {الاسم: المقدّر} في مجمع عمليات (loky)؛ يعيد {الاسم: (المقدّر المدرَّب، ثواني التدريب)}
+
+    inner_max_num_threads يحدّ OpenMP/BLAS داخل كل عملية، و n_jobs للمقدّرات يُضبط
+    على نفس الميزانية حتى لا تتنافس العمليات على الأنوية
+    """
+    workers, threads = plan_workers(len(candidates), workers, threads_per_job)
+    print(f"Fitting {len(candidates)} candidates: {workers} worker(s) x {threads} thread(s)")
+    if workers == 1:
+        # بدون مجمع: لا داعي لنسخ البيانات والنماذج بين العمليات
+        results = [_fit_one(name, estimator, X, y, threads) for name, estimator in candidates.items()]
+    else:
+        with parallel_backend('loky', inner_max_num_threads=threads):
+            results = Parallel(n_jobs=workers)(
+                delayed(_fit_one)(name, estimator, X, y, threads) for name, estimator in candidates.items()
+            )
+    return OrderedDict((name, (estimator, seconds)) for name, estimator, seconds in results)
+
+
+def assemble_voting(members, y, weights=None):
+    """VotingClassifier (soft) من أعضاء مدرَّبين مسبقاً، مطابق لنتيجة fit على نفس البيانات
+
+    التصويت الناعم يجمع predict_proba لكل عضو، وأعمدتها مرتبة حسب classes_ مثل le_
+    (التصويت الصلب يحتاج أعضاء مدرَّبين على الفئات المرمَّزة فلا يُدعم هنا)
+    """
+    ensemble = VotingClassifier(estimators=list(members.items()), voting='soft', weights=weights)
+    ensemble.le_ = LabelEncoder().fit(y)
+    ensemble.classes_ = ensemble.le_.classes_
+    for name, estimator in members.items():
+        if not np.array_equal(estimator.classes_, ensemble.classes_):
+            raise ValueError(f"{name} was fitted on classes {estimator.classes_}, expected {ensemble.classes_}")
+    ensemble.estimators_ = list(members.values())
+    ensemble.named_estimators_ = Bunch(**members)
+    for estimator in ensemble.estimators_:
+        if hasattr(estimator, 'feature_names_in_'):
+            ensemble.feature_names_in_ = estimator.feature_names_in_
+    return ensemble
+
+
+def evaluate(models, X_test, y_test):
+    """{الاسم: (التوقعات، الدقة، ثواني التوقع)} على بيانات اختبار محوَّلة مسبقاً"""
+    results = OrderedDict()
+    for name, model in models.items():
+        start = time.perf_counter()
+        y_pred = model.predict(X_test)
+        results[name] = (y_pred, accuracy_score(y_test, y_pred), time.perf_counter() - start)
+    return results
+
+
+def format_timing_table(fit_seconds, evaluation, total_seconds=None):
+    lines = [f"{'model':<22}{'fit_s':>10}{'predict_s':>11}{'accuracy':>10}"]
+    for name, (_, accuracy, predict_seconds) in evaluation.items():
+        fit = fit_seconds.get(name)
+        fit = f"{fit:>10.2f}" if fit is not None else f"{'-':>10}"
+        lines.append(f"{name:<22}{fit}{predict_seconds:>11.3f}{accuracy:>10.4f}")
+    if total_seconds is not None:
+        lines.append(f"{'total (wall clock)':<22}{total_seconds:>10.2f}")
+    return "\n".join(lines)
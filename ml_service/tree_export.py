@@ -0,0 +1,446 @@
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from featurizer import unwrap_pipeline
+
+# تصدير أشجار النموذج المدرب إلى مصفوفات متصلة وتقييمها مباشرة بـ NumPy
+# (الغابة العشوائية، GradientBoosting، XGBoost، الشبكة العصبية، وأعضاء VotingClassifier)
+# دون المرور بآلية التوقع العامة في sklearn/xgboost
+
+EXPORT_FORMAT_VERSION = 1
+DEFAULT_TOLERANCE = 1e-5
+
+
+class NotExportableError(ValueError):
+    """المصنف أو أحد أعضائه لا يمكن تحويله إلى مصفوفات"""
+
+
+def floor_float32(values):
+    """أكبر قيمة float32 لا تتجاوز العتبة
+
+    sklearn يقارن X بصيغة float32 مع عتبة float64؛ التقريب للأسفل يحافظ
+    على نفس نتيجة المقارنة x <= t لكل x من نوع float32
+    """
+    values = np.asarray(values, dtype=np.float64)
+    rounded = values.astype(np.float32)
+    over = rounded.astype(np.float64) > values
+    rounded[over] = np.nextafter(rounded[over], np.float32(-np.inf))
+    return rounded
+
+
+class FlatTrees:
+    """مجموعة أشجار مخزنة في مصفوفات متصلة (فهرس الميزة، العتبة، الأبناء، قيم الأوراق)
+
+    output:
+        'mean'    متوسط احتمالات الأوراق (الغابة العشوائية)
+        'softmax' مجموع درجات الأشجار لكل فئة ثم softmax (التعزيز متعدد الفئات)
+        'sigmoid' درجة واحدة ثم دالة لوجستية (التعزيز الثنائي)
+    """
+
+    kind = 'trees'
+
+    def __init__(self, feature, threshold, left, right, value, roots, tree_class, depth, output, init):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.tree_class = tree_class
+        self.depth = int(depth)
+        self.output = output
+        self.init = init
+        self._class_masks = [tree_class == k for k in range(len(init))] if output != 'mean' else None
+
+    @classmethod
+    def build(cls, trees, output, init=None):
+        """trees: قائمة (feature, threshold, left, right, value, depth, tree_class)
+
+        left/right محلية لكل شجرة و -1 تعني ورقة؛ العتبات بصيغة x <= threshold
+        """
+        features, thresholds, lefts, rights, values, roots, classes = [], [], [], [], [], [], []
+        n_nodes = 0
+        depth = 0
+        for feature, threshold, left, right, value, tree_depth, tree_class in trees:
+            left = np.asarray(left)
+            right = np.asarray(right)
+            is_leaf = left < 0
+            own = np.arange(len(left)) + n_nodes
+            # الأوراق تشير إلى نفسها حتى تبقى ثابتة أثناء التكرار
+            features.append(np.where(is_leaf, 0, feature).astype(np.int32))
+            thresholds.append(np.where(is_leaf, np.float32(0), threshold).astype(np.float32))
+            lefts.append(np.where(is_leaf, own, left + n_nodes).astype(np.int32))
+            rights.append(np.where(is_leaf, own, right + n_nodes).astype(np.int32))
+            values.append(np.asarray(value, dtype=np.float32).reshape(len(left), -1))
+            roots.append(n_nodes)
+            classes.append(tree_class)
+            n_nodes += len(left)
+            depth = max(depth, int(tree_depth))
+        if not roots:
+            raise NotExportableError("Ensemble has no trees")
+        return cls(
+            np.concatenate(features), np.concatenate(thresholds),
+            np.concatenate(lefts), np.concatenate(rights), np.concatenate(values),
+            np.array(roots, dtype=np.int32), np.array(classes, dtype=np.int32),
+            depth, output, np.zeros(1) if init is None else np.asarray(init, dtype=np.float64)
+        )
+
+    def leaf_values(self, X32):
+        """تمرير كل الصفوف عبر كل الأشجار معاً؛ يعيد (n_samples, n_trees, n_outputs)"""
+        n_samples = X32.shape[0]
+        node = np.repeat(self.roots[np.newaxis, :], n_samples, axis=0)
+        rows = np.arange(n_samples)[:, np.newaxis]
+        for _ in range(self.depth):
+            go_left = X32[rows, self.feature[node]] <= self.threshold[node]
+            node = np.where(go_left, self.left[node], self.right[node])
+        return self.value[node]
+
+    def predict_proba(self, X, X32):
+        values = self.leaf_values(X32)
+        if self.output == 'mean':
+            return values.sum(axis=1, dtype=np.float64) / len(self.roots)
+
+        scores = values[:, :, 0].astype(np.float64)
+        raw = np.tile(self.init, (X.shape[0], 1))
+        for k, mask in enumerate(self._class_masks):
+            raw[:, k] += scores[:, mask].sum(axis=1)
+        if self.output == 'sigmoid':
+            positive = 1.0 / (1.0 + np.exp(-raw[:, 0]))
+            return np.column_stack([1.0 - positive, positive])
+        raw -= raw.max(axis=1, keepdims=True)
+        np.exp(raw, out=raw)
+        raw /= raw.sum(axis=1, keepdims=True)
+        return raw
+
+    def arrays(self, prefix):
+        return {
+            f'{prefix}feature': self.feature, f'{prefix}threshold': self.threshold,
+            f'{prefix}left': self.left, f'{prefix}right': self.right,
+            f'{prefix}value': self.value, f'{prefix}roots': self.roots,
+            f'{prefix}tree_class': self.tree_class, f'{prefix}init': self.init,
+        }
+
+    def meta(self):
+        return {'kind': self.kind, 'output': self.output, 'depth': self.depth}
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix, meta):
+        return cls(
+            arrays[f'{prefix}feature'], arrays[f'{prefix}threshold'],
+            arrays[f'{prefix}left'], arrays[f'{prefix}right'], arrays[f'{prefix}value'],
+            arrays[f'{prefix}roots'], arrays[f'{prefix}tree_class'], meta['depth'],
+            meta['output'], arrays[f'{prefix}init']
+        )
+
+
+class FlatMLP:
+    """شبكة MLPClassifier كأوزان NumPy (تمرير أمامي فقط)"""
+
+    kind = 'mlp'
+    _activations = {
+        'relu': lambda x: np.maximum(x, 0, out=x),
+        'tanh': lambda x: np.tanh(x, out=x),
+        'logistic': lambda x: np.divide(1.0, 1.0 + np.exp(-x), out=x),
+        'identity': lambda x: x,
+    }
+
+    def __init__(self, coefs, intercepts, activation, out_activation):
+        if activation not in self._activations or out_activation not in ('softmax', 'logistic'):
+            raise NotExportableError(f"Unsupported MLP activations: {activation}/{out_activation}")
+        self.coefs = coefs
+        self.intercepts = intercepts
+        self.activation = activation
+        self.out_activation = out_activation
+
+    def predict_proba(self, X, X32):
+        hidden = self._activations[self.activation]
+        a = X
+        last = len(self.coefs) - 1
+        for i, (coef, intercept) in enumerate(zip(self.coefs, self.intercepts)):
+            a = a @ coef
+            a += intercept
+            if i < last:
+                a = hidden(a)
+        if self.out_activation == 'logistic':
+            positive = 1.0 / (1.0 + np.exp(-a[:, 0]))
+            return np.column_stack([1.0 - positive, positive])
+        a -= a.max(axis=1, keepdims=True)
+        np.exp(a, out=a)
+        a /= a.sum(axis=1, keepdims=True)
+        return a
+
+    def arrays(self, prefix):
+        arrays = {}
+        for i, (coef, intercept) in enumerate(zip(self.coefs, self.intercepts)):
+            arrays[f'{prefix}coef_{i}'] = coef
+            arrays[f'{prefix}intercept_{i}'] = intercept
+        return arrays
+
+    def meta(self):
+        return {'kind': self.kind, 'layers': len(self.coefs),
+                'activation': self.activation, 'out_activation': self.out_activation}
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix, meta):
+        coefs = [arrays[f'{prefix}coef_{i}'] for i in range(meta['layers'])]
+        intercepts = [arrays[f'{prefix}intercept_{i}'] for i in range(meta['layers'])]
+        return cls(coefs, intercepts, meta['activation'], meta['out_activation'])
+
+
+class FlatEnsemble:
+    """المصنف الكامل: متوسط موزون لاحتمالات الأعضاء (تصويت ناعم) أو عضو واحد"""
+
+    def __init__(self, classes, members, weights):
+        self.classes_ = np.asarray(classes)
+        self.members = members
+        self.weights = np.asarray(weights, dtype=np.float64)
+
+    def predict_proba(self, X):
+        # مخرجات ColumnTransformer قد تكون sparse عند استخدامه داخل Pipeline
+        X = np.asarray(X.toarray() if hasattr(X, 'toarray') else X, dtype=np.float64)
+        # نفس تحويل sklearn/xgboost قبل مقارنة العتبات
+        X32 = X.astype(np.float32)
+        if len(self.members) == 1:
+            return self.members[0].predict_proba(X, X32)
+        total = None
+        for member, weight in zip(self.members, self.weights):
+            proba = member.predict_proba(X, X32) * weight
+            total = proba if total is None else total + proba
+        return total / self.weights.sum()
+
+    def predict(self, X):
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+    def nbytes(self):
+        return sum(a.nbytes for member in self.members for a in member.arrays('').values())
+
+
+# ---------------------------------------------------------------- التصدير
+
+def _export_sklearn_tree(tree, value, tree_class=-1):
+    return (tree.feature, floor_float32(tree.threshold), tree.children_left,
+            tree.children_right, value, tree.max_depth, tree_class)
+
+
+def _export_forest(forest):
+    trees = []
+    for estimator in forest.estimators_:
+        tree = estimator.tree_
+        counts = tree.value[:, 0, :].astype(np.float64)
+        normalizer = counts.sum(axis=1, keepdims=True)
+        normalizer[normalizer == 0.0] = 1.0
+        trees.append(_export_sklearn_tree(tree, counts / normalizer))
+    return FlatTrees.build(trees, 'mean')
+
+
+def _export_gradient_boosting(model):
+    n_classes = model.estimators_.shape[1]
+    trees = []
+    for stage in model.estimators_:
+        for k, estimator in enumerate(stage):
+            tree = estimator.tree_
+            trees.append(_export_sklearn_tree(tree, tree.value[:, 0, :1] * model.learning_rate, k))
+    return FlatTrees.build(trees, 'sigmoid' if n_classes == 1 else 'softmax', _gradient_boosting_init(model))
+
+
+def _gradient_boosting_init(model):
+    """التنبؤ الابتدائي من model.init_ بنفس تحويل sklearn (log للفئات المتعددة، log-odds للثنائي)
+
+    المقدّر الافتراضي (DummyClassifier بالتوزيع المسبق) لا يعتمد على X فيكفي صف واحد
+    """
+    n_classes = model.estimators_.shape[1]
+    if isinstance(model.init_, str) and model.init_ == 'zero':
+        return np.zeros(n_classes)
+    proba = model.init_.predict_proba(np.zeros((1, model.n_features_in_)))[0]
+    eps = np.finfo(np.float32).eps
+    if n_classes == 1:
+        positive = np.clip(proba[1], eps, 1 - eps)
+        return np.array([np.log(positive / (1 - positive))], dtype=np.float64)
+    return np.log(np.clip(proba, eps, 1 - eps)).astype(np.float64)
+
+
+def _tree_depth(left, right):
+    depth = np.zeros(len(left), dtype=np.int64)
+    stack = [0]
+    while stack:
+        node = stack.pop()
+        for child in (left[node], right[node]):
+            if child >= 0:
+                depth[child] = depth[node] + 1
+                stack.append(child)
+    return int(depth.max())
+
+
+def _export_xgboost(model):
+    booster = model.get_booster()
+    learner = json.loads(bytes(booster.save_raw(raw_format='json')).decode('utf-8'))['learner']
+    if learner['gradient_booster']['name'] != 'gbtree':
+        raise NotExportableError(f"Unsupported XGBoost booster: {learner['gradient_booster']['name']}")
+    objective = learner['objective']['name']
+    params = learner['learner_model_param']
+    gbtree = learner['gradient_booster']['model']
+
+    if objective in ('multi:softprob', 'multi:softmax'):
+        # base_score يضاف لكل الفئات بالتساوي فلا يؤثر على softmax
+        output, init = 'softmax', np.zeros(int(params['num_class']))
+    elif objective == 'binary:logistic':
+        base_score = float(params['base_score'])
+        output, init = 'sigmoid', np.array([np.log(base_score / (1.0 - base_score))])
+    else:
+        raise NotExportableError(f"Unsupported XGBoost objective: {objective}")
+
+    trees = []
+    for tree, tree_class in zip(gbtree['trees'], gbtree['tree_info']):
+        left = np.array(tree['left_children'], dtype=np.int64)
+        right = np.array(tree['right_children'], dtype=np.int64)
+        conditions = np.array(tree['split_conditions'], dtype=np.float32)
+        # XGBoost يذهب يساراً عندما x < split؛ لقيم float32 هذا يكافئ x <= القيمة السابقة
+        threshold = np.nextafter(conditions, np.float32(-np.inf))
+        # قيمة الورقة مخزنة في split_conditions للعقد الطرفية
+        trees.append((np.array(tree['split_indices']), threshold, left, right,
+                      conditions.reshape(-1, 1), _tree_depth(left, right), tree_class))
+    return FlatTrees.build(trees, output, init)
+
+
+def _export_mlp(model):
+    return FlatMLP([np.asarray(c, dtype=np.float64) for c in model.coefs_],
+                   [np.asarray(b, dtype=np.float64) for b in model.intercepts_],
+                   model.activation, model.out_activation_)
+
+
+_EXPORTERS = {
+    'RandomForestClassifier': _export_forest,
+    'ExtraTreesClassifier': _export_forest,
+    'GradientBoostingClassifier': _export_gradient_boosting,
+    'XGBClassifier': _export_xgboost,
+    'MLPClassifier': _export_mlp,
+}
+
+
+def export_classifier(classifier):
+    """تحويل المصنف المدرب (أو VotingClassifier بتصويت ناعم) إلى FlatEnsemble"""
+    name = type(classifier).__name__
+    if name == 'VotingClassifier':
+        if classifier.voting != 'soft':
+            raise NotExportableError("Only soft voting can be exported")
+        members = [export_classifier(member).members[0] for member in classifier.estimators_]
+        # أوزان الأعضاء غير المستبعدة ('drop') بترتيب estimators_
+        if classifier.weights is None:
+            weights = np.ones(len(members))
+        else:
+            weights = [w for (_, est), w in zip(classifier.estimators, classifier.weights) if est != 'drop']
+        return FlatEnsemble(classifier.classes_, members, weights)
+    if name not in _EXPORTERS:
+        raise NotExportableError(f"Unsupported classifier: {name}")
+    return FlatEnsemble(classifier.classes_, [_EXPORTERS[name](classifier)], [1.0])
+
+
+def export_pipeline(model):
+    """تصدير المصنف الأخير في Pipeline المحفوظ (مع فك GridSearchCV)"""
+    return export_classifier(unwrap_pipeline(model).steps[-1][1])
+
+
+def save_ensemble(ensemble, path):
+    """ملف .npz واحد، أو مجلد بملف .npy لكل مصفوفة (يمكن ربطه بالذاكرة mmap)"""
+    arrays = {'classes': ensemble.classes_, 'weights': ensemble.weights}
+    members = []
+    for i, member in enumerate(ensemble.members):
+        arrays.update(member.arrays(f'm{i}_'))
+        members.append(member.meta())
+    meta = {'format_version': EXPORT_FORMAT_VERSION, 'members': members}
+    if path.endswith('.npz'):
+        np.savez(path, meta=np.array(json.dumps(meta)), **arrays)
+        return
+    os.makedirs(path, exist_ok=True)
+    for key, values in arrays.items():
+        np.save(os.path.join(path, f'{key}.npy'), np.ascontiguousarray(values), allow_pickle=False)
+    with open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+
+
+def load_ensemble(path, mmap_mode='r'):
+    """mmap_mode يخص صيغة المجلد: المصفوفات تُقرأ من الملفات عند أول لمس وتتشاركها العمليات"""
+    if os.path.isdir(path):
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        arrays = {name[:-4]: np.load(os.path.join(path, name), mmap_mode=mmap_mode, allow_pickle=False)
+                  for name in os.listdir(path) if name.endswith('.npy')}
+    else:
+        with np.load(path, allow_pickle=False) as data:
+            arrays = {key: data[key] for key in data.files}
+        meta = json.loads(str(arrays['meta']))
+    if meta['format_version'] != EXPORT_FORMAT_VERSION:
+        raise NotExportableError(f"Unsupported export format {meta['format_version']}")
+    member_types = {FlatTrees.kind: FlatTrees, FlatMLP.kind: FlatMLP}
+    members = [
+        member_types[member['kind']].from_arrays(arrays, f'm{i}_', member)
+        for i, member in enumerate(meta['members'])
+    ]
+    return FlatEnsemble(arrays['classes'], members, arrays['weights'])
+
+
+def default_export_path(model_path):
+    return os.path.splitext(model_path)[0] + '_trees.npz'
+
+
+def attach_exported_ensemble(featurizer, path, tolerance=DEFAULT_TOLERANCE, verify_rows=256):
+    """تحميل الأشجار المصدّرة واستخدامها للتوقع إذا طابقت المصنف الأصلي ضمن التسامح"""
+    try:
+        ensemble = load_ensemble(path)
+    except Exception as e:
+        print(f"Tree evaluator disabled: {str(e)}")
+        return None
+    X = featurizer.transform(featurizer.sample_rows(verify_rows))
+    difference = float(np.max(np.abs(ensemble.predict_proba(X) - featurizer.classifier.predict_proba(X))))
+    if difference > tolerance or not np.array_equal(ensemble.classes_, featurizer.classes_):
+        print(f"Tree evaluator disabled: differs from classifier (max diff {difference})")
+        return None
+    featurizer.use_scorer(ensemble)
+    print(f"Tree evaluator loaded from {path} (max diff {difference:.2e})")
+    return ensemble
+
+
+def _latency_ms(predict, rows, repeats=1):
+    timings = []
+    for _ in range(repeats):
+        for row in rows:
+            start = time.perf_counter()
+            predict(row)
+            timings.append((time.perf_counter() - start) * 1000)
+    return {'p50': float(np.percentile(timings, 50)), 'p99': float(np.percentile(timings, 99))}
+
+
+if __name__ == "__main__":
+    # خطوة التصدير: python tree_export.py [dosage_model.pkl] [dosage_model_trees.npz]
+    # (الحزمة تحمل أشجارها المصدّرة؛ تمريرها هنا يكتب نسخة خارجها للمقارنة)
+    from featurizer import CompiledFeaturizer
+    from model_bundle import load_model_files
+
+    source = load_model_files(sys.argv[1] if len(sys.argv) > 1 else None)
+    export_path = sys.argv[2] if len(sys.argv) > 2 else default_export_path(source.path)
+
+    pipeline = unwrap_pipeline(source.model)
+    ensemble = export_pipeline(pipeline)
+    save_ensemble(ensemble, export_path)
+    ensemble = load_ensemble(export_path)
+
+    featurizer = CompiledFeaturizer(pipeline)
+    X = featurizer.transform(featurizer.sample_rows(2000))
+    expected = featurizer.classifier.predict_proba(X)
+    difference = float(np.max(np.abs(ensemble.predict_proba(X) - expected)))
+    rows = [X[i:i + 1] for i in range(500)]
+    report = {
+        'export_path': export_path,
+        'members': [member.meta() for member in ensemble.members],
+        'resident_mb': ensemble.nbytes() / 1e6,
+        'max_difference': difference,
+        'label_agreement': float(np.mean(ensemble.predict(X) == featurizer.classes_[expected.argmax(axis=1)])),
+        'sklearn_latency_ms': _latency_ms(featurizer.classifier.predict_proba, rows),
+        'numpy_latency_ms': _latency_ms(ensemble.predict_proba, rows),
+    }
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if difference <= DEFAULT_TOLERANCE else 1)